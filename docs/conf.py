@@ -113,6 +113,9 @@ man_pages = [
     ('rasinfo',    'rasinfo',    'rasinfo utility',        _setup.__author__, 1),
     ('rasdump',    'rasdump',    'rasdump utility',        _setup.__author__, 1),
     ('rasextract', 'rasextract', 'rasextract utility',     _setup.__author__, 1),
+    ('raswatch',   'raswatch',   'raswatch utility',       _setup.__author__, 1),
+    ('rasserve',   'rasserve',   'rasserve utility',       _setup.__author__, 1),
+    ('rasqueue',   'rasqueue',   'rasqueue utility',       _setup.__author__, 1),
 ]
 
 #man_show_urls = False
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# vim: set et sw=4 sts=4:
+
+# Copyright 2012 Dave Hughes.
+#
+# This file is part of rastools.
+#
+# rastools is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# rastools is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# rastools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Generates the Encoder Performance table of rasextract.rst
+
+Each row extracts a synthetic 1000x1000 channel (with the hot colormap and
+axes) with the given options, and reports the size of the output and the best
+of several timings of the whole extraction.
+"""
+
+from __future__ import (
+    unicode_literals,
+    print_function,
+    absolute_import,
+    division,
+    )
+
+import os
+import time
+import shutil
+import logging
+import tempfile
+
+import numpy as np
+
+from rastools.rasextract import RasExtractUtility
+
+
+REPEAT = 5
+SIZE = 1000
+
+ROWS = [
+    ("(default, matplotlib's encoder)", [], 'png'),
+    ('``--png-encoder=pil``', ['--png-encoder=pil'], 'png'),
+    ('``--png-compression=0``', ['--png-compression=0'], 'png'),
+    ('``--png-compression=1``', ['--png-compression=1'], 'png'),
+    ('``--png-compression=3``', ['--png-compression=3'], 'png'),
+    ('``--png-compression=9``', ['--png-compression=9'], 'png'),
+    ('``--png-strategy=huffman``', ['--png-strategy=huffman'], 'png'),
+    ('``--png-strategy=rle``', ['--png-strategy=rle'], 'png'),
+    ('``--png-compression=1 --png-strategy=rle``',
+        ['--png-compression=1', '--png-strategy=rle'], 'png'),
+    ('JPEG (default, quality 75)', [], 'jpg'),
+    ('JPEG ``--jpeg-fast``', ['--jpeg-fast'], 'jpg'),
+    ('JPEG ``--jpeg-quality=95``', ['--jpeg-quality=95'], 'jpg'),
+    ('JPEG ``--jpeg-quality=95 --jpeg-fast``',
+        ['--jpeg-quality=95', '--jpeg-fast'], 'jpg'),
+    ]
+
+
+def make_channel(filename):
+    "Writes a channel of smooth features with counting noise to filename"
+    y, x = np.mgrid[0:SIZE, 0:SIZE] / SIZE
+    data = 5000 * (
+        np.sin(x * 7) * np.cos(y * 5) + 1 +
+        np.exp(-((x - 0.6) ** 2 + (y - 0.4) ** 2) * 40))
+    data = np.random.RandomState(0).poisson(data).astype(np.uint32)
+    np.save(filename, data)
+
+def time_row(path, data_file, options, ext):
+    "Returns the output size and the best time of extracting with options"
+    output = os.path.join(path, 'output.%s' % ext)
+    times = []
+    for i in range(REPEAT):
+        # A new instance for each run, as the utility keeps state
+        utility = RasExtractUtility()
+        start = time.time()
+        utility(['-q', '-C', 'hot', '-a', '-o', output] + options + [data_file])
+        times.append(time.time() - start)
+    return os.path.getsize(output), min(times)
+
+def main():
+    path = tempfile.mkdtemp()
+    try:
+        data_file = os.path.join(path, 'scan.npy')
+        make_channel(data_file)
+        results = [
+            (title, time_row(path, data_file, options, ext))
+            for (title, options, ext) in ROWS]
+    finally:
+        shutil.rmtree(path)
+    width = max(len(title) for (title, _) in results)
+    rule = '%s ======= ========' % ('=' * width)
+    print(rule)
+    print('%-*s Size    Time' % (width, 'Options'))
+    print(rule)
+    for title, (size, seconds) in results:
+        print('%-*s %-7s %s' % (
+            width, title, '%dKB' % (size // 1024), '%dms' % (seconds * 1000)))
+    print(rule)
+
+if __name__ == '__main__':
+    logging.disable(logging.WARNING)
+    main()
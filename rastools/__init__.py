@@ -64,6 +64,11 @@ __requires__ = [
 
 __extra_requires__ = {
     'XLS':        ['xlwt'],
+    'XLSX':       ['xlsxwriter'],
+    'HDF5':       ['h5py'],
+    'Arrow':      ['pyarrow'],
+    'ZSTD':       ['zstandard'],
+    'inotify':    ['inotify_simple'],
     'completion': ['optcomplete'],
     'GUI':        ['pyqt'],
     }
@@ -73,6 +78,9 @@ __entry_points__ = {
         'rasinfo = rastools.rasinfo:main',
         'rasextract = rastools.rasextract:main',
         'rasdump = rastools.rasdump:main',
+        'raswatch = rastools.raswatch:main',
+        'rasserve = rastools.rasserve:main',
+        'rasqueue = rastools.rasqueue:main',
         ],
     'gui_scripts': [
         'rasviewer = rastools.rasviewer:main',
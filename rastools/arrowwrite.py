@@ -0,0 +1,155 @@
+# vim: set et sw=4 sts=4:
+
+# Copyright 2012 Dave Hughes.
+#
+# This file is part of rastools.
+#
+# rastools is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# rastools is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# rastools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Apache Arrow IPC and Parquet (long format) writer module for rasdump"""
+
+from __future__ import (
+    unicode_literals,
+    print_function,
+    absolute_import,
+    division,
+    )
+
+import json
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from rastools.coords import axis_coords
+
+
+# The (approximate) number of rows in each record batch / row group; batches
+# always consist of whole rows of the scan
+BATCH_ROWS = 1048576
+
+PARQUET_COMPRESSION = 'snappy'
+
+
+def column_names(names):
+    "Returns names made unique, and distinct from the coordinate columns"
+    used = {'x', 'y'}
+    result = []
+    for name in names:
+        unique = name
+        suffix = 1
+        while unique in used:
+            suffix += 1
+            unique = '%s_%d' % (name, suffix)
+        used.add(unique)
+        result.append(unique)
+    return result
+
+
+class ArrowMultiWriter(object):
+    "Multi channel writer for Arrow IPC files"
+
+    def __init__(self, filename_or_obj, data_file):
+        self._file = filename_or_obj
+        self._data_file = data_file
+        self._names = []
+        self._pages = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, t, v, tb):
+        self.close()
+
+    def open_writer(self, schema):
+        "Returns a new writer for record batches with the specified schema"
+        return pa.ipc.new_file(self._file, schema)
+
+    def write_page(self, data, channel):
+        "Add the channel as a new column of the output"
+        # Each row of the output includes a value from every channel so nothing
+        # can be written until close(). Only a reference to each page is kept
+        # here (no copy); the conversion to Arrow happens a batch at a time
+        if self._pages and data.shape != self._pages[0].shape:
+            raise ValueError(
+                'Channel %d has shape %r which differs from the first '
+                'channel %r' % (channel.index, data.shape, self._pages[0].shape))
+        self._pages.append(data)
+        self._names.append(channel.name)
+
+    def close(self):
+        "Write all channels to the output in batches, and close the file"
+        y_size, x_size = self._pages[0].shape if self._pages else (0, 0)
+        x_coords = axis_coords(getattr(self._data_file, 'x_coords', None), x_size)
+        y_coords = axis_coords(getattr(self._data_file, 'y_coords', None), y_size)
+        schema = pa.schema(
+            [
+                pa.field('x', pa.from_numpy_dtype(x_coords.dtype)),
+                pa.field('y', pa.from_numpy_dtype(y_coords.dtype)),
+            ] + [
+                pa.field(name, pa.from_numpy_dtype(page.dtype))
+                for (name, page) in zip(
+                    column_names(self._names), self._pages)
+            ],
+            metadata={
+                'rastools': json.dumps(
+                    self._data_file.format_dict(), default=str),
+            })
+        writer = self.open_writer(schema)
+        try:
+            rows = max(1, BATCH_ROWS // max(1, x_size))
+            for y in range(0, y_size, rows):
+                # The coordinate columns are generated vectorized for each
+                # batch; the channel columns wrap each page's rows without a
+                # copy when the page is C-contiguous (i.e. hasn't been cropped)
+                y_slice = y_coords[y:y + rows]
+                columns = [
+                    pa.array(np.tile(x_coords, len(y_slice))),
+                    pa.array(np.repeat(y_slice, x_size)),
+                ] + [
+                    pa.array(page[y:y + rows].reshape(-1))
+                    for page in self._pages
+                ]
+                writer.write_batch(
+                    pa.RecordBatch.from_arrays(columns, schema=schema))
+        finally:
+            writer.close()
+
+class ParquetMultiWriter(ArrowMultiWriter):
+    "Multi channel writer for Parquet files"
+
+    def open_writer(self, schema):
+        "Returns a new writer for record batches with the specified schema"
+        # Each batch written becomes a row group of the Parquet file
+        return pq.ParquetWriter(
+            self._file, schema, compression=PARQUET_COMPRESSION)
+
+
+class ArrowWriter(object):
+    "Single channel writer for Arrow IPC files"
+
+    multi_class = ArrowMultiWriter
+
+    def __init__(self, filename_or_obj, channel):
+        self._writer = self.multi_class(filename_or_obj, channel.parent)
+        self._channel = channel
+
+    def write(self, data):
+        "Write the specified data to the output file"
+        with self._writer:
+            self._writer.write_page(data, self._channel)
+
+class ParquetWriter(ArrowWriter):
+    "Single channel writer for Parquet files"
+
+    multi_class = ParquetMultiWriter
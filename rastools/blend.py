@@ -0,0 +1,84 @@
+# vim: set et sw=4 sts=4:
+
+# Copyright 2012 Dave Hughes.
+#
+# This file is part of rastools.
+#
+# rastools is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# rastools is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# rastools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Blending of normalized channel layers into false-color composites"""
+
+from __future__ import (
+    unicode_literals,
+    print_function,
+    absolute_import,
+    division,
+    )
+
+import numpy as np
+
+
+# The colors assigned to layers which aren't given an explicit color. The first
+# three ensure the traditional red, green, blue composite is the default
+DEFAULT_LAYER_COLORS = [
+    (1.0, 0.0, 0.0),
+    (0.0, 1.0, 0.0),
+    (0.0, 0.0, 1.0),
+    (0.0, 1.0, 1.0),
+    (1.0, 0.0, 1.0),
+    (1.0, 1.0, 0.0),
+    (1.0, 0.5, 0.0),
+    (0.5, 0.0, 1.0),
+    ]
+
+BLEND_MODES = ['add', 'max']
+
+
+def default_layer_color(index):
+    "Returns the default color of the layer at index"
+    return DEFAULT_LAYER_COLORS[index % len(DEFAULT_LAYER_COLORS)]
+
+
+def blend_layers(data, colors, mode='add'):
+    """Blends normalized layers into a single RGB image.
+
+    The data parameter is a (y, x, n) array of layers normalized to values
+    between 0.0 and 1.0, and colors is a sequence of n (red, green, blue)
+    tuples. In "add" mode each pixel of the result is the sum of each layer's
+    value multiplied by the layer's color (calculated as a single matrix
+    product); in "max" mode it is the per-component maximum of those products.
+    The result is a (y, x, 3) float32 array clamped between 0.0 and 1.0.
+
+    Note that data is clamped in place to avoid copying it, and may be
+    returned as the result when no blending is required.
+    """
+    colors = np.asarray(colors, np.float32).reshape((-1, 3))
+    if data.shape[-1] != colors.shape[0]:
+        raise ValueError(
+            'Expected %d layer colors but found %d' % (
+                data.shape[-1], colors.shape[0]))
+    np.clip(data, 0.0, 1.0, out=data)
+    if mode == 'add':
+        if (colors.shape[0] == 3) and (colors == np.identity(3)).all():
+            # The traditional red, green, blue composite needs no blending
+            result = data
+        else:
+            result = np.dot(data, colors)
+    elif mode == 'max':
+        result = np.zeros(data.shape[:-1] + (3,), np.float32)
+        for index, color in enumerate(colors):
+            np.maximum(
+                result, data[..., index, np.newaxis] * color, out=result)
+    else:
+        raise ValueError('Unknown blend mode %s' % mode)
+    return np.clip(result, 0.0, 1.0, out=result)
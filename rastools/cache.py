@@ -0,0 +1,313 @@
+# vim: set et sw=4 sts=4:
+
+# Copyright 2012 Dave Hughes.
+#
+# This file is part of rastools.
+#
+# rastools is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# rastools is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# rastools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Size-bounded caches which discard their least recently used items"""
+
+from __future__ import (
+    unicode_literals,
+    print_function,
+    absolute_import,
+    division,
+    )
+
+import io
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+
+# The number of bytes at the start of a data file which OutputCache.fingerprint
+# hashes (enough to cover the header of every supported format)
+FINGERPRINT_SIZE = 65536
+
+
+class LRUCache(object):
+    """Thread-safe mapping which discards its least recently used items
+
+    The max_size parameter bounds the total size of the values held, as
+    measured by the sizeof callable (by default every value has size 1, so
+    max_size is the number of items). A value larger than max_size is never
+    cached. If on_evict is given, it is called with the key and value of each
+    item discarded to make room for another.
+    """
+
+    def __init__(self, max_size, sizeof=None, on_evict=None):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._sizeof = sizeof or (lambda value: 1)
+        self._on_evict = on_evict
+        self._items = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __getitem__(self, key):
+        with self._lock:
+            try:
+                # Re-insert the item to mark it as the most recently used
+                value, size = self._items.pop(key)
+            except KeyError:
+                self.misses += 1
+                raise
+            self._items[key] = (value, size)
+            self.hits += 1
+            return value
+
+    def __setitem__(self, key, value):
+        size = self._sizeof(value)
+        evicted = []
+        with self._lock:
+            try:
+                self.size -= self._items.pop(key)[1]
+            except KeyError:
+                pass
+            if size > self.max_size:
+                return
+            while self._items and self.size + size > self.max_size:
+                old_key, (old_value, old_size) = self._items.popitem(
+                    last=False)
+                self.size -= old_size
+                evicted.append((old_key, old_value))
+            self._items[key] = (value, size)
+            self.size += size
+        # Call on_evict outside the lock in case it uses this cache too
+        if self._on_evict:
+            for old_key, old_value in evicted:
+                self._on_evict(old_key, old_value)
+
+    def __delitem__(self, key):
+        with self._lock:
+            self.size -= self._items.pop(key)[1]
+
+    def get(self, key, default=None):
+        "Returns the value of key, or default if it isn't in the cache"
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def compute(self, key, factory):
+        """Returns the value of key, calling factory to create it if missing
+
+        If several threads want the same missing key at once, only the first
+        calls factory; the others wait for it to finish and use its result.
+        """
+        with self._lock:
+            try:
+                value, size = self._items.pop(key)
+            except KeyError:
+                event = self._pending.get(key)
+                if event is None:
+                    event = self._pending[key] = threading.Event()
+                    self.misses += 1
+                    owner = True
+                else:
+                    owner = False
+            else:
+                self._items[key] = (value, size)
+                self.hits += 1
+                return value
+        if not owner:
+            event.wait()
+            # If the first thread failed (or the value was too large to
+            # cache), the key is still missing and this thread tries in turn
+            return self.compute(key, factory)
+        try:
+            value = factory()
+            self[key] = value
+            return value
+        finally:
+            with self._lock:
+                del self._pending[key]
+            event.set()
+
+    def keys(self):
+        "Returns a list of the keys, least recently used first"
+        with self._lock:
+            return list(self._items)
+
+    def discard(self, predicate):
+        """Removes every item for whose key predicate returns True
+
+        Returns a list of the (key, value) pairs removed.
+        """
+        result = []
+        with self._lock:
+            for key in [key for key in self._items if predicate(key)]:
+                value, size = self._items.pop(key)
+                self.size -= size
+                result.append((key, value))
+        return result
+
+    def clear(self):
+        "Removes every item from the cache"
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+
+class OutputCache(object):
+    """Content-addressed cache of output files on disk
+
+    Output files are stored beneath path, named by a key which identifies
+    everything that determines their content (see key). When an output with
+    the same key is required again, fetch hard-links the cached copy into
+    place (copying it where links aren't possible) instead of generating it.
+    The total size of the cache is bounded by max_size bytes; when it's
+    exceeded, the least recently used entries (by modification time, which
+    fetch updates) are removed.
+
+    As outputs may be hard-linked to the cache, an existing output must be
+    passed to detach before it is overwritten, lest the cached copy be
+    modified too.
+    """
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self._size = None
+        self._lock = threading.Lock()
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    @staticmethod
+    def key(*parts):
+        "Returns the hex digest of parts (which must be JSON serializable)"
+        return hashlib.sha1(json.dumps(
+            parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def fingerprint(filename):
+        """Returns a digest identifying the content of filename
+
+        Rather than reading the whole file, this combines its size and
+        modification time with the hash of its header (the first
+        FINGERPRINT_SIZE bytes).
+        """
+        stat = os.stat(filename)
+        with io.open(filename, 'rb') as f:
+            header = hashlib.sha1(f.read(FINGERPRINT_SIZE)).hexdigest()
+        return '%d-%d-%s' % (stat.st_size, int(stat.st_mtime * 1000), header)
+
+    def entry(self, key):
+        "Returns the path of the cache entry for key"
+        return os.path.join(self.path, key[:2], key[2:])
+
+    def fetch(self, key, filename):
+        """Puts the cached output for key at filename, returning True
+
+        Returns False if there is no such output in the cache. If filename is
+        already the cached output, it's left alone.
+        """
+        entry = self.entry(key)
+        try:
+            # Mark the entry as recently used
+            os.utime(entry, None)
+        except OSError:
+            return False
+        try:
+            if os.path.samefile(entry, filename):
+                return True
+        except OSError:
+            pass
+        _link(entry, filename)
+        return True
+
+    def detach(self, filename):
+        "Removes filename if it's hard-linked (e.g. to a cache entry)"
+        try:
+            if os.stat(filename).st_nlink > 1:
+                os.unlink(filename)
+        except OSError:
+            pass
+
+    def store(self, key, filename):
+        "Adds the output filename to the cache as key"
+        entry = self.entry(key)
+        if not os.path.isdir(os.path.dirname(entry)):
+            try:
+                os.makedirs(os.path.dirname(entry))
+            except OSError:
+                # Another process may have created it
+                if not os.path.isdir(os.path.dirname(entry)):
+                    raise
+        _link(filename, entry)
+        size = os.stat(entry).st_size
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for (_, size, _) in self.entries())
+            else:
+                self._size += size
+            if self._size > self.max_size:
+                self.evict()
+
+    def entries(self):
+        "Returns (mtime, size, path) for every entry, oldest first"
+        result = []
+        for path, dirs, files in os.walk(self.path):
+            for name in files:
+                entry = os.path.join(path, name)
+                try:
+                    stat = os.stat(entry)
+                except OSError:
+                    continue
+                result.append((stat.st_mtime, stat.st_size, entry))
+        return sorted(result)
+
+    def evict(self):
+        "Removes the least recently used entries until the cache fits"
+        entries = self.entries()
+        self._size = sum(size for (_, size, _) in entries)
+        for _, size, entry in entries:
+            if self._size <= self.max_size:
+                break
+            logging.debug('Evicting %s from the output cache', entry)
+            try:
+                os.unlink(entry)
+            except OSError:
+                pass
+            self._size -= size
+
+
+def _link(source, target):
+    "Atomically replaces target with a hard-link to (or a copy of) source"
+    temp = '%s.%d.tmp' % (target, os.getpid())
+    try:
+        os.link(source, temp)
+    except (OSError, AttributeError):
+        # Different file-systems, or no hard-link support (e.g. on Windows
+        # with Py2); fall back to a copy
+        shutil.copyfile(source, temp)
+    try:
+        if os.name == 'nt' and os.path.exists(target):
+            os.unlink(target)
+        os.rename(temp, target)
+    except:
+        os.unlink(temp)
+        raise
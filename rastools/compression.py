@@ -0,0 +1,334 @@
+# vim: set et sw=4 sts=4:
+
+# Copyright 2012 Dave Hughes.
+#
+# This file is part of rastools.
+#
+# rastools is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# rastools is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# rastools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Transparent compression of output files and decompression of input files"""
+
+from __future__ import (
+    unicode_literals,
+    print_function,
+    absolute_import,
+    division,
+    )
+
+import io
+import gzip
+import bz2
+import threading
+try:
+    import queue
+except ImportError:
+    # XXX Py2 only
+    import Queue as queue
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+import numpy as np
+
+try:
+    string_types = (str, unicode)
+except NameError:
+    # XXX Py3 only
+    string_types = (str,)
+
+
+# Writes are gathered into chunks of CHUNK_SIZE bytes before being handed to
+# the compression thread; at most QUEUE_SIZE chunks are queued before writers
+# block (bounding memory use when compression is slower than formatting)
+CHUNK_SIZE = 1048576
+QUEUE_SIZE = 8
+
+# Every suffix recognized as a compressed file (whether or not the library
+# required to handle it is available)
+COMPRESSION_SUFFIXES = ('.gz', '.bz2', '.xz', '.zst')
+
+# Maps each available suffix to a function which opens a binary compressed
+# stream for writing
+COMPRESSORS = {
+    '.gz':  lambda filename: gzip.open(filename, 'wb', compresslevel=6),
+    '.bz2': lambda filename: bz2.BZ2File(filename, 'wb'),
+    }
+if lzma:
+    COMPRESSORS['.xz'] = lambda filename: lzma.open(filename, 'wb')
+if zstandard:
+    COMPRESSORS['.zst'] = lambda filename: zstandard.open(filename, 'wb')
+
+# Maps each available suffix to a function which wraps a binary file object
+# in a decompressing stream
+DECOMPRESSORS = {
+    '.gz':  lambda f: gzip.GzipFile(fileobj=f, mode='rb'),
+    '.bz2': lambda f: bz2.BZ2File(f, 'rb'),
+    }
+if lzma:
+    DECOMPRESSORS['.xz'] = lambda f: lzma.LZMAFile(f, 'rb')
+if zstandard:
+    DECOMPRESSORS['.zst'] = lambda f: zstandard.ZstdDecompressor().stream_reader(
+        f, read_across_frames=True)
+
+# The magic bytes which identify compressed files that lack a suffix
+COMPRESSION_MAGIC = (
+    (b'\x1f\x8b',             '.gz'),
+    (b'BZh',                  '.bz2'),
+    (b'\xfd7zXZ\x00',         '.xz'),
+    (b'\x28\xb5\x2f\xfd',     '.zst'),
+    )
+
+
+def compression_suffix(filename):
+    "Returns the compression suffix of filename, or '' if it has none"
+    if isinstance(filename, string_types):
+        lower = filename.lower()
+        for suffix in COMPRESSION_SUFFIXES:
+            if lower.endswith(suffix):
+                return suffix
+    return ''
+
+def strip_compression(filename):
+    "Returns filename without any compression suffix"
+    suffix = compression_suffix(filename)
+    return filename[:-len(suffix)] if suffix else filename
+
+def open_output(filename_or_obj, mode='w', **kwargs):
+    """Opens filename_or_obj for writing, compressing it if required
+
+    If filename_or_obj ends with one of the COMPRESSION_SUFFIXES, the result is
+    a stream which compresses everything written to it in a background thread
+    (wrapped in a TextIOWrapper unless mode includes "b"). Otherwise, this is
+    equivalent to the built-in open (and likewise raises TypeError when given
+    something that isn't a filename).
+    """
+    suffix = compression_suffix(filename_or_obj)
+    if not suffix:
+        return open(filename_or_obj, mode, **kwargs)
+    try:
+        compressor = COMPRESSORS[suffix]
+    except KeyError:
+        raise IOError(
+            'Support for %s compression is not available' % suffix)
+    result = CompressedWriter(compressor(filename_or_obj))
+    result.name = filename_or_obj
+    if 'b' not in mode:
+        result = io.TextIOWrapper(
+            result, encoding=kwargs.get('encoding'),
+            newline=kwargs.get('newline'))
+    return result
+
+def open_input(filename_or_obj, mode='r', **kwargs):
+    """Opens filename_or_obj for reading, decompressing it if required
+
+    Compressed files are recognized by one of the COMPRESSION_SUFFIXES or, if
+    the filename has none, by their magic bytes. The result is a buffered
+    stream which decompresses the file as it is read (wrapped in a
+    TextIOWrapper unless mode includes "b"). Otherwise, this is equivalent to
+    the built-in open (and likewise raises TypeError when given something
+    that isn't a filename).
+    """
+    suffix = compression_suffix(filename_or_obj)
+    if not suffix and isinstance(filename_or_obj, string_types):
+        with open(filename_or_obj, 'rb') as f:
+            magic = f.read(6)
+        for prefix, compression in COMPRESSION_MAGIC:
+            if magic.startswith(prefix):
+                suffix = compression
+                break
+    if not suffix:
+        return open(filename_or_obj, mode, **kwargs)
+    try:
+        decompressor = DECOMPRESSORS[suffix]
+    except KeyError:
+        raise IOError(
+            'Support for %s compression is not available' % suffix)
+    raw = open(filename_or_obj, 'rb')
+    try:
+        result = io.BufferedReader(
+            CompressedReader(decompressor(raw), raw, filename_or_obj),
+            CHUNK_SIZE)
+    except:
+        raw.close()
+        raise
+    if 'b' not in mode:
+        result = io.TextIOWrapper(
+            result, encoding=kwargs.get('encoding'),
+            newline=kwargs.get('newline'))
+    return result
+
+def is_compressed(f):
+    "Returns True if f is a decompressing stream returned by open_input"
+    return isinstance(
+        getattr(getattr(f, 'buffer', f), 'raw', None), CompressedReader)
+
+def read_array(f, dtype, count, progress=None):
+    """Reads an array of count values of dtype from the binary file f
+
+    Real files are read with numpy.fromfile. Anything else, including the
+    streams returned by open_input, is read in chunks into a single reused
+    buffer which is copied into the result (reading large blocks bypasses the
+    stream's buffer, so the data is never held twice). The optional progress
+    callable is called with the percentage read after each chunk. Like
+    fromfile, the result is shorter than count if f ends early.
+    """
+    dtype = np.dtype(dtype)
+    if not is_compressed(f):
+        try:
+            return np.fromfile(f, dtype=dtype, count=count)
+        except (AttributeError, IOError, OSError, ValueError,
+                io.UnsupportedOperation):
+            pass
+    data = np.empty(count, dtype)
+    result = data.view(np.uint8)
+    chunk = bytearray(min(CHUNK_SIZE, result.size))
+    pos = 0
+    while pos < result.size:
+        if result.size - pos < len(chunk):
+            del chunk[result.size - pos:]
+        read = f.readinto(chunk)
+        if not read:
+            break
+        result[pos:pos + read] = np.frombuffer(chunk, np.uint8, read)
+        pos += read
+        if progress:
+            progress(round(pos * 100.0 / result.size))
+    return data[:pos // dtype.itemsize]
+
+
+class CompressedReader(io.RawIOBase):
+    """Raw stream which reads from a decompressing stream
+
+    This adapts the various decompression libraries' streams (which differ
+    in the attributes they provide) to something which io.BufferedReader can
+    wrap. The underlying raw file is closed along with the stream, and seeks
+    are passed to the stream where supported (gzip, including bgzip files,
+    emulates them).
+    """
+
+    def __init__(self, stream, raw, name):
+        super(CompressedReader, self).__init__()
+        self._stream = stream
+        self._raw = raw
+        self.name = name
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        return self._stream.readinto(buf)
+
+    def seekable(self):
+        return self._stream.seekable()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self._stream.seek(offset, whence)
+
+    def tell(self):
+        return self._stream.tell()
+
+    def close(self):
+        if not self.closed:
+            try:
+                self._stream.close()
+            finally:
+                try:
+                    self._raw.close()
+                finally:
+                    super(CompressedReader, self).close()
+
+
+class CompressedWriter(io.RawIOBase):
+    """Writable stream which compresses its output in a background thread
+
+    The stream parameter is an open, binary, compressed stream (as returned by
+    gzip.open and the like). Data written is gathered into chunks which are
+    passed to a thread that writes them to stream, allowing the formatting
+    of output to overlap its compression (the compression libraries release
+    the GIL while compressing). Any exception raised by the thread is
+    re-raised by the next write or by close.
+    """
+
+    def __init__(self, stream):
+        super(CompressedWriter, self).__init__()
+        self._stream = stream
+        self._buffer = bytearray()
+        self._queue = queue.Queue(QUEUE_SIZE)
+        self._error = None
+        self._thread = threading.Thread(target=self._compress)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _compress(self):
+        "Writes queued chunks to the compressed stream until told to stop"
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                break
+            # After an error, keep draining the queue so the writer never
+            # blocks on a queue that nothing is reading
+            if self._error is None:
+                try:
+                    self._stream.write(chunk)
+                except Exception as exc:
+                    self._error = exc
+
+    def _check(self):
+        "Re-raises any exception which occurred in the compression thread"
+        if self._error is not None:
+            raise self._error
+
+    def _queue_buffer(self):
+        "Passes any buffered data to the compression thread"
+        if self._buffer:
+            self._queue.put(bytes(self._buffer))
+            del self._buffer[:]
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+        self._check()
+        if not isinstance(data, bytes):
+            # Copy anything else (e.g. a memoryview of an array) as the caller
+            # is free to modify it once this returns
+            data = memoryview(data).tobytes()
+        if len(data) >= CHUNK_SIZE:
+            self._queue_buffer()
+            self._queue.put(data)
+        else:
+            self._buffer += data
+            if len(self._buffer) >= CHUNK_SIZE:
+                self._queue_buffer()
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            try:
+                self._queue_buffer()
+                self._queue.put(None)
+                self._thread.join()
+                self._check()
+            finally:
+                try:
+                    self._stream.close()
+                finally:
+                    super(CompressedWriter, self).close()
@@ -0,0 +1,41 @@
+# vim: set et sw=4 sts=4:
+
+# Copyright 2012 Dave Hughes.
+#
+# This file is part of rastools.
+#
+# rastools is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# rastools is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# rastools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Axis coordinates for the writers of tabular and NeXus output"""
+
+from __future__ import (
+    unicode_literals,
+    print_function,
+    absolute_import,
+    division,
+    )
+
+import numpy as np
+
+
+def axis_coords(coords, size):
+    """Returns the coordinates of an axis of size elements as float64
+
+    Cropped data no longer matches the coordinates in the source file (if it
+    has any), in which case fall back to indices (as the DAT writer does).
+    Indices are floats too, so the type of the coordinates doesn't depend on
+    whether the data was cropped.
+    """
+    if coords is not None and len(coords) == size:
+        return np.asarray(coords, np.float64)
+    return np.arange(size, dtype=np.float64)
@@ -28,30 +28,89 @@ from __future__ import (
 import sys
 import csv
 
+import numpy as np
+
+from rastools.compression import open_output
+from rastools.textformat import TextFormatter, write_text
+
+
+# The number of values formatted in each block of output
+BLOCK_SIZE = 1048576
+
+
 class CsvWriter(object):
-    "CSV writer class for rasdump"
+    """CSV writer class for rasdump
+
+    The optional number_format parameter is a % format string (e.g. '%d' or
+    '%.3f') used for every value. By default, integers are written as with
+    '%d' and floats as Python's repr() (as the csv module does).
+    """
 
-    def __init__(self, filename_or_obj, channel):
+    dialect = 'excel'
+
+    def __init__(self, filename_or_obj, channel, number_format=None):
         try:
             if sys.hexversion >= 0x03000000:
                 # XXX Py3 only
-                self._file = open(filename_or_obj, mode='w', newline='')
+                self._file = open_output(filename_or_obj, mode='w', newline='')
             else:
                 # XXX Py2 only
-                self._file = open(filename_or_obj, mode='wb')
+                self._file = open_output(filename_or_obj, mode='wb')
         except TypeError:
             self._file = filename_or_obj
-        self._writer = csv.writer(self._file, dialect='excel')
+        self._writer = csv.writer(self._file, dialect=self.dialect)
+        self.number_format = number_format
 
     def write(self, data):
-        "Writes channel data as CSV"
-        for row in data:
-            self._writer.writerow(row)
+        """Writes channel data as CSV and closes the output
+
+        The output must be closed before it is renamed into place; for
+        compressed output this waits for the compression thread to finish.
+        """
+        try:
+            self._write(data)
+        finally:
+            self.close()
+
+    def close(self):
+        "Flushes and closes the output file"
+        self._file.close()
+
+    def _write(self, data):
+        data = np.asarray(data)
+        number_format = self.number_format
+        if number_format is None:
+            if data.dtype.kind in 'iu':
+                number_format = '%d'
+            elif data.dtype == np.float64:
+                number_format = '%r'
+        if data.ndim != 2 or not data.size or number_format is None:
+            # Anything the bulk path can't reproduce exactly (e.g. the str()
+            # of float32 values) goes through the csv module
+            for row in data:
+                self._writer.writerow(row)
+            return
+        # Rather than passing each value through the csv module, blocks of
+        # rows are formatted at once; numbers never require quoting so only
+        # the dialect's delimiter and line terminator matter
+        dialect = csv.get_dialect(self.dialect)
+        rows = max(1, BLOCK_SIZE // data.shape[1])
+        if number_format in ('%d', '%i'):
+            formatter = TextFormatter(
+                [('', dialect.delimiter)] * (data.shape[1] - 1) + [('', '')],
+                line_end=dialect.lineterminator)
+            for y in range(0, data.shape[0], rows):
+                write_text(self._file, formatter.format(data[y:y + rows]))
+        else:
+            line_format = dialect.delimiter.join(
+                [number_format] * data.shape[1]) + dialect.lineterminator
+            for y in range(0, data.shape[0], rows):
+                block = data[y:y + rows]
+                self._file.write(
+                    line_format * block.shape[0] % tuple(block.ravel().tolist()))
 
 
 class TsvWriter(CsvWriter):
     "Tab-separated writer class for rasdump"
 
-    def __init__(self, filename_or_obj, channel):
-        super(TsvWriter, self).__init__(filename_or_obj, channel)
-        self._writer = csv.writer(self._file, dialect='excel-tab')
+    dialect = 'excel-tab'
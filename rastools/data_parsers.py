@@ -51,3 +51,14 @@ else:
         (DatParser, ('.dat', '.DAT'), "DAT - Sam's data format"),
     ])
 
+
+logging.info('Loading NumPy parser')
+try:
+    from rastools.npyparse import NpyParser, NpzParser
+except ImportError:
+    logging.warning('Failed to load NumPy parser')
+else:
+    DATA_PARSERS.extend([
+        (NpyParser, ('.npy', '.NPY'), 'NPY - NumPy array'),
+        (NpzParser, ('.npz', '.NPZ'), 'NPZ - NumPy array archive'),
+    ])
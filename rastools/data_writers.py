@@ -23,10 +23,13 @@ from __future__ import (
 
 import logging
 
-__all__ = ['DATA_WRITERS']
+__all__ = ['DATA_WRITERS', 'COMPRESSED_WRITERS']
 
 DATA_WRITERS = []
 
+# Writers which accept output filenames with a compression suffix (.gz, etc.)
+COMPRESSED_WRITERS = set()
+
 logging.info('Loading CSV writer')
 try:
     from rastools.csvwrite import CsvWriter, TsvWriter
@@ -40,6 +43,7 @@ else:
         (CsvWriter, ('.csv', '.CSV'), 'CSV - Comma Separated Values', None),
         (TsvWriter, ('.tsv', '.TSV'), 'TSV - Tab Separated Values',   None),
     ])
+    COMPRESSED_WRITERS.update([CsvWriter, TsvWriter])
 
 logging.info('Loading RAS writer')
 try:
@@ -54,6 +58,8 @@ else:
         (RasAsciiWriter, ('.ras_a', '.RAS_A'), 'RAS_A - QSCAN ASCII format',
             RasAsciiMultiWriter),
     ])
+    COMPRESSED_WRITERS.update([
+        RasWriter, RasMultiWriter, RasAsciiWriter, RasAsciiMultiWriter])
 
 logging.info('Loading DAT writer')
 try:
@@ -64,6 +70,7 @@ else:
     DATA_WRITERS.extend([
         (DatWriter, ('.dat', '.DAT'), "DAT - Sam's data format", DatMultiWriter),
     ])
+    COMPRESSED_WRITERS.update([DatWriter, DatMultiWriter])
 
 logging.info('Loading Excel writer')
 try:
@@ -74,3 +81,50 @@ else:
     DATA_WRITERS.extend([
         (XlsWriter, ('.xls', '.XLS'), 'XLS - Excel workbook', XlsMulti),
     ])
+
+logging.info('Loading Excel 2007+ writer')
+try:
+    from rastools.xlsxwrite import XlsxWriter, XlsxMulti
+except ImportError:
+    logging.warning('Failed to load Excel 2007+ support')
+else:
+    DATA_WRITERS.extend([
+        (XlsxWriter, ('.xlsx', '.XLSX'), 'XLSX - Excel 2007+ workbook', XlsxMulti),
+    ])
+
+logging.info('Loading HDF5 writer')
+try:
+    from rastools.h5write import H5Writer, H5Multi
+except ImportError:
+    logging.warning('Failed to load HDF5 support')
+else:
+    DATA_WRITERS.extend([
+        (H5Writer, ('.h5', '.H5', '.hdf5', '.nxs'), 'HDF5 - NeXus HDF5 file',
+            H5Multi),
+    ])
+
+logging.info('Loading NumPy writer')
+try:
+    from rastools.npywrite import NpyWriter, NpzWriter, NpzMultiWriter
+except ImportError:
+    logging.warning('Failed to load NumPy support')
+else:
+    DATA_WRITERS.extend([
+        (NpyWriter, ('.npy', '.NPY'), 'NPY - NumPy array', None),
+        (NpzWriter, ('.npz', '.NPZ'), 'NPZ - NumPy array archive', NpzMultiWriter),
+    ])
+
+logging.info('Loading Arrow writer')
+try:
+    from rastools.arrowwrite import (
+        ArrowWriter, ArrowMultiWriter, ParquetWriter, ParquetMultiWriter
+    )
+except ImportError:
+    logging.warning('Failed to load Arrow support')
+else:
+    DATA_WRITERS.extend([
+        (ArrowWriter, ('.arrow', '.feather'), 'Arrow - Arrow IPC file (one row per pixel)',
+            ArrowMultiWriter),
+        (ParquetWriter, ('.parquet',), 'Parquet - Parquet file (one row per pixel)',
+            ParquetMultiWriter),
+    ])
@@ -34,6 +34,8 @@ from bisect import bisect_left
 
 import numpy as np
 
+from rastools.compression import open_input, strip_compression
+
 
 class Error(ValueError):
     """Base exception class"""
@@ -102,14 +104,14 @@ class DatParser(object):
         if channels_file:
             logging.warning('Channels files are currently ignored')
         try:
-            self._file = open(data_file, 'rU')
+            self._file = open_input(data_file, 'rU')
         except TypeError:
             self._file = data_file
         self.header = {}
         self.version = self.header_version
         self.filename = self._file.name
         self.filename_root = re.sub(r'^(.*?)[_-][0-9]+\.(dat|DAT)$', r'\1',
-            os.path.split(self._file.name)[1])
+            strip_compression(os.path.split(self._file.name)[1]))
         self.start_time = dt.datetime.fromtimestamp(
             os.stat(self._file.name).st_ctime
         )
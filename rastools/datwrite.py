@@ -27,9 +27,15 @@ from __future__ import (
 
 import numpy as np
 
+from rastools.compression import open_output
+from rastools.textformat import TextFormatter, write_text
+
 
 DEFAULT_ENERGY_POINTS = 10000.0
 
+# The number of values formatted in each block of output
+BLOCK_SIZE = 1048576
+
 DAT_HEADER = """\
 * Abscissa points : {x_size:5d}
 * Ordinate points : {y_size:5d}
@@ -53,12 +59,48 @@ DAT_HEADER = """\
 """
 
 
+def write_rows(f, data, value_format):
+    """Writes data (rows of pixels each with one or more values) as dat lines
+
+    Each line consists of the pixel's y and x coordinates formatted as %.4f,
+    then each value formatted with value_format (a % format string which
+    includes any separator or line ending). Lines are built in blocks of
+    several rows; the coordinate columns are broadcast alongside the values and
+    the whole block is formatted by TextFormatter when the values are all
+    integral (the common case), or with a single % operation otherwise.
+    """
+    y_size, x_size = data.shape[:2]
+    data = data.reshape((y_size, x_size, -1))
+    columns = 2 + data.shape[2]
+    suffixes = {'%.1f\t': '.0\t', '%.1f\n': '.0\n'}
+    formatter = TextFormatter(
+        [('', '.0000\t')] * 2 + [('', suffixes[value_format])] * data.shape[2],
+        line_end='\n' if value_format.endswith('\t') else '')
+    line_format = '%.4f\t%.4f\t' + value_format * data.shape[2] + (
+        '\n' if value_format.endswith('\t') else '')
+    rows = max(1, BLOCK_SIZE // (x_size * columns))
+    block = np.empty((rows, x_size, columns), np.float64)
+    block[..., 1] = np.arange(x_size)
+    for y in range(0, y_size, rows):
+        values = data[y:y + rows]
+        count = values.shape[0]
+        lines = block[:count]
+        lines[..., 0] = np.arange(y, y + count)[:, np.newaxis]
+        lines[..., 2:] = values
+        if values.dtype.kind in 'iu' or (
+                np.all(np.floor(values) == values) and
+                not np.any(np.signbit(values))):
+            write_text(f, formatter.format(lines))
+        else:
+            f.write(line_format * (count * x_size) % tuple(lines.ravel().tolist()))
+
+
 class DatWriter(object):
     "Single channel writer for Sam's dat format"
 
     def __init__(self, filename_or_obj, channel):
         try:
-            self._file = open(filename_or_obj, 'w')
+            self._file = open_output(filename_or_obj, 'w')
         except TypeError:
             self._file = filename_or_obj
         self._data_file = channel.parent
@@ -83,10 +125,7 @@ class DatWriter(object):
             energy_points=data_file.header.get(
                 'energy_points', DEFAULT_ENERGY_POINTS),
         ))
-        for y, row in enumerate(data):
-            for x, value in enumerate(row):
-                self._file.write(
-                    '%.4f\t%.4f\t%.1f\n' % (y_coords[y], x_coords[x], value))
+        write_rows(self._file, data, '%.1f\n')
         self._file.close()
 
 class DatMultiWriter(object):
@@ -94,7 +133,7 @@ class DatMultiWriter(object):
 
     def __init__(self, filename_or_obj, data_file):
         try:
-            self._file = open(filename_or_obj, 'w')
+            self._file = open_output(filename_or_obj, 'w')
         except TypeError:
             self._file = filename_or_obj
         self._data_file = data_file
@@ -109,14 +148,31 @@ class DatMultiWriter(object):
 
     def write_page(self, data, channel):
         "Write the channel to the output file"
+        # Channels are interleaved in the output so all must be stored before
+        # anything is written; an array large enough for every enabled channel
+        # is allocated on the first call and each page is copied into its
+        # stride
         if self._data is None:
-            self._data = np.dstack((data,))
-        else:
-            self._data = np.dstack((self._data, data))
+            self._data = np.empty(
+                data.shape + (sum(
+                    1 for c in self._data_file.channels if c.enabled),),
+                data.dtype)
+        elif not np.can_cast(data.dtype, self._data.dtype):
+            self._data = self._data.astype(
+                np.result_type(self._data.dtype, data.dtype))
+        if len(self._names) >= self._data.shape[2]:
+            raise ValueError('Too many channels written')
+        self._data[..., len(self._names)] = data
         self._names.append(channel.name)
 
     def close(self):
         "Finalize and close the output file"
+        if self._data is None:
+            self._file.close()
+            return
+        # Take a slice of the data which only includes the channels that got
+        # written
+        self._data = self._data[..., :len(self._names)]
         data_file = self._data_file
         # XXX Is there any way of getting the real coords in the case of a
         # cropped .dat file? If so, define it here...
@@ -134,13 +190,5 @@ class DatMultiWriter(object):
             energy_points=data_file.header.get(
                 'energy_points', DEFAULT_ENERGY_POINTS),
         ))
-        for y, row in enumerate(self._data):
-            for x, values in enumerate(row):
-                self._file.write(
-                    '%.4f\t%.4f\t%s\n' % (
-                        y_coords[y],
-                        x_coords[x],
-                        ''.join('%.1f\t' % value for value in values)
-                    )
-                )
+        write_rows(self._file, self._data, '%.1f\t')
         self._file.close()
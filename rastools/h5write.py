@@ -0,0 +1,142 @@
+# vim: set et sw=4 sts=4:
+
+# Copyright 2012 Dave Hughes.
+#
+# This file is part of rastools.
+#
+# rastools is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# rastools is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# rastools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""HDF5 (NeXus) writer module for rasdump"""
+
+from __future__ import (
+    unicode_literals,
+    print_function,
+    absolute_import,
+    division,
+    )
+
+import re
+import datetime as dt
+
+import numpy as np
+import h5py
+
+from rastools.coords import axis_coords
+
+
+# Options passed to create_dataset for each channel. Chunks are whole rows so
+# that a chunk is never split by the row-major order the data is written in,
+# and the shuffle filter improves gzip's ratio on small integer counts
+COMPRESSION = 'gzip'
+COMPRESSION_LEVEL = 4
+CHUNK_BYTES = 262144
+
+INVALID_NAME_CHARS = re.compile(r'[^A-Za-z0-9_]')
+
+
+def dataset_name(channel):
+    "Returns a valid (NeXus-style) dataset name for channel"
+    return 'channel%02d_%s' % (
+        channel.index, INVALID_NAME_CHARS.sub('_', channel.name))
+
+def set_attrs(obj, values):
+    "Stores values from a format_dict as HDF5 attributes of obj"
+    for key, value in values.items():
+        if value is None:
+            continue
+        if isinstance(value, (dt.datetime, dt.date)):
+            value = value.isoformat()
+        elif isinstance(value, np.generic):
+            value = value.item()
+        elif isinstance(value, bytes):
+            value = value.decode('utf-8', 'replace')
+        try:
+            obj.attrs[key] = value
+        except TypeError:
+            obj.attrs[key] = str(value)
+
+def create_entry(h5file, data_file, shape):
+    "Creates the NXentry and NXdata groups for data_file"
+    h5file.attrs['NX_class'] = 'NXroot'
+    h5file.attrs['creator'] = 'rastools'
+    entry = h5file.create_group('entry')
+    entry.attrs['NX_class'] = 'NXentry'
+    set_attrs(entry, data_file.format_dict())
+    data = entry.create_group('data')
+    data.attrs['NX_class'] = 'NXdata'
+    data.attrs['axes'] = ['y', 'x']
+    data.attrs['y_indices'] = 0
+    data.attrs['x_indices'] = 1
+    data.create_dataset('y', data=axis_coords(
+        getattr(data_file, 'y_coords', None), shape[0]))
+    data.create_dataset('x', data=axis_coords(
+        getattr(data_file, 'x_coords', None), shape[1]))
+    return data
+
+def write_channel(group, data, channel):
+    "Writes data as a chunked, compressed dataset of group"
+    rows = max(1, min(data.shape[0],
+        CHUNK_BYTES // max(1, data.shape[1] * data.dtype.itemsize)))
+    dataset = group.create_dataset(
+        dataset_name(channel), data=data,
+        chunks=(rows, data.shape[1]),
+        compression=COMPRESSION, compression_opts=COMPRESSION_LEVEL,
+        shuffle=True)
+    set_attrs(dataset, dict(
+        (key, value)
+        for (key, value) in channel.format_dict().items()
+        if key.startswith('channel')))
+    return dataset
+
+
+class H5Writer(object):
+    "Single channel writer class for HDF5 output"
+
+    def __init__(self, filename_or_obj, channel):
+        self._file = h5py.File(filename_or_obj, 'w')
+        self._channel = channel
+
+    def write(self, data):
+        "Writes channel data as the signal of the file's NXdata group"
+        try:
+            group = create_entry(self._file, self._channel.parent, data.shape)
+            dataset = write_channel(group, data, self._channel)
+            group.attrs['signal'] = dataset.name.rsplit('/', 1)[-1]
+        finally:
+            self._file.close()
+
+class H5Multi(object):
+    "Multi channel writer class for HDF5 output"
+
+    def __init__(self, filename_or_obj, data_file):
+        self._file = h5py.File(filename_or_obj, 'w')
+        self._data_file = data_file
+        self._group = None
+        self._names = []
+
+    def write_page(self, data, channel):
+        "Writes channel data to a new dataset"
+        # Each channel is a dataset of its own, so pages are compressed and
+        # written to disk as they arrive instead of being buffered
+        if self._group is None:
+            self._group = create_entry(self._file, self._data_file, data.shape)
+        dataset = write_channel(self._group, data, channel)
+        self._names.append(dataset.name.rsplit('/', 1)[-1])
+
+    def close(self):
+        "Finalizes and closes the output file"
+        if self._group is not None and self._names:
+            self._group.attrs['signal'] = self._names[0]
+            if len(self._names) > 1:
+                self._group.attrs['auxiliary_signals'] = self._names[1:]
+        self._file.close()
@@ -28,10 +28,15 @@ from __future__ import (
 import logging
 import matplotlib
 
-__all__ = ['IMAGE_WRITERS']
+__all__ = ['IMAGE_WRITERS', 'VECTOR_WRITERS']
 
 IMAGE_WRITERS = []
 
+# Canvas classes which produce vector output. Images drawn by these are
+# embedded as rasters within the document and thus may be downsampled to the
+# resolution they occupy on the page
+VECTOR_WRITERS = set()
+
 logging.info('Loading PNG support')
 try:
     from matplotlib.backends.backend_agg import FigureCanvasAgg
@@ -57,6 +62,7 @@ else:
         (FigureCanvasSVG, FigureCanvasSVG.print_svgz, ('.svgz', '.SVGZ'),
             'SVGZ - Compressed Scalable Vector Graphics', 'lanczos', None),
     ])
+    VECTOR_WRITERS.add(FigureCanvasSVG)
 
 logging.info('Loading TIFF, GIF, JPEG support')
 try:
@@ -91,6 +97,7 @@ else:
         (FigureCanvasPS, FigureCanvasPS.print_ps, ('.ps', '.PS'),
             'PS - PostScript document', 'lanczos', None),
     ])
+    VECTOR_WRITERS.add(FigureCanvasPS)
 
 logging.info('Loading PDF support')
 try:
@@ -103,6 +110,7 @@ else:
         (FigureCanvasPdf, FigureCanvasPdf.print_pdf, ('.pdf', '.PDF'),
             'PDF - Adobe Portable Document Format', 'lanczos', PdfPages),
     ])
+    VECTOR_WRITERS.add(FigureCanvasPdf)
 
 logging.info('Loading GIMP support')
 try:
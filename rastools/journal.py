@@ -0,0 +1,176 @@
+# vim: set et sw=4 sts=4:
+
+# Copyright 2012 Dave Hughes.
+#
+# This file is part of rastools.
+#
+# rastools is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# rastools is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# rastools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Checkpoint journals and atomic output files for resumable batch runs"""
+
+from __future__ import (
+    unicode_literals,
+    print_function,
+    absolute_import,
+    division,
+    )
+
+import io
+import os
+import json
+import logging
+import threading
+from contextlib import contextmanager
+
+
+# The prefix of the temporary files which outputs are written to before being
+# renamed into place. A prefix (rather than a suffix) keeps the extension,
+# which selects the format and compression of some outputs
+TEMP_PREFIX = '.tmp.'
+
+
+def temp_name(filename):
+    "Returns the name of the temporary file for the output filename"
+    path, name = os.path.split(filename)
+    return os.path.join(path, '%s%d.%s' % (TEMP_PREFIX, os.getpid(), name))
+
+
+def discard_partial(filename):
+    "Removes the temporary files of interrupted attempts to write filename"
+    path, name = os.path.split(filename)
+    try:
+        names = os.listdir(path or os.curdir)
+    except OSError:
+        return
+    for temp in names:
+        if temp.startswith(TEMP_PREFIX) and \
+                temp[len(TEMP_PREFIX):].partition('.')[2] == name:
+            logging.debug('Removing partial output %s', temp)
+            try:
+                os.unlink(os.path.join(path, temp))
+            except OSError:
+                pass
+
+
+@contextmanager
+def atomic_output(filename, sync=False):
+    """Context manager which yields a temporary name to write filename to
+
+    When the context exits successfully, the temporary file is renamed to
+    filename, so that readers never see a partially written output (nor does
+    an interrupted run leave one behind). If an exception occurs, the
+    temporary file is removed instead. If sync is True, the content of the
+    file is flushed to disk before the rename.
+    """
+    temp = temp_name(filename)
+    try:
+        yield temp
+        if sync:
+            with io.open(temp, 'rb') as f:
+                os.fsync(f.fileno())
+        if os.name == 'nt' and os.path.exists(filename):
+            os.unlink(filename)
+        os.rename(temp, filename)
+    except:
+        if os.path.exists(temp):
+            os.unlink(temp)
+        raise
+
+
+class CheckpointJournal(object):
+    """Append-only record of the completed units of a batch run
+
+    Each unit is an output written from an input data file; the journal
+    records the input's path, size, and modification time, the indexes of the
+    channels written, and the output's path. A unit with no output records
+    that every output of its input is complete. Records are appended (and
+    flushed to disk) as each unit completes, so that a run which dies part way
+    through can be resumed without repeating completed units. Several
+    processes may append to the same journal.
+
+    If resume is False, the journal's existing records are ignored.
+    """
+
+    def __init__(self, filename, resume=False):
+        self.filename = filename
+        self._completed = set()
+        self._lock = threading.Lock()
+        if resume and os.path.exists(filename):
+            with io.open(filename, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        self._completed.add(self._unit(*json.loads(line)))
+                    except (ValueError, TypeError):
+                        # A line cut short by the death of a previous run
+                        logging.debug('Ignoring partial journal record')
+            logging.info(
+                'Journal %s records %d completed units',
+                filename, len(self._completed))
+
+    @staticmethod
+    def _unit(input_file, size, mtime, channels, output):
+        return (input_file, size, mtime, tuple(channels or ()), output)
+
+    @staticmethod
+    def _input(input_file, version=None):
+        if version is None:
+            stat = os.stat(input_file)
+            version = (stat.st_size, stat.st_mtime)
+        size, mtime = version
+        return (input_file, size, int(mtime * 1000))
+
+    @staticmethod
+    def truncate(filename):
+        "Empties the journal filename (if it exists), to start a new run"
+        if os.path.exists(filename):
+            with io.open(filename, 'wb'):
+                pass
+
+    def completed(self, input_file, channels=None, output=None):
+        """Returns True if the unit has been completed
+
+        The unit must have been recorded against the current size and
+        modification time of input_file, and its output must still exist.
+        """
+        try:
+            unit = self._unit(
+                *(self._input(input_file) + (channels, output)))
+        except OSError:
+            return False
+        return unit in self._completed and (
+            output is None or os.path.exists(output))
+
+    def record(self, input_file, channels=None, output=None, version=None):
+        """Appends the unit to the journal, flushing it to disk
+
+        If version is given, it is the (size, mtime) of input_file when it was
+        read, so that a change since then isn't recorded as complete. By
+        default the current size and modification time are recorded.
+        """
+        try:
+            unit = self._input(input_file, version) + (
+                list(channels or ()), output)
+        except OSError:
+            return
+        line = (json.dumps(unit) + '\n').encode('utf-8')
+        with self._lock:
+            self._completed.add(self._unit(*unit))
+            # Each record is a single write to a file opened for appending so
+            # that records from concurrent processes aren't interleaved
+            fd = os.open(
+                self.filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
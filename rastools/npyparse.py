@@ -0,0 +1,302 @@
+# vim: set et sw=4 sts=4:
+
+# Copyright 2012 Dave Hughes.
+#
+# This file is part of rastools.
+#
+# rastools is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# rastools is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# rastools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Parser for NumPy .npy and .npz files"""
+
+from __future__ import (
+    unicode_literals,
+    print_function,
+    absolute_import,
+    division,
+    )
+
+import os
+import re
+import json
+import struct
+import logging
+import zipfile
+import datetime as dt
+
+import numpy as np
+
+
+# Layout of the .npz files written by rastools.npywrite. Each channel is
+# stored (uncompressed, so it can be memory-mapped) as a member named
+# CHANNEL_MEMBER % position, alongside the following optional members:
+#
+# names     - unicode array of the channel names, in position order
+# header    - 0-d unicode array containing the source file's format_dict as
+#             a JSON object (datetimes are in ISO-8601 format)
+# x_coords  - the abscissa coordinates of the data (from .dat files)
+# y_coords  - the ordinate coordinates of the data (from .dat files)
+CHANNEL_MEMBER = 'channel%02d'
+CHANNEL_RE = re.compile(r'^channel(\d+)$')
+
+# Keys of the header which are recalculated from the data rather than restored
+DERIVED_KEYS = {'filename', 'channel_count', 'x_size', 'y_size'}
+
+# The fixed portion of a zip local file header; the last two fields are the
+# lengths of the variable-length filename and extra fields that follow it
+ZIP_LOCAL_HEADER = struct.Struct(str('<4s5H3L2H'))
+
+
+class Error(ValueError):
+    """Base exception class"""
+
+class NpyFileError(Error):
+    """Base class for errors encountered in .npy/.npz parsing"""
+
+
+def parse_time(value):
+    "Converts an ISO-8601 timestamp back into a datetime"
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            return dt.datetime.strptime(value, fmt)
+        except (TypeError, ValueError):
+            pass
+    return None
+
+def map_member(zip_file, filename, name):
+    """Returns the named array of zip_file, memory-mapped if possible
+
+    Members which are stored uncompressed are located within filename and
+    mapped copy-on-write (so callers may still modify the data in place, as
+    they can with the other parsers). Compressed members (e.g. from
+    numpy.savez_compressed) have to be read into memory.
+    """
+    info = zip_file.getinfo(name)
+    if filename and info.compress_type == zipfile.ZIP_STORED:
+        with open(filename, 'rb') as f:
+            f.seek(info.header_offset)
+            fields = ZIP_LOCAL_HEADER.unpack(f.read(ZIP_LOCAL_HEADER.size))
+            f.seek(fields[-2] + fields[-1], os.SEEK_CUR)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = \
+                    np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = \
+                    np.lib.format.read_array_header_2_0(f)
+            offset = f.tell()
+        if not dtype.hasobject:
+            return np.memmap(
+                filename, dtype=dtype, mode='c', offset=offset, shape=shape,
+                order='F' if fortran_order else 'C')
+    with zip_file.open(name) as f:
+        return np.lib.format.read_array(f, allow_pickle=False)
+
+
+class NpyParser(object):
+    """Parser for NumPy .npy files containing 2D or 3D arrays"""
+
+    # A 2D array is treated as a single channel, and a 3D array as a stack of
+    # channels indexed by its first dimension (the layout np.save produces
+    # for np.stack(channels)). Plain .npy files have nowhere to store channel
+    # names or header information so these are all defaulted
+    header_version = 1
+
+    def __init__(
+            self, data_file, channels_file=None, **kwargs):
+        """Constructor accepts a filename or file-like object"""
+        super(NpyParser, self).__init__()
+        self.progress_start, self.progress_update, self.progress_finish = \
+            kwargs.get('progress', (None, None, None))
+        if channels_file:
+            logging.warning('Channels files are currently ignored')
+        try:
+            self._file = open(data_file, 'rb')
+        except TypeError:
+            self._file = data_file
+        self.header = {}
+        self.version = self.header_version
+        self.filename = self._file.name
+        self.filename_root = os.path.splitext(
+            os.path.split(self._file.name)[1])[0]
+        self.start_time = dt.datetime.fromtimestamp(
+            os.stat(self._file.name).st_ctime)
+        self.stop_time = self.start_time
+        self.comments = ''
+        logging.debug('Reading .npy header')
+        self._data = self.read_arrays()
+        self.channel_count = len(self._data)
+        if self.channel_count == 0:
+            raise NpyFileError('%s contains no channels' % self.filename)
+        self.y_size, self.x_size = self._data[0].shape[:2]
+        for data in self._data:
+            if data.shape != (self.y_size, self.x_size):
+                raise NpyFileError(
+                    'Expected 2 dimensional channels of shape %r but found %r '
+                    'in %s' % (
+                        (self.y_size, self.x_size), data.shape, self.filename))
+        self.channel_names = [''] * self.channel_count
+        self.read_metadata()
+        self.channels = NpyChannels(self)
+
+    def read_arrays(self):
+        """Returns the list of channel arrays (memory-mapped)"""
+        data = np.load(self._file.name, mmap_mode='c', allow_pickle=False)
+        if data.ndim == 2:
+            return [data]
+        elif data.ndim == 3:
+            return list(data)
+        raise NpyFileError(
+            'Expected a 2 or 3 dimensional array but found %d dimensions' %
+            data.ndim)
+
+    def read_metadata(self):
+        """Reads channel names and header information, if present"""
+        pass
+
+    def format_dict(self, **kwargs):
+        """Return a dictionary suitable for the format method"""
+        result = {}
+        result.update(
+            self.header,
+            filename           = self._file.name,
+            filename_root      = self.filename_root,
+            version            = self.version,
+            start_time         = self.start_time,
+            stop_time          = self.stop_time,
+            channel_count      = self.channel_count,
+            x_size             = self.x_size,
+            y_size             = self.y_size,
+            comments           = self.comments,
+            **kwargs
+        )
+        return result
+
+
+class NpzParser(NpyParser):
+    """Parser for NumPy .npz files (as written by rasdump)"""
+
+    def read_arrays(self):
+        """Returns the list of channel arrays (memory-mapped)"""
+        logging.debug('Reading .npz directory')
+        self._zip = zipfile.ZipFile(self._file)
+        self._members = dict(
+            (os.path.splitext(name)[0], name)
+            for name in self._zip.namelist())
+        channels = sorted(
+            (int(match.group(1)), name)
+            for (name, match) in (
+                (name, CHANNEL_RE.match(name)) for name in self._members)
+            if match)
+        if not channels:
+            # Not written by rasdump; treat every 2D array as a channel in
+            # the order they were saved
+            channels = list(enumerate(
+                os.path.splitext(name)[0] for name in self._zip.namelist()))
+        return [
+            map_member(self._zip, self.filename, self._members[name])
+            for (_, name) in channels]
+
+    def read_member(self, name):
+        """Returns the small array stored as name, or None"""
+        try:
+            name = self._members[name]
+        except KeyError:
+            return None
+        with self._zip.open(name) as f:
+            return np.lib.format.read_array(f, allow_pickle=False)
+
+    def read_metadata(self):
+        """Reads channel names and header information"""
+        names = self.read_member('names')
+        if names is not None:
+            self.channel_names = [str(name) for name in names.tolist()]
+        header = self.read_member('header')
+        if header is not None:
+            header = json.loads(header.item())
+            for key in DERIVED_KEYS:
+                header.pop(key, None)
+            self.filename_root = header.pop(
+                'filename_root', self.filename_root)
+            self.version = header.pop('version', self.version)
+            self.comments = header.pop('comments', self.comments)
+            self.start_time = parse_time(
+                header.pop('start_time', None)) or self.start_time
+            self.stop_time = parse_time(
+                header.pop('stop_time', None)) or self.stop_time
+            self.header = header
+        for axis in ('x_coords', 'y_coords'):
+            coords = self.read_member(axis)
+            if coords is not None:
+                setattr(self, axis, coords.tolist())
+
+
+class NpyChannels(object):
+    """Container for the channels in a .npy or .npz file"""
+    def __init__(self, parent):
+        super(NpyChannels, self).__init__()
+        self.parent = parent
+        self._items = [
+            NpyChannel(self, i, name, data)
+            for (i, (name, data)) in enumerate(
+                zip(self.parent.channel_names, self.parent._data))
+        ]
+
+    def __len__(self):
+        return self.parent.channel_count
+
+    def __getitem__(self, index):
+        return self._items[index]
+
+    def __iter__(self):
+        for channel in self._items:
+            yield channel
+
+    def __contains__(self, obj):
+        return obj in self._items
+
+
+class NpyChannel(object):
+    """Represents a channel of data in a .npy or .npz file"""
+    def __init__(self, channels, index, name, data, enabled=True):
+        self._channels = channels
+        self._index = index
+        self.name = name if name else 'I{0}'.format(index)
+        self.enabled = enabled
+        self._data = data
+
+    @property
+    def parent(self):
+        """Returns the object representing the .npy or .npz file"""
+        return self._channels.parent
+
+    @property
+    def index(self):
+        """Returns the index of this channel in the channel list"""
+        return self._index
+
+    @property
+    def data(self):
+        """Returns the channel data as a (memory-mapped) numpy array"""
+        return self._data
+
+    def format_dict(self, **kwargs):
+        """Return a dictionary suitable for the format method"""
+        return self.parent.format_dict(
+            channel         = self.index,
+            channel_name    = self.name,
+            channel_enabled = self.enabled,
+            channel_min     = self.data.min(),
+            channel_max     = self.data.max(),
+            channel_empty   = self.data.min() == self.data.max(),
+            **kwargs
+        )
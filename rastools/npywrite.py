@@ -0,0 +1,134 @@
+# vim: set et sw=4 sts=4:
+
+# Copyright 2012 Dave Hughes.
+#
+# This file is part of rastools.
+#
+# rastools is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# rastools is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# rastools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Writer for NumPy .npy and .npz files"""
+
+from __future__ import (
+    unicode_literals,
+    print_function,
+    absolute_import,
+    division,
+    )
+
+import io
+import sys
+import json
+import zipfile
+import datetime as dt
+
+import numpy as np
+
+from rastools.npyparse import CHANNEL_MEMBER
+
+
+def json_default(value):
+    "Converts values which JSON can't represent natively"
+    if isinstance(value, (dt.datetime, dt.date)):
+        return value.isoformat()
+    elif isinstance(value, np.generic):
+        return value.item()
+    elif isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return str(value)
+
+
+class NpyWriter(object):
+    "Single channel writer for NumPy's .npy format"
+
+    def __init__(self, filename_or_obj, channel):
+        try:
+            self._file = open(filename_or_obj, 'wb')
+        except TypeError:
+            self._file = filename_or_obj
+
+    def write(self, data):
+        "Write the specified data to the output file"
+        np.lib.format.write_array(self._file, data, allow_pickle=False)
+        self._file.close()
+
+class NpzMultiWriter(object):
+    "Multi channel writer for NumPy's .npz format"
+
+    def __init__(self, filename_or_obj, data_file):
+        # Members are stored uncompressed so that NpzParser can memory-map
+        # them, and each is written straight to the archive as it's received
+        self._zip = zipfile.ZipFile(
+            filename_or_obj, 'w', zipfile.ZIP_STORED, allowZip64=True)
+        self._data_file = data_file
+        self._names = []
+        self._shape = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, t, v, tb):
+        self.close()
+
+    def write_member(self, name, data):
+        "Writes data to the archive as the member name"
+        if sys.hexversion >= 0x03060000:
+            # XXX Py3.6+ only
+            with self._zip.open(name + '.npy', 'w', force_zip64=True) as f:
+                np.lib.format.write_array(
+                    f, np.asanyarray(data), allow_pickle=False)
+        else:
+            # Older versions of zipfile can't stream a member into the
+            # archive, so each is built in memory (one at a time) instead
+            f = io.BytesIO()
+            np.lib.format.write_array(
+                f, np.asanyarray(data), allow_pickle=False)
+            self._zip.writestr(name + '.npy', f.getvalue())
+
+    def write_page(self, data, channel):
+        "Write the channel to the output file"
+        if self._shape is None:
+            self._shape = data.shape
+        elif data.shape != self._shape:
+            raise ValueError(
+                'Channel %d has shape %r which differs from the first '
+                'channel %r' % (channel.index, data.shape, self._shape))
+        self.write_member(CHANNEL_MEMBER % len(self._names), data)
+        self._names.append(channel.name)
+
+    def close(self):
+        "Write the channel names and header, and close the output file"
+        try:
+            self.write_member('names', np.array(self._names, dtype=np.str_))
+            self.write_member('header', np.array(json.dumps(
+                self._data_file.format_dict(), default=json_default)))
+            if self._shape is not None:
+                # Coordinates are only meaningful if the data hasn't been
+                # cropped (see the DAT writer)
+                for axis, size in zip(('y_coords', 'x_coords'), self._shape):
+                    coords = getattr(self._data_file, axis, None)
+                    if coords is not None and len(coords) == size:
+                        self.write_member(axis, np.asarray(coords, np.float64))
+        finally:
+            self._zip.close()
+
+class NpzWriter(object):
+    "Single channel writer for NumPy's .npz format"
+
+    def __init__(self, filename_or_obj, channel):
+        self._writer = NpzMultiWriter(filename_or_obj, channel.parent)
+        self._channel = channel
+
+    def write(self, data):
+        "Write the specified data to the output file"
+        with self._writer:
+            self._writer.write_page(data, self._channel)
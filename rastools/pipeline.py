@@ -0,0 +1,188 @@
+# vim: set et sw=4 sts=4:
+
+# Copyright 2012 Dave Hughes.
+#
+# This file is part of rastools.
+#
+# rastools is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# rastools is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# rastools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Threaded pipelines of processing stages connected by bounded queues"""
+
+from __future__ import (
+    unicode_literals,
+    print_function,
+    absolute_import,
+    division,
+    )
+
+import threading
+try:
+    import queue
+except ImportError:
+    # XXX Py2 only
+    import Queue as queue
+
+
+# The default number of items which a stage may produce ahead of the stage
+# after it
+QUEUE_SIZE = 2
+
+# How often (in seconds) blocked stages check whether the pipeline has stopped
+POLL_INTERVAL = 0.1
+
+_DONE = object()
+
+
+class _Failure(object):
+    "Carries an exception raised by a stage down the pipeline"
+
+    def __init__(self, exc):
+        self.exc = exc
+
+
+def _acquire(slots, stop):
+    "Takes a slot from slots unless the pipeline stops first"
+    while not stop.is_set():
+        try:
+            slots.get(timeout=POLL_INTERVAL)
+        except queue.Empty:
+            pass
+        else:
+            return True
+    return False
+
+def _items(q, slots, stop):
+    "Yields the items put on q until it's done or the pipeline stops"
+    while True:
+        try:
+            item = q.get(timeout=POLL_INTERVAL)
+        except queue.Empty:
+            if stop.is_set():
+                return
+        else:
+            if item is _DONE:
+                return
+            elif isinstance(item, _Failure):
+                raise item.exc
+            # The item's slot is returned as it's taken, so the stage before
+            # works on the next item while this one is handled
+            slots.put(None)
+            yield item
+
+def _feed(items, q, slots, stop):
+    """Puts everything from the iterable items on q, followed by _DONE
+
+    A slot is taken before each item is drawn from items, so an item which
+    is being produced counts against the queue's size just as one which is
+    waiting on it does.
+    """
+    items = iter(items)
+    try:
+        while _acquire(slots, stop):
+            try:
+                item = next(items)
+            except StopIteration:
+                break
+            q.put(item)
+        else:
+            return
+    except Exception as exc:
+        q.put(_Failure(exc))
+    else:
+        q.put(_DONE)
+
+def _connect(items, queue_size, stop):
+    "Returns a thread feeding items into a queue, and the queue's iterable"
+    q = queue.Queue()
+    slots = queue.Queue()
+    for _ in range(queue_size):
+        slots.put(None)
+    thread = threading.Thread(target=_feed, args=(items, q, slots, stop))
+    return thread, _items(q, slots, stop)
+
+def _apply(stage, items):
+    "Yields everything produced by stage for each of items"
+    for item in items:
+        for result in stage(item):
+            yield result
+
+
+def pipeline(source, stages=(), queue_size=QUEUE_SIZE):
+    """Runs the items of source through stages in background threads
+
+    The source iterable is consumed in a thread of its own, and each of stages
+    (callables which accept an item and return an iterable of zero or more
+    items for the next stage) runs in another. Each thread is connected to the
+    next by a queue, and a stage may be at most queue_size items ahead of the
+    stage after it, counting the item it's producing (so with a queue_size of
+    1, a stage produces the next item only while the stage after it handles
+    the last); a stage which gets ahead blocks until the next catches up. The results of the last
+    stage are yielded in the calling thread. With the stages running
+    concurrently, the total time approaches that of the slowest stage rather
+    than the sum of them all (provided the stages spend their time in I/O or
+    in code which releases the GIL, as numpy, zlib, and the Agg renderer do).
+
+    An exception raised in any stage stops the pipeline and is re-raised by
+    the generator; likewise, if the caller stops iterating early, the threads
+    are stopped.
+    """
+    if queue_size < 1:
+        raise ValueError('queue_size must be at least 1')
+    stop = threading.Event()
+    threads = []
+    items = source
+    for stage in stages:
+        thread, items = _connect(items, queue_size, stop)
+        threads.append(thread)
+        items = _apply(stage, items)
+    thread, items = _connect(items, queue_size, stop)
+    threads.append(thread)
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    try:
+        for item in items:
+            yield item
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+def parallel(calls):
+    """Calls each of calls (callables taking no arguments) in its own thread
+
+    Returns a list of their results once every call has returned. If any of
+    them raised an exception, the first (in the order of calls) is re-raised
+    instead, once the others have finished.
+    """
+    results = [None] * len(calls)
+    failures = [None] * len(calls)
+    def run(index, call):
+        try:
+            results[index] = call()
+        except Exception as exc:
+            failures[index] = _Failure(exc)
+    threads = [
+        threading.Thread(target=run, args=(index, call))
+        for (index, call) in enumerate(calls)
+        ]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for failure in failures:
+        if failure is not None:
+            raise failure.exc
+    return results
@@ -0,0 +1,232 @@
+# vim: set et sw=4 sts=4:
+
+# Copyright 2012 Dave Hughes.
+#
+# This file is part of rastools.
+#
+# rastools is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# rastools is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# rastools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Defines the channel processing base class shared by the utilities and the
+rendering API"""
+
+from __future__ import (
+    unicode_literals,
+    print_function,
+    absolute_import,
+    division,
+    )
+
+import logging
+
+import numpy as np
+
+from rastools.settings import Percentile, Range, Crop, Coord
+
+
+class RasError(Exception):
+    """
+    Base class for processing errors
+    """
+
+
+class RasChannelEmptyError(RasError):
+    """
+    Error raised when an empty channel is discovered
+    """
+
+
+class RasChannelProcessor(object):
+    """
+    Base class for classes which intend to process channel data.
+
+    This class provides the ability to perform percentile or straight range
+    limiting of channel data - functionality which is common to several tools
+    in the suite. The class attributes are as follows:
+
+    crop -- A Crop instance indicating the number of pixels that should be
+            cropped from each edge before data-limits are calculated
+    clip -- A Percentile or Range instance indicating the type and range of
+            limiting to be applied to channel data
+    empty -- If False (the default), then channels which are empty, or which
+            become empty after data limits are applied, will result in an
+            EmptyError exception being raised during a call to process()
+    stats_cache -- If not None, an LRUCache in which the domain and range of
+            each channel are kept by process_single() to avoid recalculating
+            them (which involves sorting the channel's data) when the same
+            channel is processed with the same crop and clip again, possibly
+            by another processor in another thread
+    """
+
+    def __init__(self, data_size):
+        self.data_size = Coord(*data_size)
+        self.crop = Crop(0, 0, 0, 0)
+        self.clip = None
+        self.empty = False
+        self.stats_cache = None
+
+    def process_multiple(self, *channels, **kwargs):
+        """Combine, crop, and limit the specified channels returning the data
+
+        Any number of channels may be specified (None may be given for a layer
+        which has no channel). The optional clips keyword argument provides a
+        Percentile or Range instance (or None) for each layer, overriding the
+        clip attribute for that layer.
+        """
+        clips = kwargs.get('clips') or [None] * len(channels)
+        clips = [clip or self.clip for clip in clips]
+        # Allocate the combined array at its cropped size, and in single
+        # precision (which is all matplotlib's image module needs). Layers
+        # without a channel are left as zeros and take no part in the
+        # statistics below
+        data = np.zeros((
+            self.data_size.y - self.crop.top - self.crop.bottom,
+            self.data_size.x - self.crop.left - self.crop.right,
+            len(channels)), np.float32)
+        data_domain = [Range(0.0, 0.0)] * len(channels)
+        data_range = [Range(0.0, 0.0)] * len(channels)
+        for index, (channel, clip) in enumerate(zip(channels, clips)):
+            if channel:
+                channel_data = channel.data[
+                    self.crop.top:self.data_size.y - self.crop.bottom,
+                    self.crop.left:self.data_size.x - self.crop.right]
+                data[..., index] = channel_data
+                data_domain[index] = Range(
+                    channel_data.min(), channel_data.max())
+                if isinstance(clip, Percentile):
+                    # Partitioning around the two percentile indexes gives the
+                    # same values as indexing a fully sorted copy, without the
+                    # cost of the sort
+                    size = channel_data.size
+                    low = min(size - 1, int(size * clip.low / 100.0))
+                    high = min(size - 1, int(size * clip.high / 100.0))
+                    vpartitioned = np.partition(
+                        channel_data, (low, high), axis=None)
+                    data_range[index] = Range(
+                        vpartitioned[low], vpartitioned[high])
+                elif isinstance(clip, Range):
+                    if clip.low < data_domain[index].low:
+                        logging.warning(
+                            'Layer %d channel (%d - %s) has no values below '
+                            '%d', index, channel.index, channel.name, clip.low)
+                    if clip.high > data_domain[index].high:
+                        logging.warning(
+                            'Layer %d channel (%d - %s) has no values above '
+                            '%d', index, channel.index, channel.name, clip.high)
+                    data_range[index] = Range(
+                        max(clip.low, data_domain[index].low),
+                        min(clip.high, data_domain[index].high))
+                else:
+                    data_range[index] = data_domain[index]
+        for (index, (channel, channel_domain, channel_range)) in enumerate(zip(
+                channels, data_domain, data_range)):
+            if channel:
+                if channel_range != channel_domain:
+                    logging.info(
+                        'Layer %d channel (%d - %s) has new range %d-%d',
+                        index, channel.index, channel.name,
+                        channel_range.low, channel_range.high)
+                if channel_range.low >= channel_range.high:
+                    logging.warning(
+                        'Layer %d channel (%d - %s) is empty',
+                        index, channel.index, channel.name)
+        return data, data_domain, data_range
+
+    def process_single(self, channel):
+        "Crop and limit the specified channel returning the domain and range"
+        # Perform any cropping requested. This must be done before calculation
+        # of the data's range and percentile limiting is performed
+        data = channel.data
+        data = data[
+            self.crop.top:data.shape[0] - self.crop.bottom,
+            self.crop.left:data.shape[1] - self.crop.right]
+        if self.stats_cache is None:
+            data_domain, data_range = self.channel_stats(channel, data)
+        else:
+            # Percentile and Range are both tuples so the clip's type must be
+            # part of the key
+            key = (channel, self.crop, type(self.clip), self.clip)
+            data_domain, data_range = self.stats_cache.compute(
+                key, lambda: self.channel_stats(channel, data))
+        if data_range.low >= data_range.high:
+            if self.empty:
+                logging.warning(
+                    'Channel %d (%s) is empty',
+                    channel.index, channel.name)
+            else:
+                logging.warning(
+                    'Channel %d (%s) is empty, skipping',
+                    channel.index, channel.name)
+                raise RasChannelEmptyError(
+                    'Channel %d is empty' % channel.index)
+        return data, data_domain, data_range
+
+    def channel_stats(self, channel, data):
+        "Returns the domain and (clipped) range of channel's cropped data"
+        # Find the minimum and maximum values in the channel and clip
+        # them to a percentile/range if requested
+        vsorted = np.sort(data, None)
+        data_domain = Range(vsorted[0], vsorted[-1])
+        logging.info(
+            'Channel %d (%s) has range %d-%d',
+            channel.index, channel.name, data_domain.low, data_domain.high)
+        if isinstance(self.clip, Percentile):
+            data_range = Range(
+                vsorted[min(
+                    len(vsorted) - 1,
+                    int(len(vsorted) * self.clip.low / 100.0))],
+                vsorted[min(
+                    len(vsorted) - 1,
+                    int(len(vsorted) * self.clip.high / 100.0))])
+            logging.info(
+                '%gth percentile is %d',
+                self.clip.low, data_range.low)
+            logging.info(
+                '%gth percentile is %d',
+                self.clip.high, data_range.high)
+        elif isinstance(self.clip, Range):
+            data_range = self.clip
+            if data_range.low < data_domain.low:
+                logging.warning(
+                    'Channel %d (%s) has no values below %d',
+                    channel.index, channel.name, data_range.low)
+            if data_range.high > data_domain.high:
+                logging.warning(
+                    'Channel %d (%s) has no values above %d',
+                    channel.index, channel.name, data_range.high)
+            data_range = Range(
+                max(data_range.low, data_domain.low),
+                min(data_range.high, data_domain.high))
+        else:
+            data_range = data_domain
+        if data_range != data_domain:
+            logging.info(
+                'Channel %d (%s) has new range %d-%d',
+                channel.index, channel.name, data_range.low, data_range.high)
+        return data_domain, data_range
+
+    def format_dict(self, **kwargs):
+        "Converts the configuration for use in format substitutions"
+        return dict(
+            percentile_from=
+                self.clip.low if isinstance(self.clip, Percentile) else None,
+            percentile_to=
+                self.clip.high if isinstance(self.clip, Percentile) else None,
+            range_from=
+                self.clip.low if isinstance(self.clip, Range) else None,
+            range_to=
+                self.clip.high if isinstance(self.clip, Range) else None,
+            crop_left=self.crop.left,
+            crop_top=self.crop.top,
+            crop_right=self.crop.right,
+            crop_bottom=self.crop.bottom,
+            **kwargs)
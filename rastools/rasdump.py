@@ -34,17 +34,18 @@ import logging
 
 from rastools.terminal import (
     RasApplication, RasChannelEmptyError, RasChannelProcessor)
+from rastools.journal import atomic_output
 
 
 class RasDumpUtility(RasApplication):
     """
-    %prog [options] data-file [channels-file]
+    %prog [options] data-file... [channels-file]
 
-    This utility accepts a data file and an optional channel definition file.
-    For each channel listed in the latter (or all channels if none is
-    provided), a dump is produced of the corresponding channel in the data
-    file.  Various options are provided for customizing the output including
-    percentile limiting, and output format.
+    This utility accepts one or more data files and an optional channel
+    definition file. For each channel listed in the latter (or all channels if
+    none is provided), a dump is produced of the corresponding channel in each
+    data file. Various options are provided for customizing the output
+    including percentile limiting, and output format.
 
     The available command line options are listed below.
     """
@@ -56,6 +57,7 @@ class RasDumpUtility(RasApplication):
             list_formats=False,
             output='{filename_root}_{channel:02d}_{channel_name}.csv',
             multi=False,
+            number_format=None,
         )
         self.parser.add_option(
             '--help-formats', dest='list_formats', action='store_true',
@@ -63,6 +65,9 @@ class RasDumpUtility(RasApplication):
         self.add_range_options()
         self.add_crop_option()
         self.add_empty_option()
+        self.add_jobs_option()
+        self.add_cache_options()
+        self.add_journal_options()
         self.parser.add_option(
             '-o', '--output', dest='output', action='store',
             help='specify the template used to generate the output filenames; '
@@ -73,6 +78,11 @@ class RasDumpUtility(RasApplication):
             help='if specified, produce a single output file with multiple '
             'pages or sheets, one per channel (only available with certain '
             'formats)')
+        self.parser.add_option(
+            '--number-format', dest='number_format', action='store',
+            help='specify the %-style format of values in CSV and TSV output '
+            '(e.g. %d, or %.2f). By default integer counts are written as '
+            'integers and other values at full precision')
 
     @property
     def data_writers(self):
@@ -90,13 +100,18 @@ class RasDumpUtility(RasApplication):
         if options.list_formats:
             self.list_formats()
             return 0
+        return self.run_batch(options, args)
+
+    def process(self, options, data_file):
+        "Dump the channels of data_file"
         # Verify the various command line options
-        data_file = self.parse_files(options, args)
         self.converter = RasConverter((data_file.x_size, data_file.y_size))
         self.converter.crop = self.parse_crop_option(options)
         self.converter.clip = self.parse_range_options(options)
         self.converter.empty = options.empty
+        self.converter.stats_cache = self.stats_cache
         writer_class, multi_class = self.parse_output_options(options)
+        writer_options = self.parse_number_format_option(options, writer_class)
         # Extract the specified channels
         logging.info(
             'File contains %d channels, extracting channels %s',
@@ -107,40 +122,69 @@ class RasDumpUtility(RasApplication):
                 if channel.enabled
             )
         )
+        cache = self.open_cache(options)
+        # Outputs are flushed to disk before being journalled as complete
+        sync = bool(options.journal)
         if options.multi:
             filename = options.output.format(
                 **data_file.format_dict(
                     **self.converter.format_dict()))
+            fetched, multi_complete = self.fetch_output(
+                cache, options, data_file,
+                [channel for channel in data_file.channels if channel.enabled],
+                filename)
+            if fetched:
+                return
             logging.warning('Writing all channels to %s', filename)
-            output = multi_class(filename, data_file)
-        try:
+            with atomic_output(filename, sync) as temp:
+                output = multi_class(temp, data_file)
+                try:
+                    for channel in data_file.channels:
+                        if channel.enabled:
+                            logging.warning(
+                                'Writing channel %d (%s) to new page',
+                                channel.index, channel.name)
+                            data = self.converter.convert(channel)
+                            if data is not None:
+                                output.write_page(data, channel)
+                finally:
+                    output.close()
+            multi_complete()
+        else:
             for channel in data_file.channels:
                 if channel.enabled:
-                    if options.multi:
-                        logging.warning(
-                            'Writing channel %d (%s) to new page',
-                            channel.index, channel.name)
-                    else:
-                        filename = options.output.format(
-                            **channel.format_dict(
-                                **self.converter.format_dict()))
-                        logging.warning(
-                            'Writing channel %d (%s) to %s',
-                            channel.index, channel.name, filename)
+                    filename = options.output.format(
+                        **channel.format_dict(
+                            **self.converter.format_dict()))
+                    fetched, complete = self.fetch_output(
+                        cache, options, data_file, [channel], filename)
+                    if fetched:
+                        continue
+                    logging.warning(
+                        'Writing channel %d (%s) to %s',
+                        channel.index, channel.name, filename)
                     data = self.converter.convert(channel)
                     if data is not None:
                         # Finally, dump the figure to disk as whatever format
-                        # the user requested
-                        if options.multi:
-                            output.write_page(data, channel)
-                        else:
-                            writer_class(filename, channel).write(data)
-        finally:
-            if options.multi:
-                output.close()
+                        # the user requested; single channel writers close
+                        # their output in write, but make sure of it before
+                        # atomic_output renames the file into place
+                        with atomic_output(filename, sync) as temp:
+                            writer = writer_class(
+                                temp, channel, **writer_options)
+                            try:
+                                writer.write(data)
+                            finally:
+                                close = getattr(writer, 'close', None)
+                                if close:
+                                    close()
+                        complete()
 
     def list_formats(self):
         "Prints the list of supported data formats to stdout"
+        sys.stdout.write(
+            'CSV, TSV, RAS, RAS_A, and DAT output may be compressed by adding '
+            '.gz, .bz2, .xz,\nor .zst to the filename (e.g. scan.csv.gz)\n\n')
         sys.stdout.write('The following file formats are available:\n\n')
         for ext in sorted(self.data_writers.keys()):
             sys.stdout.write('%-8s - %s\n' % (ext, self.data_writers[ext][-1]))
@@ -148,11 +192,23 @@ class RasDumpUtility(RasApplication):
 
     def parse_output_options(self, options):
         "Checks the validity of the --output and --multi options"
-        ext = os.path.splitext(options.output)[1]
+        from rastools.compression import (
+            COMPRESSORS, compression_suffix, strip_compression)
+        from rastools.data_writers import COMPRESSED_WRITERS
+        ext = os.path.splitext(strip_compression(options.output))[1]
         try:
             writer_class, multi_class, _ = self.data_writers[ext]
         except KeyError:
             self.parser.error('unknown output format "%s"' % ext)
+        suffix = compression_suffix(options.output)
+        if suffix:
+            if suffix not in COMPRESSORS:
+                self.parser.error(
+                    'support for %s compression is not available' % suffix)
+            if (multi_class if options.multi else writer_class) not in \
+                    COMPRESSED_WRITERS:
+                self.parser.error(
+                    'output format "%s" cannot be compressed' % ext)
         if options.multi and not multi_class:
             multi_ext = [
                 ext for (ext, (_, multi, _)) in self.data_writers.items()
@@ -167,6 +223,21 @@ class RasDumpUtility(RasApplication):
         return (writer_class, multi_class)
 
 
+    def parse_number_format_option(self, options, writer_class):
+        "Checks the validity of the --number-format option"
+        from rastools.csvwrite import CsvWriter
+        if options.number_format is None:
+            return {}
+        if not issubclass(writer_class, CsvWriter) or options.multi:
+            self.parser.error(
+                '--number-format may only be used with CSV or TSV output')
+        try:
+            options.number_format % 0
+        except (TypeError, ValueError):
+            self.parser.error(
+                '%s is not a valid --number-format' % options.number_format)
+        return {'number_format': options.number_format}
+
 class RasConverter(RasChannelProcessor):
     "Converter class for data files"
 
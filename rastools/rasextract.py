@@ -32,11 +32,13 @@ import os
 import re
 import sys
 import logging
+import optparse
 from operator import methodcaller
+from functools import partial
 
-import numpy as np
 import matplotlib
 import matplotlib.cm
+import matplotlib.colors
 import matplotlib.image
 
 try:
@@ -45,22 +47,36 @@ try:
 except ImportError:
     optcomplete = None
 
-from rastools.terminal import (
-    RasApplication, RasChannelEmptyError, RasChannelProcessor)
-from rastools.settings import BoundingBox, Coord, Range
+from rastools.terminal import RasApplication
+from rastools.pipeline import pipeline, parallel
+from rastools.cache import LRUCache
+from rastools.rasdump import RasDumpUtility
+from rastools.journal import atomic_output
+from rastools.settings import Coord, Range, Percentile, Layer
+from rastools.blend import BLEND_MODES, default_layer_color
+# The renderers used to live here; they are re-exported for any external code
+# which imports them from this module
+from rastools.render import (
+    DPI, BaseRenderer, LayeredRenderer, ChannelRenderer, MontageRenderer)
 
 
-DPI = 72.0
+# The template used to generate output filenames if --output isn't given
+DEFAULT_OUTPUT = '{filename_root}_{channel:02d}_{channel_name}.png'
+
+# The template used instead of DEFAULT_OUTPUT with --montage, which produces
+# one output per data file (so has no {channel} variables)
+DEFAULT_MONTAGE_OUTPUT = '{filename_root}_montage.png'
+
 
 class RasExtractUtility(RasApplication):
     """
-    %prog [options] data-file [channel-file]
+    %prog [options] data-file... [channel-file]
 
-    This utility accepts a data file and an optional channel definition file.
-    For each channel listed in the latter, an image is produced from the
-    corresponding channel in the data file. Various options are provided for
-    customizing the output including percentile limiting, color-mapping, and
-    drawing of axes and titles.
+    This utility accepts one or more data files and an optional channel
+    definition file. For each channel listed in the latter, an image is
+    produced from the corresponding channel in each data file. Various
+    options are provided for customizing the output including percentile
+    limiting, color-mapping, and drawing of axes and titles.
 
     The available command line options are listed below.
     """
@@ -68,6 +84,7 @@ class RasExtractUtility(RasApplication):
     def __init__(self):
         super(RasExtractUtility, self).__init__()
         self._image_writers = None
+        self._vector_writers = None
         self.parser.set_defaults(
             list_colormaps=False,
             list_formats=False,
@@ -81,13 +98,23 @@ class RasExtractUtility(RasApplication):
             show_histogram=False,
             bins=32,
             colormap='gray',
-            output='{filename_root}_{channel:02d}_{channel_name}.png',
+            output=None,
             title='',
             title_x='',
             title_y='',
             interpolation=None,
             layers=None,
+            blend='add',
             multi=False,
+            montage=False,
+            montage_columns=0,
+            raster_dpi=None,
+            raster_max_pixels=None,
+            png_encoder='agg',
+            png_compression=None,
+            png_strategy=None,
+            jpeg_quality=75,
+            jpeg_fast=False,
         )
         self.parser.add_option(
             '--help-colormaps', dest='list_colormaps', action='store_true',
@@ -102,6 +129,9 @@ class RasExtractUtility(RasApplication):
         self.add_range_options()
         self.add_crop_option()
         self.add_empty_option()
+        self.add_jobs_option()
+        self.add_cache_options()
+        self.add_journal_options()
         self.parser.add_option(
             '-a', '--axes', dest='show_axes', action='store_true',
             help='draw the coordinate axes in the output')
@@ -122,7 +152,7 @@ class RasExtractUtility(RasApplication):
             '-H', '--histogram', dest='show_histogram', action='store_true',
             help='draw a histogram of the channel values below the output')
         self.parser.add_option(
-            '--histogram-bins', dest='bins', action='store',
+            '--histogram-bins', dest='bins', action='store', type='int',
             help='specify the number of bins to use when constructing the '
             'histogram (default=%default)')
         opt = self.parser.add_option(
@@ -157,10 +187,13 @@ class RasExtractUtility(RasApplication):
             '--y-title', dest='title_y', action='store',
             help='specify the title for the Y-axis; imples --axes')
         opt = self.parser.add_option(
-            '-o', '--output', dest='output', action='store',
+            '-o', '--output', dest='output', action='append',
             help='specify the template used to generate the output filenames; '
             'supports {variables}, see --help-formats for supported file '
-            'formats. Default: %default')
+            'formats. May be specified multiple times to produce several '
+            'outputs (including the data formats of rasdump) from one read '
+            'of each data file. Default: %s (%s with --montage)' % (
+                DEFAULT_OUTPUT, DEFAULT_MONTAGE_OUTPUT))
         if optcomplete:
             opt.completer = optcomplete.RegexCompleter(
                 re.compile('.*' + ext.replace('.', '\.'))
@@ -173,9 +206,65 @@ class RasExtractUtility(RasApplication):
             'formats)')
         self.parser.add_option(
             '-L', '--layers', dest='layers', action='store',
-            help='store the specified channels as Red, Green, and Blue in '
-            'the resulting image. Channels are comma separated and specified '
-            'as 0-based numbers. Channels may be left empty')
+            help='blend the specified channels into a single false-color '
+            'image. Channels are comma separated and specified as 0-based '
+            'numbers, optionally followed by :color (a name or #rrggbb) and '
+            ':low-high (a count range, or a percentile range if suffixed '
+            'with %), e.g. 3:red,5:#00ffff:1-99%. Channels may be left '
+            'empty. By default the first three channels are Red, Green, '
+            'and Blue')
+        self.parser.add_option(
+            '--blend', dest='blend', action='store', type='choice',
+            choices=BLEND_MODES,
+            help='specify how --layers are combined; "add" sums the colors '
+            'of each layer while "max" takes the brightest. Default: '
+            '%default')
+        self.parser.add_option(
+            '-M', '--montage', dest='montage', action='store_true',
+            help='if specified, produce a single output image with all '
+            'channels laid out on a grid, each labelled with --title (by '
+            'default the channel number and name)')
+        self.parser.add_option(
+            '--montage-columns', dest='montage_columns', action='store',
+            type='int', help='specify the number of columns in the --montage '
+            'grid; by default the grid is roughly square')
+        self.parser.add_option(
+            '--dpi', dest='raster_dpi', action='store', type='float',
+            help='for vector output formats (SVG, PDF, EPS, etc.) downsample '
+            'the image to the specified resolution on the page before '
+            'embedding it. By default the image is embedded at full '
+            'resolution')
+        self.parser.add_option(
+            '--max-pixels', dest='raster_max_pixels', action='store',
+            type='int', help='for vector output formats, downsample the '
+            'image so that no more than the specified number of pixels are '
+            'embedded')
+        self.parser.add_option(
+            '--png-encoder', dest='png_encoder', action='store',
+            type='choice', choices=['agg', 'pil'],
+            help='specify the encoder used for PNG output; "agg" is '
+            'matplotlib\'s own encoder while "pil" encodes with PIL which '
+            'permits the compression to be configured. Default: %default')
+        self.parser.add_option(
+            '--png-compression', dest='png_compression', action='store',
+            type='int', help='specify the zlib compression level (0-9) of '
+            'PNG output; lower levels are quicker to write but produce larger '
+            'files. Implies --png-encoder=pil')
+        self.parser.add_option(
+            '--png-strategy', dest='png_strategy', action='store',
+            type='choice',
+            choices=['default', 'filtered', 'huffman', 'rle', 'fixed'],
+            help='specify the zlib strategy of PNG output; one of default, '
+            'filtered, huffman, rle, or fixed. Implies --png-encoder=pil')
+        self.parser.add_option(
+            '--jpeg-quality', dest='jpeg_quality', action='store',
+            type='int', help='specify the quality (1-95) of JPEG output. '
+            'Default: %default')
+        self.parser.add_option(
+            '--jpeg-fast', dest='jpeg_fast', action='store_true',
+            help='if specified, skip the extra pass which optimizes the '
+            'encoding of JPEG output; quicker to write but produces larger '
+            'files')
         if optcomplete:
             self.arg_completer = optcomplete.RegexCompleter(
                 re.compile('.*' + ext.replace('.', '\.'))
@@ -194,6 +283,14 @@ class RasExtractUtility(RasApplication):
             )
         return self._image_writers
 
+    @property
+    def vector_writers(self):
+        "Returns the set of canvas classes that produce vector output"
+        if self._vector_writers is None:
+            from rastools.image_writers import VECTOR_WRITERS
+            self._vector_writers = VECTOR_WRITERS
+        return self._vector_writers
+
     def main(self, options, args):
         if options.list_colormaps:
             self.list_colormaps()
@@ -223,6 +320,9 @@ class RasExtractUtility(RasApplication):
                 for (ext, desc) in self.list_input_formats()
             ))
             sys.stdout.write('\n\n')
+            sys.stdout.write(
+                'The data formats of rasdump (see rasdump --help-formats) '
+                'may also be given\nas --output templates\n\n')
             sys.stdout.write('The following output formats are supported:\n\n')
             sys.stdout.write('\n'.join(
                 '{0:<8} - {1}'.format(ext, desc)
@@ -230,13 +330,174 @@ class RasExtractUtility(RasApplication):
             ))
             sys.stdout.write('\n\n')
             return 0
-        # Configure the renderer from the command line options
-        data_file = self.parse_files(options, args)
-        options.layers = self.parse_layers(options, data_file)
-        if options.layers:
+        return self.run_batch(options, args)
+
+    def process(self, options, data_file):
+        "Extract images (and data) from the channels of data_file"
+        outputs = self.parse_outputs(options)
+        if len(outputs) == 1:
+            utility, output_options = outputs[0]
+            self.process_output(utility, output_options, data_file)
+            return
+        # The data is read once, and the statistics of each channel are
+        # calculated once (by whichever output needs them first) and shared
+        # between the outputs, each of which is drawn and encoded in its own
+        # thread
+        self.prefetch(options, data_file)
+        stats_cache = LRUCache(max(1, len(data_file.channels)))
+        for utility, _ in outputs:
+            utility.stats_cache = stats_cache
+        try:
+            parallel([
+                partial(
+                    self.process_output, utility, output_options, data_file)
+                for (utility, output_options) in outputs
+                ])
+        finally:
+            for utility, _ in outputs:
+                utility.stats_cache = None
+
+    def parse_outputs(self, options):
+        """Checks the validity of the --output templates
+
+        Returns (utility, options) for each template, where the options are
+        a copy of options for that template alone. Image outputs are produced
+        by this utility, and outputs in the data formats of rasdump by an
+        instance of RasDumpUtility (with the rasdump options which this
+        utility shares). When several templates are given, --multi applies
+        to those whose formats support it.
+        """
+        templates = options.output or [
+            DEFAULT_MONTAGE_OUTPUT if options.montage else DEFAULT_OUTPUT]
+        result = []
+        for template in templates:
+            ext = os.path.splitext(template)[1]
+            if ext in self.image_writers:
+                utility = self
+                output_options = optparse.Values(vars(options))
+                multi = self.image_writers[ext][3]
+            else:
+                utility = RasDumpUtility()
+                if utility.data_file_ext(template) not in \
+                        utility.data_writers:
+                    self.parser.error('unknown output format "%s"' % ext)
+                output_options = utility.parser.get_default_values()
+                for name in vars(output_options):
+                    if hasattr(options, name):
+                        setattr(output_options, name, getattr(options, name))
+                multi = utility.data_writers[
+                    utility.data_file_ext(template)][1]
+            output_options.output = template
+            if len(templates) > 1:
+                output_options.multi = options.multi and bool(multi)
+            result.append((utility, output_options))
+        if options.multi and not any(
+                output_options.multi for (_, output_options) in result):
+            self.parser.error(
+                '--multi requires an output format with pages or layers')
+        return result
+
+    def process_output(self, utility, options, data_file):
+        "Produces the output of options with utility (see parse_outputs)"
+        if utility is not self:
+            utility.process(options, data_file)
+            return
+        layers = self.parse_layers(options, data_file)
+        (   renderer,
+            canvas_class,
+            canvas_method,
+            multi_class,
+            encoder_options
+        ) = self.configure_renderer(options, data_file, layers)
+        renderer.stats_cache = self.stats_cache
+        # Extract the specified channels
+        logging.info(
+            'File contains %d channels, extracting channels %s',
+            len(data_file.channels),
+            ','.join(
+                str(channel.index)
+                for channel in data_file.channels
+                if channel.enabled
+            )
+        )
+        cache = self.open_cache(options)
+        # Outputs are flushed to disk before being journalled as complete
+        sync = bool(options.journal)
+        def encode_all(encode):
+            # Figures are drawn in one thread and encoded in another, so the
+            # encoding (and writing) of one channel overlaps the drawing of
+            # the next
+            for _ in pipeline(
+                    self.draw_figures(
+                        options, data_file, renderer, layers, cache),
+                    [encode]):
+                pass
+        if options.multi and not layers:
+            filename = options.output.format(
+                **data_file.format_dict(
+                    **renderer.format_dict()))
+            fetched, complete = self.fetch_output(
+                cache, options, data_file,
+                [channel for channel in data_file.channels if channel.enabled],
+                filename)
+            if fetched:
+                return
+            logging.warning('Writing all channels to %s',  filename)
+            with atomic_output(filename, sync) as temp:
+                output = multi_class(temp)
+                def encode(job):
+                    channel, _, figure, _ = job
+                    canvas_class(figure)
+                    output.savefig(
+                        figure,
+                        title='{channel} - {channel_name}'.format(
+                            **channel.format_dict()))
+                    return ()
+                try:
+                    encode_all(encode)
+                finally:
+                    output.close()
+            complete()
+        else:
+            def encode(job):
+                _, filename, figure, complete = job
+                # Finally, dump the figure to disk as whatever format the user
+                # requested
+                canvas = canvas_class(figure)
+                with atomic_output(filename, sync) as temp:
+                    canvas_method(canvas, temp, **encoder_options)
+                complete()
+                return ()
+            encode_all(encode)
+
+    def configure_renderer(self, options, data_file, layers):
+        """Constructs a renderer for data_file from the command line options
+
+        Returns the renderer, the canvas class and method used to encode its
+        figures, the class used for --multi output, and the encoder options.
+        """
+        if layers:
             if options.show_colorbar:
                 self.parser.error('you may not use --color-bar with --layers')
+            if options.montage:
+                self.parser.error('you may not use --montage with --layers')
             renderer = LayeredRenderer((data_file.x_size, data_file.y_size))
+            renderer.colors = [layer.color for layer in layers]
+            renderer.clips = [layer.clip for layer in layers]
+            renderer.blend = options.blend
+        elif options.montage:
+            if options.multi:
+                self.parser.error('you may not use --montage with --multi')
+            if options.show_colorbar or options.show_histogram:
+                self.parser.error(
+                    'you may not use --color-bar or --histogram with '
+                    '--montage')
+            if options.show_axes or options.title_x or options.title_y:
+                self.parser.error('you may not use --axes with --montage')
+            if options.montage_columns < 0:
+                self.parser.error('--montage-columns cannot be negative')
+            renderer = MontageRenderer((data_file.x_size, data_file.y_size))
+            renderer.columns = options.montage_columns
         else:
             renderer = ChannelRenderer((data_file.x_size, data_file.y_size))
         renderer.colormap = self.parse_colormap_option(options)
@@ -260,60 +521,91 @@ class RasExtractUtility(RasApplication):
         ) = self.parse_output_options(options)
         renderer.interpolation = self.parse_interpolation_option(
             options, default_interpolation)
-        # Extract the specified channels
-        logging.info(
-            'File contains %d channels, extracting channels %s',
-            len(data_file.channels),
-            ','.join(
-                str(channel.index)
-                for channel in data_file.channels
-                if channel.enabled
-            )
-        )
-        if options.layers:
-            filename = options.output.format(
-                **data_file.format_dict(
-                    **renderer.format_dict()))
-            logging.warning('Writing all layers to %s', filename)
-            figure = renderer.draw(*options.layers)
-            canvas = canvas_class(figure)
-            canvas_method(canvas, filename)
-        elif options.multi:
-            filename = options.output.format(
+        (   canvas_class,
+            canvas_method,
+            encoder_options
+        ) = self.parse_encoder_options(options, canvas_class, canvas_method)
+        (   renderer.raster_dpi,
+            renderer.raster_max_pixels
+        ) = self.parse_raster_options(options, canvas_class)
+        return (
+            renderer, canvas_class, canvas_method, multi_class,
+            encoder_options)
+
+    def format_output(self, options, mode, data_file, renderer):
+        """Returns the output filename for a figure of several channels
+
+        Only the variables of the data file are available to the template
+        (not those of a channel); the parser error names the offending
+        variable rather than letting a bare KeyError escape.
+        """
+        try:
+            return options.output.format(
                 **data_file.format_dict(
                     **renderer.format_dict()))
-            logging.warning('Writing all channels to %s',  filename)
-            output = multi_class(filename)
-            try:
-                for channel in data_file.channels:
-                    if channel.enabled:
-                        logging.warning(
-                            'Writing channel %d (%s) to new page/layer',
-                            channel.index, channel.name)
-                        figure = renderer.draw(channel)
-                        if figure is not None:
-                            canvas = canvas_class(figure)
-                            output.savefig(
-                                figure,
-                                title='{channel} - {channel_name}'.format(
-                                    **channel.format_dict()))
-            finally:
-                output.close()
+        except KeyError as exc:
+            self.parser.error(
+                'the output template %s uses {%s}, which is not available '
+                'with %s' % (options.output, exc.args[0], mode))
+
+    def draw_figures(self, options, data_file, renderer, layers, cache=None):
+        """Yields (channel, filename, figure, complete) for each output figure
+
+        The channel is None for figures of several channels (layers and
+        montages), and the filename is None for pages of --multi output.
+        Outputs which are unchanged (see fetch_output) are fetched rather than
+        drawn; complete must be called once the figure's output is written
+        (it is None for pages of --multi output).
+        """
+        if layers:
+            filename = self.format_output(
+                options, '--layers', data_file, renderer)
+            fetched, complete = self.fetch_output(
+                cache, options, data_file,
+                [layer.channel for layer in layers if layer.channel],
+                filename)
+            if not fetched:
+                logging.warning('Writing all layers to %s', filename)
+                yield None, filename, renderer.draw(
+                    *(layer.channel for layer in layers)), complete
+        elif options.montage:
+            filename = self.format_output(
+                options, '--montage', data_file, renderer)
+            channels = [
+                channel for channel in data_file.channels
+                if channel.enabled
+            ]
+            fetched, complete = self.fetch_output(
+                cache, options, data_file, channels, filename)
+            if not fetched:
+                logging.warning(
+                    'Writing montage of all channels to %s', filename)
+                figure = renderer.draw(channels)
+                if figure is not None:
+                    yield None, filename, figure, complete
         else:
             for channel in data_file.channels:
                 if channel.enabled:
-                    filename = options.output.format(
-                        **channel.format_dict(
-                            **renderer.format_dict()))
-                    logging.warning(
-                        'Writing channel %d (%s) to %s',
-                        channel.index, channel.name, filename)
+                    complete = None
+                    if options.multi:
+                        filename = None
+                        logging.warning(
+                            'Writing channel %d (%s) to new page/layer',
+                            channel.index, channel.name)
+                    else:
+                        filename = options.output.format(
+                            **channel.format_dict(
+                                **renderer.format_dict()))
+                        fetched, complete = self.fetch_output(
+                            cache, options, data_file, [channel], filename)
+                        if fetched:
+                            continue
+                        logging.warning(
+                            'Writing channel %d (%s) to %s',
+                            channel.index, channel.name, filename)
                     figure = renderer.draw(channel)
                     if figure is not None:
-                        # Finally, dump the figure to disk as whatever format
-                        # the user requested
-                        canvas = canvas_class(figure)
-                        canvas_method(canvas, filename)
+                        yield channel, filename, figure, complete
 
     def list_colormaps(self):
         "List the available colormaps"
@@ -342,15 +634,11 @@ class RasExtractUtility(RasApplication):
         )
 
     def parse_layers(self, options, data_file):
+        "Checks the validity of the --layers option"
         if options.layers is not None:
-            try:
-                red, green, blue = options.layers.split(',')
-            except ValueError:
-                self.parser.error(
-                    '--layers must be specified with three '
-                    'comma-separated channels')
-            result = [red, green, blue]
-            for index, channel in enumerate(result):
+            result = []
+            for index, spec in enumerate(options.layers.split(',')):
+                channel, color, clip = (spec.split(':', 2) + ['', ''])[:3]
                 if channel:
                     try:
                         channel = int(channel)
@@ -368,7 +656,37 @@ class RasExtractUtility(RasApplication):
                             'not exist in the source file' % channel)
                 else:
                     channel = None
-                result[index] = channel
+                if color:
+                    try:
+                        color = matplotlib.colors.colorConverter.to_rgb(color)
+                    except ValueError:
+                        self.parser.error(
+                            '%s is not a valid --layers color' % color)
+                else:
+                    color = default_layer_color(index)
+                if clip:
+                    cls = Range
+                    if clip.endswith('%'):
+                        cls = Percentile
+                        clip = clip[:-1]
+                    try:
+                        low, high = clip.split('-', 1)
+                        clip = cls(float(low), float(high))
+                    except ValueError:
+                        self.parser.error(
+                            '%s is not a valid --layers range' % spec)
+                    if clip.low > clip.high:
+                        self.parser.error(
+                            '--layers ranges must be specified low-high')
+                    if cls is Percentile and not (
+                            0.0 <= clip.low <= clip.high <= 100.0):
+                        self.parser.error(
+                            '--layers percentiles must be between 0 and 100')
+                else:
+                    clip = None
+                result.append(Layer(channel, color, clip))
+            if not any(layer.channel for layer in result):
+                self.parser.error('--layers must specify at least one channel')
             return result
 
     def parse_colormap_option(self, options):
@@ -462,6 +780,48 @@ class RasExtractUtility(RasApplication):
                     'output formats')
         return canvas_class, canvas_method, multi_class, default_interpolation
 
+    def parse_raster_options(self, options, canvas_class):
+        "Checks the validity of the --dpi and --max-pixels options"
+        if (options.raster_dpi is not None or
+                options.raster_max_pixels is not None):
+            if not canvas_class in self.vector_writers:
+                self.parser.error(
+                    '--dpi and --max-pixels may only be used with vector '
+                    'output formats')
+            if options.raster_dpi is not None and options.raster_dpi <= 0.0:
+                self.parser.error('--dpi must be greater than 0')
+            if (options.raster_max_pixels is not None and
+                    options.raster_max_pixels <= 0):
+                self.parser.error('--max-pixels must be greater than 0')
+        return options.raster_dpi, options.raster_max_pixels
+
+    def parse_encoder_options(self, options, canvas_class, canvas_method):
+        "Checks the validity of the PNG and JPEG encoder options"
+        ext = os.path.splitext(options.output)[1].lower()
+        if options.png_compression is not None or options.png_strategy:
+            options.png_encoder = 'pil'
+        if options.png_compression is not None and not (
+                0 <= options.png_compression <= 9):
+            self.parser.error('--png-compression must be between 0 and 9')
+        if not (1 <= options.jpeg_quality <= 95):
+            self.parser.error('--jpeg-quality must be between 1 and 95')
+        encoder_options = {}
+        if ext == '.png' and options.png_encoder == 'pil':
+            try:
+                from rastools.tiffwrite import FigureCanvasPIL
+            except ImportError:
+                self.parser.error('PIL is required for --png-encoder=pil')
+            canvas_class = FigureCanvasPIL
+            canvas_method = FigureCanvasPIL.print_png
+            if options.png_compression is not None:
+                encoder_options['compress_level'] = options.png_compression
+            if options.png_strategy:
+                encoder_options['strategy'] = options.png_strategy
+        elif ext in ('.jpg', '.jpeg'):
+            encoder_options['quality'] = options.jpeg_quality
+            encoder_options['optimize'] = not options.jpeg_fast
+        return canvas_class, canvas_method, encoder_options
+
     def parse_interpolation_option(self, options, default_interpolation):
         "Checks the validity of the --interpolation option"
         if options.interpolation is None:
@@ -473,339 +833,6 @@ class RasExtractUtility(RasApplication):
         return options.interpolation
 
 
-class BaseRenderer(RasChannelProcessor):
-    "Abstract renderer class for data files"
-
-    def __init__(self, data_size):
-        super(BaseRenderer, self).__init__(data_size)
-        self.colorbar = False
-        self.colormap = 'gray'
-        self.histogram = False
-        self.histogram_bins = 32
-        self.interpolation = 'nearest'
-        self.grid = False
-        self.axes = False
-        self.title = None
-        self.axes_titles = Coord(None, None)
-        self.axes_offsets = Coord(0.0, 0.0)
-        self.axes_scales = Coord(1.0, 1.0)
-        self.resize = 1.0
-
-    @property
-    def axes_extents(self):
-        "Returns the extents of the axes for the image, after offsets and scaling"
-        return (
-            Range(
-                self.axes_scales.x * (
-                    self.axes_offsets.x + self.crop.left),
-                self.axes_scales.x * (
-                    self.axes_offsets.x + self.data_size.x - self.crop.right)
-            ) +
-            Range(
-                self.axes_scales.y * (
-                    self.axes_offsets.y + self.data_size.y - self.crop.bottom),
-                self.axes_scales.y * (
-                    self.axes_offsets.y + self.crop.top)
-            )
-        )
-
-    @property
-    def margins_visible(self):
-        "Returns True if the image margins should be shown"
-        return (
-            self.axes
-            or self.histogram
-            or self.colorbar
-            or bool(self.title))
-
-    @property
-    def margin(self):
-        "Returns the size of the margins when drawing"
-        return Coord(0.75, 0.25) if self.margins_visible else Coord(0.0, 0.0)
-
-    @property
-    def sep_margin(self):
-        "Returns the size of the separator between image elements"
-        return 0.3
-
-    # The following properties calculate the figure dimensions and margins. The
-    # layout of objects in the final image is roughly as illustrated below.
-    # Objects which are not selected to appear take up no space. Only the IMAGE
-    # element is mandatory:
-    #
-    #   +-----------------+
-    #   |     margin.x    |
-    #   |                 |
-    #   | m    TITLE    m |
-    #   | a             a |
-    #   | r    IMAGE    r |
-    #   | g             g |
-    #   | i  HISTOGRAM  i |
-    #   | n             n |
-    #   | .  COLORBAR   . |
-    #   | y             y |
-    #   |     margin.x    |
-    #   +-----------------+
-    #
-    # Positions are calculated from the bottom up, but several dimensions
-    # depend on the image size. Hence, this is calculated first, then each
-    # bounding box from the bottom up is calculated followed by the overall
-    # figure box.
-
-    @property
-    def image_size(self):
-        "Returns the size of the image in pixels after cropping and resizing"
-        if isinstance(self.resize, Coord):
-            return self.resize
-        else:
-            return Coord(
-                self.resize * (self.data_size.x - self.crop.left - self.crop.right),
-                self.resize * (self.data_size.y - self.crop.top - self.crop.bottom),
-            )
-
-    @property
-    def colorbar_box(self):
-        "Returns the colorbar bounding box"
-        return BoundingBox(
-            self.margin.x,
-            self.margin.y,
-            self.image_size.x / DPI,
-            0.5 if self.colorbar else 0.0,
-        )
-
-    @property
-    def histogram_box(self):
-        "Returns the histogram bounding box"
-        return BoundingBox(
-            self.margin.x,
-            self.colorbar_box.top + (
-                self.sep_margin if self.colorbar else 0.0),
-            self.image_size.x / DPI,
-            self.image_size.y / DPI * 0.8 if self.histogram else 0.0,
-        )
-
-    @property
-    def image_box(self):
-        "Returns the image bounding box"
-        return BoundingBox(
-            self.margin.x,
-            self.histogram_box.top + (
-                self.sep_margin if self.colorbar or self.histogram else 0.0),
-            self.image_size.x / DPI,
-            self.image_size.y / DPI,
-        )
-
-    @property
-    def title_box(self):
-        "Returns the title bounding box"
-        return BoundingBox(
-            self.margin.x,
-            self.image_box.top,
-            self.image_box.width,
-            1.0 if bool(self.title) else 0.0,
-        )
-
-    @property
-    def figure_box(self):
-        "Returns the overall bounding box"
-        return BoundingBox(
-            0.0,
-            0.0,
-            self.image_box.width + (self.margin.x * 2),
-            self.title_box.top + self.margin.y,
-        )
-
-    def title_axes(self, figure):
-        "Construct and configure a set of axes for the title"
-        box = self.title_box.relative_to(self.figure_box)
-        axes = figure.add_axes(box)
-        axes.set_axis_off()
-        return axes
-
-    def image_axes(self, figure):
-        "Construct and configure a set of axes for an image"
-        axes = figure.add_axes(
-            self.image_box.relative_to(self.figure_box),
-            frame_on=self.axes or self.grid)
-        # Configure the x and y axes appearance
-        if self.grid:
-            axes.grid(color='k', linestyle='-')
-        else:
-            axes.grid(False)
-        if self.axes:
-            if self.axes_titles.x:
-                axes.set_xlabel(self.axes_titles.x.decode('string_escape'))
-            if self.axes_titles.y:
-                axes.set_ylabel(self.axes_titles.y.decode('string_escape'))
-        else:
-            axes.set_xticks([], False)
-            axes.set_yticks([], False)
-        return axes
-
-    def histogram_axes(self, figure):
-        "Construct and configure a set of axes for a histogram"
-        return figure.add_axes(self.histogram_box.relative_to(self.figure_box))
-
-    def colorbar_axes(self, figure):
-        "Construct and configure a set of axes for the colorbar"
-        return figure.add_axes(self.colorbar_box.relative_to(self.figure_box))
-
-    def format_dict(self, **kwargs):
-        "Converts the configuration for use in format substitutions"
-        result = super(BaseRenderer, self).format_dict()
-        result.update(
-            interpolation=self.interpolation,
-            colormap=self.colormap)
-        return result
-
-
-class LayeredRenderer(BaseRenderer):
-    "Renderer implementation for multi-layered images"
-
-    def draw(self, red_channel, green_channel, blue_channel):
-        "Draw the specified channels as a single image, returning the matplotlib figure"
-        assert not self.colorbar
-        data, data_domain, data_range = self.process_multiple(
-            red_channel, green_channel, blue_channel)
-        # Copy the data into a floating-point array (matplotlib's image module
-        # won't play with uint32 data - only uint8 or float32) and normalize it
-        # to values between 0.0 and 1.0
-        data = np.array(data, np.float)
-        for index in range(3):
-            low, high = data_range[index]
-            data[..., index] = data[..., index] - low
-            if (high - low):
-                data[..., index] = data[..., index] / (high - low)
-        figure = matplotlib.figure.Figure(
-            figsize=(self.figure_box.width, self.figure_box.height), dpi=DPI,
-            facecolor='w', edgecolor='w')
-        # Draw the various image elements within bounding boxes calculated from
-        # the metrics above
-        image = self.draw_image(data, data_range, figure)
-        if self.histogram:
-            self.draw_histogram(data, data_range, figure)
-        if bool(self.title):
-            self.draw_title(channel, figure)
-        return figure
-
-    def draw_image(self, data, data_range, figure):
-        "Draws the image of the data within the specified figure"
-        axes = self.image_axes(figure)
-        # Clamp all data to values between 0.0 and 1.0 (operate on a copy to
-        # ensure we don't mess with the original array which is needed for a
-        # histogram)
-        data = data.copy()
-        data[data < 0.0] = 0.0
-        data[data > 1.0] = 1.0
-        # The imshow() call takes care of clamping values with data_range and
-        # color-mapping
-        return axes.imshow(
-            data,
-            origin='upper',
-            extent=self.axes_extents,
-            interpolation=self.interpolation)
-
-    def draw_histogram(self, data, data_range, figure):
-        "Draws the data's historgram within the specified figure"
-        axes = self.histogram_axes(figure)
-        data_flat = np.empty((data.shape[0] * data.shape[1], 3))
-        for index in range(3):
-            data_flat[..., index] = data[..., index].flatten()
-        axes.hist(
-            data_flat,
-            bins=self.histogram_bins,
-            histtype='barstacked',
-            color=('red', 'green', 'blue'),
-            range=(0.0, 1.0))
-
-    def draw_title(self, channels, figure):
-        "Draws a title within the specified figure"
-        axes = self.title_axes(figure)
-        # The string_escape codec is used to permit new-line escapes, and
-        # various options are passed-thru to the channel formatter so things
-        # like percentile can be included in the title
-        title_dict = self.format_dict()
-        for prefix, channel in zip(('red', 'green', 'blue'), channels):
-            if channel:
-                for name, value in channel.format_dict():
-                    title_dict[prefix + '_' + name] = value
-        title = self.title.decode('string_escape').format(**title_dict)
-        axes.text(
-            0.5, 0, title,
-            horizontalalignment='center', verticalalignment='baseline',
-            multialignment='center', size='medium', family='sans-serif',
-            transform=axes.transAxes)
-
-
-class ChannelRenderer(BaseRenderer):
-    "Renderer implementation for single-channel images"
-
-    def draw(self, channel):
-        "Draw the specified channel, returning the matplotlib figure"
-        try:
-            data, data_domain, data_range = self.process_single(channel)
-        except RasChannelEmptyError:
-            return None
-        # Copy the data into a floating-point array (matplotlib's image module
-        # won't play with uint32 data - only uint8 or float32)
-        data = np.array(data, np.float)
-        figure = matplotlib.figure.Figure(
-            figsize=(self.figure_box.width, self.figure_box.height), dpi=DPI,
-            facecolor='w', edgecolor='w')
-        # Draw the various image elements within bounding boxes calculated from
-        # the metrics above
-        image = self.draw_image(data, data_range, figure)
-        if self.histogram:
-            self.draw_histogram(data, data_range, figure)
-        if self.colorbar:
-            self.draw_colorbar(image, data_domain, data_range, figure)
-        if bool(self.title):
-            self.draw_title(channel, figure)
-        return figure
-
-    def draw_image(self, data, data_range, figure):
-        "Draws the image of the data within the specified figure"
-        axes = self.image_axes(figure)
-        # The imshow() call takes care of clamping values with data_range and
-        # color-mapping
-        return axes.imshow(
-            data, cmap=matplotlib.cm.get_cmap(self.colormap),
-            origin='upper', extent=self.axes_extents,
-            vmin=data_range.low, vmax=data_range.high,
-            interpolation=self.interpolation)
-
-    def draw_histogram(self, data, data_range, figure):
-        "Draws the data's historgram within the specified figure"
-        axes = self.histogram_axes(figure)
-        axes.hist(data.flat, bins=self.histogram_bins, range=data_range)
-
-    def draw_colorbar(self, image, data_domain, data_range, figure):
-        "Draws a range color-bar within the specified figure"
-        axes = self.colorbar_axes(figure)
-        figure.colorbar(
-            image, cax=axes, orientation='horizontal',
-            extend=
-                'both' if data_range.low > data_domain.low and
-                          data_range.high < data_domain.high else
-                'max' if data_range.high < data_domain.high else
-                'min' if data_range.low > data_domain.low else
-                'neither')
-
-    def draw_title(self, channel, figure):
-        "Draws a title within the specified figure"
-        axes = self.title_axes(figure)
-        # The string_escape codec is used to permit new-line escapes, and
-        # various options are passed-thru to the channel formatter so things
-        # like percentile can be included in the title
-        title = self.title.decode('string_escape').format(
-            **channel.format_dict(**self.format_dict()))
-        axes.text(
-            0.5, 0, title,
-            horizontalalignment='center', verticalalignment='baseline',
-            multialignment='center', size='medium', family='sans-serif',
-            transform=axes.transAxes)
-
-
 main = RasExtractUtility()
 
 if __name__ == '__main__':
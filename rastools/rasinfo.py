@@ -35,12 +35,12 @@ from rastools.terminal import RasApplication
 
 class RasInfoUtility(RasApplication):
     """
-    %prog [options] data-file [channels-file]
+    %prog [options] data-file... [channels-file]
 
-    This utility accepts a source RAS file from QSCAN. It extracts and prints
-    the information from the RAS file's header. If the optional channels
-    definition file is also specified, then channels will be named in the
-    output as they would be with rasextract.
+    This utility accepts one or more source RAS files from QSCAN. It extracts
+    and prints the information from each RAS file's header. If the optional
+    channels definition file is also specified, then channels will be named
+    in the output as they would be with rasextract.
 
     The available command line options are listed below.
     """
@@ -143,6 +143,7 @@ class RasInfoUtility(RasApplication):
             channels=False,
         )
         self.add_empty_option()
+        self.add_jobs_option()
         self.parser.add_option(
             '-t', '--templates', dest='templates', action='store_true',
             help='output substitution templates used with rasextract '
@@ -154,7 +155,14 @@ class RasInfoUtility(RasApplication):
             'entire file which can take some time)')
 
     def main(self, options, args):
-        data_file = self.parse_files(options, args)
+        return self.run_batch(options, args)
+
+    def prefetch(self, options, data_file):
+        # Channel data is only needed for --channels
+        if options.channels:
+            super(RasInfoUtility, self).prefetch(options, data_file)
+
+    def process(self, options, data_file):
         self.query_header(options, data_file)
         if options.channels:
             for channel in data_file.channels:
@@ -31,6 +31,8 @@ import datetime as dt
 
 import numpy as np
 
+from rastools.compression import open_input, read_array
+
 
 class Error(ValueError):
     """Base exception class"""
@@ -193,7 +195,7 @@ class RasParser(object):
             self.progress_finish,
         ) = kwargs.get('progress', (None, None, None))
         try:
-            self._file = open(data_file, 'rb')
+            self._file = open_input(data_file, 'rb')
         except TypeError:
             self._file = data_file
         # Parse the header
@@ -379,9 +381,10 @@ class RasChannels(object):
             if self.parent.progress_start:
                 self.parent.progress_start()
             try:
-                data = np.fromfile(
-                    self.parent._file, dtype=np.uint32,
-                    count=self.parent.x_size * self.parent.y_size * len(self))
+                data = read_array(
+                    self.parent._file, np.uint32,
+                    self.parent.x_size * self.parent.y_size * len(self),
+                    progress=self.parent.progress_update)
                 for channel in self:
                     channel._data = data[channel.index::len(self)].reshape(
                         (self.parent.y_size, self.parent.x_size))
@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+# vim: set et sw=4 sts=4:
+
+# Copyright 2012 Dave Hughes.
+#
+# This file is part of rastools.
+#
+# rastools is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# rastools is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# rastools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Main module for the rasqueue utility.
+"""
+
+from __future__ import (
+    unicode_literals,
+    print_function,
+    absolute_import,
+    division,
+    )
+
+import os
+import sys
+import time
+import shlex
+import signal
+import logging
+import datetime
+import multiprocessing
+
+from rastools.terminal import RasApplication, normalize_path
+from rastools.raswatch import RECIPE_TOOLS
+from rastools.workqueue import WorkQueue, Heartbeat, worker_name
+
+
+class RasQueueUtility(RasApplication):
+    """
+    %prog [options] queue-dir [data-file...]
+
+    This utility spreads the processing of many data files across any number
+    of hosts sharing a filesystem. With --submit, a task is added to the
+    queue directory for each data file (or each channel of each data file),
+    to run the configured rasextract and rasdump commands. With --work, the
+    tasks are claimed and run until the queue is empty; run workers on as
+    many hosts as you like. With --status, a summary of the queue is
+    printed.
+
+    The available command line options are listed below.
+    """
+
+    def __init__(self):
+        super(RasQueueUtility, self).__init__()
+        self.parser.set_defaults(
+            action='work',
+            extract=[],
+            dump=[],
+            channels_file=None,
+            output_dir='.',
+            per_channel=False,
+            jobs=1,
+            lease=60.0,
+            max_attempts=3,
+            interval=1.0,
+            wait=False,
+        )
+        self.parser.add_option(
+            '-s', '--submit', dest='action', action='store_const',
+            const='submit',
+            help='add a task for each of the specified data files to the '
+            'queue')
+        self.parser.add_option(
+            '-w', '--work', dest='action', action='store_const', const='work',
+            help='claim and run tasks from the queue until it is empty (the '
+            'default)')
+        self.parser.add_option(
+            '-S', '--status', dest='action', action='store_const',
+            const='status',
+            help='print a summary of the queue\'s tasks and workers')
+        self.parser.add_option(
+            '-x', '--extract', dest='extract', action='append',
+            help='when submitting, run rasextract with the specified (quoted) '
+            'options on each data file. May be specified multiple times')
+        self.parser.add_option(
+            '-d', '--dump', dest='dump', action='append',
+            help='when submitting, run rasdump with the specified (quoted) '
+            'options on each data file. May be specified multiple times')
+        self.parser.add_option(
+            '-C', '--channels-file', dest='channels_file', action='store',
+            help='when submitting, use the specified channels definition '
+            'file for every data file')
+        self.parser.add_option(
+            '-o', '--output-dir', dest='output_dir', action='store',
+            help='when submitting, write output to the specified directory. '
+            'Default: the current directory')
+        self.parser.add_option(
+            '--per-channel', dest='per_channel', action='store_true',
+            help='when submitting, add a task for each enabled channel of '
+            'each data file, rather than one per data file')
+        self.parser.add_option(
+            '-j', '--jobs', dest='jobs', action='store', type='int',
+            help='run JOBS workers in this process (0 means one per CPU). '
+            'Default: %default')
+        self.parser.add_option(
+            '--lease', dest='lease', action='store', type='float',
+            help='requeue a running task if its worker has not renewed its '
+            'lease for LEASE seconds. Default: %default')
+        self.parser.add_option(
+            '--max-attempts', dest='max_attempts', action='store',
+            type='int',
+            help='fail a task once its lease has expired MAX_ATTEMPTS times. '
+            'Default: %default')
+        self.parser.add_option(
+            '-i', '--interval', dest='interval', action='store', type='float',
+            help='check for new tasks every INTERVAL seconds while others are '
+            'running. Default: %default')
+        self.parser.add_option(
+            '--wait', dest='wait', action='store_true',
+            help='keep waiting for new tasks when the queue is empty')
+
+    def parse_recipes(self, options):
+        "Parses the --extract and --dump options into a list of commands"
+        result = [
+            (tool, shlex.split(args))
+            for (tool, option) in (
+                ('rasextract', options.extract),
+                ('rasdump', options.dump))
+            for args in option
+            ]
+        if not result:
+            self.parser.error(
+                'you must specify at least one --extract or --dump command')
+        return result
+
+    def main(self, options, args):
+        if not args:
+            self.parser.error('you must specify a queue directory')
+        queue_dir, data_files = normalize_path(args[0]), args[1:]
+        if options.action != 'submit':
+            if data_files:
+                self.parser.error(
+                    'data files may only be specified with --submit')
+            if not os.path.isdir(queue_dir):
+                self.parser.error('%s is not a queue directory' % args[0])
+        if options.lease <= 0 or options.interval <= 0:
+            self.parser.error('--lease and --interval must be positive')
+        queue = WorkQueue(queue_dir)
+        if options.action == 'submit':
+            return self.submit(options, queue, data_files)
+        elif options.action == 'status':
+            return self.status(options, queue)
+        else:
+            return self.work(options, queue)
+
+    def submit(self, options, queue, data_files):
+        "Adds a task for each of data_files (or their channels) to queue"
+        if not data_files:
+            self.parser.error('you must specify a data file to submit')
+        for data_file in data_files:
+            ext = self.data_file_ext(data_file)
+            if ext not in self.data_parsers:
+                self.parser.error('unrecognized file extension %s' % ext)
+        recipes = self.parse_recipes(options)
+        channels_file = options.channels_file
+        if channels_file:
+            channels_file = normalize_path(channels_file)
+        output_dir = normalize_path(options.output_dir)
+        tasks = []
+        for data_file in data_files:
+            data_file = normalize_path(data_file)
+            if options.per_channel:
+                # Only the header is needed to list the channels
+                channels = [
+                    channel.index
+                    for channel in self.open_data_file(
+                        options, data_file, channels_file,
+                        progress=False).channels
+                    if channel.enabled]
+            else:
+                channels = [None]
+            for channel in channels:
+                tasks.append(dict(
+                    recipes=recipes,
+                    data_file=data_file,
+                    channels_file=channels_file,
+                    output_dir=output_dir,
+                    channel=channel))
+        queue.submit(tasks)
+        logging.warning('Submitted %d tasks to %s', len(tasks), queue.path)
+
+    def work(self, options, queue):
+        "Runs --jobs workers until queue is empty, returning an exit code"
+        if options.jobs < 0:
+            self.parser.error('--jobs cannot be negative')
+        if options.max_attempts < 1:
+            self.parser.error('--max-attempts must be at least 1')
+        jobs = options.jobs or multiprocessing.cpu_count()
+        if jobs == 1:
+            results = [_queue_work((queue.path, options))]
+        else:
+            pool = multiprocessing.Pool(jobs, _queue_init, (options,))
+            try:
+                results = pool.map(
+                    _queue_work, [(queue.path, options)] * jobs, 1)
+            finally:
+                pool.terminate()
+                pool.join()
+        done = sum(result[0] for result in results)
+        failed = sum(result[1] for result in results)
+        logging.warning(
+            'Ran %d tasks (%d failed) with %d workers', done + failed, failed,
+            jobs)
+        return 1 if failed else 0
+
+    def status(self, options, queue):
+        "Prints a summary of the tasks and workers of queue"
+        status = queue.status(options.lease)
+        sys.stdout.write(
+            'Queue %s: %d pending, %d running, %d done, %d failed\n' % (
+                queue.path, status['pending'], status['running'],
+                status['done'], status['failed']))
+        if status['expired']:
+            sys.stdout.write(
+                '%d running tasks have expired leases and will be requeued '
+                'by the next worker\n' % status['expired'])
+        finished = [
+            task for task in status['done_tasks'] + status['failed_tasks']
+            if task.get('started')]
+        if finished:
+            start = min(task['started'] for task in finished)
+            finish = max(task['finished'] for task in finished)
+            sys.stdout.write(
+                'Finished %d tasks between %s and %s (%.1f per minute)\n' % (
+                    len(finished), _format_time(start),
+                    _format_time(finish),
+                    len(finished) * 60 / max(1.0, finish - start)))
+            sys.stdout.write('\nWorkers:\n')
+            workers = {}
+            for task in finished:
+                workers.setdefault(task['worker'], []).append(task)
+            for worker, tasks in sorted(workers.items()):
+                sys.stdout.write(
+                    '  %-30s %5d tasks, %3d failed, %7.1fs mean, last '
+                    'finished %s\n' % (
+                        worker, len(tasks),
+                        sum(1 for task in tasks if task['code']),
+                        sum(task['finished'] - task['started']
+                            for task in tasks) / len(tasks),
+                        _format_time(max(task['finished'] for task in tasks))))
+        if status['running_tasks']:
+            sys.stdout.write('\nRunning:\n')
+            for task, worker, age in status['running_tasks']:
+                sys.stdout.write('  %s on %s (renewed %.0fs ago)\n' % (
+                    _describe(task), worker, age))
+        if status['failed_tasks']:
+            sys.stdout.write('\nFailed:\n')
+            for task in status['failed_tasks']:
+                sys.stdout.write('  %s on %s: %s\n' % (
+                    _describe(task), task.get('worker'),
+                    task.get('error') or 'exit code %s' % task.get('code')))
+
+
+def _format_time(timestamp):
+    "Formats timestamp for the --status summary"
+    return datetime.datetime.fromtimestamp(timestamp).strftime(
+        '%Y-%m-%d %H:%M:%S')
+
+
+def _describe(task):
+    "Returns a short description of task for the --status summary"
+    if task.get('channel') is None:
+        return task['data_file']
+    return '%s channel %d' % (task['data_file'], task['channel'])
+
+
+def _queue_init(options):
+    "Initializes a worker process of RasQueueUtility.work"
+    # The parent handles Ctrl+C by terminating the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.getLogger().setLevel(
+        logging.DEBUG if options.debug else logging.INFO)
+
+def _queue_work(args):
+    """Claims and runs tasks until the queue is empty
+
+    Returns the number of tasks which succeeded and failed.
+    """
+    path, options = args
+    queue = WorkQueue(path)
+    worker = worker_name()
+    done = failed = 0
+    while True:
+        queue.expire(options.lease, options.max_attempts, worker)
+        task, lease = queue.claim(worker)
+        if task is None:
+            # Wait for running tasks in case their leases expire
+            if not options.wait and not queue.list('running'):
+                break
+            time.sleep(options.interval)
+            continue
+        logging.info('%s running %s', worker, _describe(task))
+        started = time.time()
+        with Heartbeat(queue, lease, options.lease / 4):
+            try:
+                code = _queue_run(task)
+                error = None
+            except KeyboardInterrupt:
+                queue.release(task, lease)
+                raise
+            except Exception as exc:
+                code = 1
+                error = str(exc)
+                logging.error('Task %s failed: %s', task['id'], exc)
+        queue.finish(task, lease, dict(
+            worker=worker, started=started, finished=time.time(),
+            code=code, error=error))
+        if code:
+            failed += 1
+        else:
+            done += 1
+    logging.info('%s ran %d tasks (%d failed)', worker, done + failed, failed)
+    return done, failed
+
+def _queue_run(task):
+    """Runs each recipe of task in its output directory
+
+    Returns the highest exit code of the recipes.
+    """
+    output_dir = task['output_dir']
+    if not os.path.isdir(output_dir):
+        try:
+            os.makedirs(output_dir)
+        except OSError:
+            # Another worker may have created it in the meantime
+            if not os.path.isdir(output_dir):
+                raise
+    # Each worker process runs one task at a time so changing directory is
+    # safe, and lets the recipes' --output templates be relative
+    os.chdir(output_dir)
+    codes = []
+    for tool, args in task['recipes']:
+        # A fresh instance of the utility for each task, as it's told which
+        # channel to process
+        utility = type(
+            __import__(RECIPE_TOOLS[tool], fromlist=['main']).main)()
+        if task['channel'] is not None:
+            utility.channel_indexes = {task['channel']}
+        args = list(args) + [task['data_file']]
+        if task['channels_file']:
+            args.append(task['channels_file'])
+        try:
+            codes.append(utility(args))
+        except Exception:
+            codes.append(utility.handle(*sys.exc_info()))
+    return max(codes)
+
+
+main = RasQueueUtility()
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+# vim: set et sw=4 sts=4:
+
+# Copyright 2012 Dave Hughes.
+#
+# This file is part of rastools.
+#
+# rastools is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# rastools is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# rastools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Main module for the rasserve utility.
+"""
+
+from __future__ import (
+    unicode_literals,
+    print_function,
+    absolute_import,
+    division,
+    )
+
+import io
+import os
+import sys
+import time
+import logging
+import optparse
+import threading
+import mimetypes
+import traceback
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn, UnixStreamServer
+    from urllib.parse import urlsplit, unquote, parse_qsl
+except ImportError:
+    # XXX Py2 only
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn, UnixStreamServer
+    from urlparse import urlsplit, parse_qsl
+    from urllib import unquote
+
+from rastools.terminal import RasApplication, normalize_path
+from rastools.rasextract import RasExtractUtility
+from rastools.cache import LRUCache
+
+
+# The rasextract options which make no sense for a request (the output option
+# is derived from the request's format)
+EXCLUDED_OPTIONS = {
+    '--help', '--version', '--quiet', '--verbose', '--log-file', '--pdb',
+    '--help-colormaps', '--help-formats', '--help-interpolations',
+    '--output', '--multi', '--jobs', '--cache', '--cache-size', '--journal',
+    '--resume',
+    }
+
+# The number of channel statistics (domains and ranges) to keep
+STATS_CACHE_SIZE = 4096
+
+
+class RenderError(Exception):
+    "Raised when a request can't be rendered; carries the HTTP status"
+
+    def __init__(self, status, message):
+        super(RenderError, self).__init__(message)
+        self.status = status
+
+
+class RenderServer(object):
+    """Renders images of channels on request, caching what it can
+
+    Three caches are kept, each discarding its least recently used items when
+    full: parsed data files (with their channel data) bounded by the size of
+    their data, the domain and range of channels (the calculation of which
+    involves sorting the channel's data), and encoded images bounded by their
+    size.
+    """
+
+    def __init__(self, root, channels_file, parser_cache, image_cache):
+        self.root = root
+        self.channels_file = channels_file
+        self.extractor = RasExtractUtility()
+        # optparse keeps the state of a parse in the parser
+        self._parse_lock = threading.Lock()
+        self.parsers = LRUCache(
+            parser_cache,
+            sizeof=lambda value: value[-1],
+            on_evict=self.parser_evicted)
+        self.stats = LRUCache(STATS_CACHE_SIZE)
+        self.images = LRUCache(
+            image_cache, sizeof=lambda value: len(value[-1]))
+
+    def parser_evicted(self, key, value):
+        "Discard the statistics of an evicted data file's channels"
+        data_file = value[0]
+        self.stats.discard(lambda stats_key: stats_key[0].parent is data_file)
+
+    def resolve(self, path):
+        "Returns the data file path within root, and its size and mtime"
+        filename = normalize_path(os.path.join(self.root, path.lstrip('/')))
+        if not filename.startswith(self.root + os.sep):
+            raise RenderError(403, '%s is outside the served directory' % path)
+        if self.extractor.data_file_ext(filename) not in \
+                self.extractor.data_parsers:
+            raise RenderError(404, '%s is not a data file' % path)
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            raise RenderError(404, '%s does not exist' % path)
+        return filename, (stat.st_size, stat.st_mtime)
+
+    def data_file(self, filename, fingerprint, options):
+        """Returns the (cached) parser for filename with its data loaded
+
+        Concurrent requests for a file which isn't cached load it once. When
+        the file has changed, its previous version is discarded (along with
+        the statistics of its channels) before the new one is loaded.
+        """
+        def load():
+            for key, value in self.parsers.discard(
+                    lambda key: key[0] == filename):
+                self.parser_evicted(key, value)
+            logging.info('Loading %s', filename)
+            data_file = self.extractor.open_data_file(
+                options, filename, self.channels_file, progress=False)
+            size = sum(channel.data.nbytes for channel in data_file.channels)
+            return (data_file, size)
+        return self.parsers.compute((filename, fingerprint), load)[0]
+
+    def parse_query(self, query):
+        """Converts a query string into rasextract options
+
+        Each parameter is a long rasextract option without the leading
+        dashes (a parameter without a value is a flag), except channel which
+        selects the channel to render and format which selects the image
+        format. Returns the options, the channel index (or None), and the
+        image format.
+        """
+        args = []
+        channel = None
+        image_format = 'png'
+        for key, value in parse_qsl(query, keep_blank_values=True):
+            if key == 'channel':
+                try:
+                    channel = int(value)
+                except ValueError:
+                    raise RenderError(400, 'invalid channel %s' % value)
+            elif key == 'format':
+                image_format = value.lower()
+            else:
+                option = self.extractor.parser.get_option('--' + key)
+                if option is None or option.get_opt_string() in \
+                        EXCLUDED_OPTIONS:
+                    raise RenderError(400, 'unsupported option %s' % key)
+                if option.takes_value():
+                    args.append('--%s=%s' % (key, value))
+                else:
+                    args.append('--' + key)
+        if image_format == 'xcf' or '/' in image_format:
+            raise RenderError(400, 'unsupported format %s' % image_format)
+        try:
+            with self._parse_lock:
+                options, _ = self.extractor.parser.parse_args(args)
+        except optparse.OptParseError as exc:
+            raise RenderError(400, str(exc))
+        options.output = 'image.%s' % image_format
+        return options, channel, image_format
+
+    def render(self, path, query):
+        """Returns the content type and encoded image for a request
+
+        The result comes from the image cache if the data file hasn't changed
+        since the same request was last rendered.
+        """
+        filename, fingerprint = self.resolve(path)
+        key = (filename, fingerprint, query)
+        try:
+            return self.images[key]
+        except KeyError:
+            pass
+        options, channel, image_format = self.parse_query(query)
+        data_file = self.data_file(filename, fingerprint, options)
+        try:
+            layers = self.extractor.parse_layers(options, data_file)
+            renderer, canvas_class, canvas_method, _, encoder_options = \
+                self.extractor.configure_renderer(options, data_file, layers)
+        except optparse.OptParseError as exc:
+            raise RenderError(400, str(exc))
+        renderer.stats_cache = self.stats
+        if layers:
+            figure = renderer.draw(*(layer.channel for layer in layers))
+        elif options.montage:
+            figure = renderer.draw([
+                c for c in data_file.channels if c.enabled])
+        else:
+            channels = [
+                c for c in data_file.channels
+                if c.enabled and channel in (None, c.index)]
+            if not channels:
+                raise RenderError(404, 'channel %s does not exist' % channel)
+            figure = renderer.draw(channels[0])
+        if figure is None:
+            raise RenderError(404, 'channel %s is empty' % channel)
+        output = io.BytesIO()
+        canvas_method(canvas_class(figure), output, **encoder_options)
+        result = (
+            mimetypes.guess_type('image.' + image_format)[0] or
+                'application/octet-stream',
+            output.getvalue())
+        self.images[key] = result
+        return result
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    "Answers GET requests for images with the server's RenderServer"
+
+    def do_GET(self):
+        start = time.time()
+        url = urlsplit(self.path)
+        try:
+            content_type, body = self.server.renderer.render(
+                unquote(url.path), url.query)
+            status = 200
+        except RenderError as exc:
+            status, content_type, body = (
+                exc.status, 'text/plain', str(exc).encode('utf-8'))
+        except (ValueError, IOError) as exc:
+            status, content_type, body = (
+                500, 'text/plain', str(exc).encode('utf-8'))
+            logging.error('Failed to render %s: %s', self.path, exc)
+        except Exception:
+            status, content_type, body = (
+                500, 'text/plain', b'Internal error')
+            for line in traceback.format_exc().rstrip().split('\n'):
+                logging.error(line)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        logging.info(
+            '%s %d %d bytes in %.1fms',
+            self.path, status, len(body), (time.time() - start) * 1000)
+
+    def log_message(self, format, *args):
+        # Requests are logged by do_GET; this just routes errors to logging
+        # (and avoids address_string which fails for Unix sockets)
+        logging.debug(format, *args)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    "HTTP server handling each request in its own thread"
+    daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    "HTTP server on a Unix socket handling each request in its own thread"
+    daemon_threads = True
+
+
+class RasServeUtility(RasApplication):
+    """
+    %prog [options]
+
+    This utility runs a local HTTP server which renders images of the
+    channels of the data files beneath a directory on request, accepting the
+    same options as rasextract. Parsed data files, channel statistics, and
+    rendered images are cached so that repeated requests are answered
+    quickly.
+
+    The available command line options are listed below.
+    """
+
+    def __init__(self):
+        super(RasServeUtility, self).__init__()
+        self.parser.set_defaults(
+            bind='localhost:8000',
+            unix_socket=None,
+            root='.',
+            channels_file=None,
+            parser_cache=1024,
+            image_cache=256,
+        )
+        self.parser.add_option(
+            '-b', '--bind', dest='bind', action='store',
+            help='listen on the specified address:port. Default: %default')
+        self.parser.add_option(
+            '-u', '--unix-socket', dest='unix_socket', action='store',
+            help='listen on the specified Unix socket instead of TCP')
+        self.parser.add_option(
+            '-R', '--root', dest='root', action='store',
+            help='serve data files beneath the specified directory. Default: '
+            'the current directory')
+        self.parser.add_option(
+            '-C', '--channels-file', dest='channels_file', action='store',
+            help='use the specified channels definition file for every data '
+            'file')
+        self.parser.add_option(
+            '--parser-cache', dest='parser_cache', action='store', type='int',
+            help='keep up to PARSER_CACHE MB of parsed data files in memory. '
+            'Default: %default')
+        self.parser.add_option(
+            '--image-cache', dest='image_cache', action='store', type='int',
+            help='keep up to IMAGE_CACHE MB of rendered images in memory. '
+            'Default: %default')
+
+    def main(self, options, args):
+        if args:
+            self.parser.error('rasserve takes no arguments')
+        if options.parser_cache < 0 or options.image_cache < 0:
+            self.parser.error('cache sizes cannot be negative')
+        root = normalize_path(options.root)
+        if not os.path.isdir(root):
+            self.parser.error('%s is not a directory' % options.root)
+        channels_file = options.channels_file
+        if channels_file:
+            channels_file = normalize_path(channels_file)
+        if options.unix_socket:
+            if os.path.exists(options.unix_socket):
+                os.unlink(options.unix_socket)
+            server = ThreadingUnixHTTPServer(
+                options.unix_socket, RenderRequestHandler)
+            address = options.unix_socket
+        else:
+            host, _, port = options.bind.rpartition(':')
+            try:
+                port = int(port)
+            except ValueError:
+                self.parser.error('invalid --bind address %s' % options.bind)
+            server = ThreadingHTTPServer((host, port), RenderRequestHandler)
+            address = 'http://%s:%d/' % server.server_address[:2]
+        server.renderer = RenderServer(
+            root, channels_file,
+            options.parser_cache * 1048576, options.image_cache * 1048576)
+        logging.warning('Serving %s on %s', root, address)
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            if options.unix_socket:
+                os.unlink(options.unix_socket)
+
+
+main = RasServeUtility()
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,492 @@
+#!/usr/bin/env python
+# vim: set et sw=4 sts=4:
+
+# Copyright 2012 Dave Hughes.
+#
+# This file is part of rastools.
+#
+# rastools is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# rastools is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# rastools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Main module for the raswatch utility.
+"""
+
+from __future__ import (
+    unicode_literals,
+    print_function,
+    absolute_import,
+    division,
+    )
+
+import io
+import os
+import sys
+import time
+import shlex
+import signal
+import logging
+import multiprocessing
+
+try:
+    # Optionally import inotify_simple (for efficient watching on Linux) if
+    # it's installed
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+from rastools.terminal import RasApplication, normalize_path
+from rastools.compression import compression_suffix
+from rastools.rasparse import RasParser
+from rastools.journal import CheckpointJournal
+
+
+# The utilities which may be used in a recipe, and the modules which provide
+# their main instances
+RECIPE_TOOLS = {
+    'rasextract': 'rastools.rasextract',
+    'rasdump':    'rastools.rasdump',
+    }
+
+
+def ras_complete(filename, size):
+    """Returns True if the RAS file filename of size bytes holds a full scan
+
+    The header records the number of channels, points and lines of the scan
+    before any data is written, so a file which contains that much data is
+    complete even if the acquisition software hasn't yet closed it.
+    """
+    try:
+        with io.open(filename, 'rb') as f:
+            header = f.read(RasParser.header_struct.size)
+        if len(header) < RasParser.header_struct.size:
+            return False
+        fields = RasParser.header_struct.unpack(header)
+    except (IOError, OSError):
+        return False
+    channel_count, x_size, y_size = fields[16], fields[21], fields[22]
+    return size >= RasParser.header_struct.size + (
+        channel_count * x_size * y_size * 4)
+
+
+class PollingWatcher(object):
+    """Finds new and changed files by periodically scanning directories"""
+
+    def __init__(self, roots, recursive, interval):
+        self.roots = roots
+        self.recursive = recursive
+        self.interval = interval
+        self._state = None
+
+    def close(self):
+        "Stop watching"
+        pass
+
+    def scan(self, root):
+        "Yield the path of every file under root"
+        if self.recursive:
+            for path, dirs, files in os.walk(root):
+                for name in files:
+                    yield os.path.join(path, name)
+        else:
+            for name in os.listdir(root):
+                path = os.path.join(root, name)
+                if os.path.isfile(path):
+                    yield path
+
+    def changes(self):
+        """Returns the (path, root) of files which may have changed
+
+        The first call returns every existing file. Subsequent calls wait
+        up to interval seconds before returning.
+        """
+        if self._state is not None:
+            time.sleep(self.interval)
+        state = {}
+        for root in self.roots:
+            for path in self.scan(root):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                state[path] = (root, stat.st_size, stat.st_mtime)
+        old_state = self._state or {}
+        self._state = state
+        return [
+            (path, value[0])
+            for (path, value) in state.items()
+            if old_state.get(path) != value
+            ]
+
+
+class InotifyWatcher(PollingWatcher):
+    """Finds new and changed files with Linux's inotify"""
+
+    def __init__(self, roots, recursive, interval):
+        super(InotifyWatcher, self).__init__(roots, recursive, interval)
+        flags = inotify_simple.flags
+        self._flags = (
+            flags.CREATE | flags.MODIFY | flags.CLOSE_WRITE | flags.MOVED_TO)
+        self._inotify = inotify_simple.INotify()
+        self._dirs = {}
+        for root in roots:
+            self.add_watches(root, root)
+
+    def close(self):
+        self._inotify.close()
+
+    def add_watches(self, path, root):
+        "Watch the directory path (and its subdirectories if recursive)"
+        dirs = os.walk(path) if self.recursive else [(path, [], [])]
+        for dir_path, _, _ in dirs:
+            wd = self._inotify.add_watch(dir_path, self._flags)
+            self._dirs[wd] = (dir_path, root)
+
+    def changes(self):
+        if self._state is None:
+            # Start with every existing file
+            self._state = {}
+            return [
+                (path, root)
+                for root in self.roots
+                for path in self.scan(root)
+                ]
+        result = []
+        for event in self._inotify.read(timeout=int(self.interval * 1000)):
+            try:
+                dir_path, root = self._dirs[event.wd]
+            except KeyError:
+                continue
+            path = os.path.join(dir_path, event.name)
+            if event.mask & inotify_simple.flags.ISDIR:
+                if self.recursive and event.mask & (
+                        inotify_simple.flags.CREATE |
+                        inotify_simple.flags.MOVED_TO):
+                    # Files may have appeared in the new directory before the
+                    # watch was added
+                    self.add_watches(path, root)
+                    result.extend((p, root) for p in self.scan(path))
+            else:
+                result.append((path, root))
+        return result
+
+
+class RasWatchUtility(RasApplication):
+    """
+    %prog [options] watch-dir...
+
+    This utility watches the specified directories for new RAS and DAT files.
+    When a scan is complete, the configured rasextract and rasdump commands
+    are run on it, with their output written to a tree under the output
+    directory mirroring the layout of the watched directories.
+
+    The available command line options are listed below.
+    """
+
+    def __init__(self):
+        super(RasWatchUtility, self).__init__()
+        self.parser.set_defaults(
+            extract=[],
+            dump=[],
+            channels_file=None,
+            output_dir='.',
+            journal=None,
+            jobs=1,
+            settle=5.0,
+            interval=1.0,
+            poll=False,
+            recursive=False,
+            once=False,
+            stats_interval=300.0,
+        )
+        self.parser.add_option(
+            '-x', '--extract', dest='extract', action='append',
+            help='run rasextract with the specified (quoted) options on each '
+            'new data file. May be specified multiple times')
+        self.parser.add_option(
+            '-d', '--dump', dest='dump', action='append',
+            help='run rasdump with the specified (quoted) options on each '
+            'new data file. May be specified multiple times')
+        self.parser.add_option(
+            '-C', '--channels-file', dest='channels_file', action='store',
+            help='use the specified channels definition file for every data '
+            'file')
+        self.parser.add_option(
+            '-o', '--output-dir', dest='output_dir', action='store',
+            help='write output beneath the specified directory, which must '
+            'not be a watched directory. Default: the current directory')
+        self.parser.add_option(
+            '-J', '--journal', dest='journal', action='store',
+            help='record processed files in the specified file. Default: '
+            '.raswatch in the output directory')
+        self.parser.add_option(
+            '-j', '--jobs', dest='jobs', action='store', type='int',
+            help='process up to JOBS data files in parallel (0 means one per '
+            'CPU). Default: %default')
+        self.parser.add_option(
+            '-s', '--settle', dest='settle', action='store', type='float',
+            help='consider a data file complete when it has not changed for '
+            'SETTLE seconds (RAS files are also complete as soon as they '
+            'contain all the data declared in their header). Default: '
+            '%default')
+        self.parser.add_option(
+            '-i', '--interval', dest='interval', action='store', type='float',
+            help='check for changes every INTERVAL seconds. Default: %default')
+        self.parser.add_option(
+            '-p', '--poll', dest='poll', action='store_true',
+            help='scan the directories for changes instead of using inotify')
+        self.parser.add_option(
+            '-r', '--recursive', dest='recursive', action='store_true',
+            help='watch subdirectories of the watched directories too')
+        self.parser.add_option(
+            '--once', dest='once', action='store_true',
+            help='process the data files currently present and exit instead '
+            'of watching for new ones')
+        self.parser.add_option(
+            '--stats-interval', dest='stats_interval', action='store',
+            type='float',
+            help='log throughput and latency every STATS_INTERVAL seconds. '
+            'Default: %default')
+
+    def parse_recipes(self, options):
+        "Parses the --extract and --dump options into a list of commands"
+        result = [
+            (tool, shlex.split(args))
+            for (tool, option) in (
+                ('rasextract', options.extract),
+                ('rasdump', options.dump))
+            for args in option
+            ]
+        if not result:
+            self.parser.error(
+                'you must specify at least one --extract or --dump command')
+        return result
+
+    def main(self, options, args):
+        if not args:
+            self.parser.error('you must specify a directory to watch')
+        roots = [normalize_path(arg) for arg in args]
+        for root in roots:
+            if not os.path.isdir(root):
+                self.parser.error('%s is not a directory' % root)
+        recipes = self.parse_recipes(options)
+        if options.jobs < 0:
+            self.parser.error('--jobs cannot be negative')
+        if options.settle < 0 or options.interval <= 0:
+            self.parser.error(
+                '--settle and --interval must be positive')
+        output_dir = normalize_path(options.output_dir)
+        if output_dir in roots:
+            # The output of the watched directory would be written to it,
+            # where it couldn't be told apart from new data files
+            self.parser.error(
+                'the output directory %s is watched; specify another with '
+                '--output-dir' % output_dir)
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        channels_file = options.channels_file
+        if channels_file:
+            channels_file = normalize_path(channels_file)
+        # Every run resumes from the journal, so that files which haven't
+        # changed since they were last processed are skipped
+        journal = CheckpointJournal(
+            normalize_path(
+                options.journal or os.path.join(output_dir, '.raswatch')),
+            resume=True)
+        if options.poll or not inotify_simple or options.once:
+            watcher_class = PollingWatcher
+        else:
+            watcher_class = InotifyWatcher
+        logging.info(
+            'Watching %s with %s', ', '.join(roots), watcher_class.__name__)
+        watcher = watcher_class(roots, options.recursive, options.interval)
+        pool = multiprocessing.Pool(
+            options.jobs or multiprocessing.cpu_count(), _watch_init)
+        stats = WatchStats()
+        # pending maps each unprocessed path to its watched root and the size
+        # and modification time it had when it last changed, and when that was
+        pending = {}
+        running = []
+        try:
+            while True:
+                for path, root in watcher.changes():
+                    if self.wanted(path, root, output_dir, options.recursive):
+                        if path not in pending:
+                            logging.debug('Found %s', path)
+                            pending[path] = (root, None, None, None)
+                now = time.time()
+                for path, (root, size, mtime, since) in list(pending.items()):
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        # Deleted or renamed before it was complete
+                        del pending[path]
+                        continue
+                    if (stat.st_size, stat.st_mtime) != (size, mtime):
+                        pending[path] = (
+                            root, stat.st_size, stat.st_mtime, now)
+                    elif journal.completed(path):
+                        del pending[path]
+                    elif now - since >= options.settle or (
+                            # Events can arrive in quick succession, so
+                            # insist the file is still for an interval
+                            now - since >= min(
+                                options.settle, options.interval) and
+                            self.data_file_ext(path).lower() == '.ras' and
+                            not compression_suffix(path) and
+                            ras_complete(path, size)):
+                        del pending[path]
+                        logging.info('Processing %s (%d bytes)', path, size)
+                        out_path = os.path.join(
+                            output_dir, os.path.relpath(
+                                os.path.dirname(path), root))
+                        running.append((
+                            path, size, mtime, now,
+                            pool.apply_async(
+                                _watch_process,
+                                (recipes, path, channels_file, out_path))))
+                for job in [job for job in running if job[-1].ready()]:
+                    running.remove(job)
+                    path, size, mtime, queued, result = job
+                    try:
+                        code, elapsed = result.get()
+                    except Exception as exc:
+                        logging.critical('Failed to process %s: %s', path, exc)
+                        code, elapsed = 1, 0.0
+                    # Failures are recorded too; a file is only retried
+                    # once it changes
+                    journal.record(path, version=(size, mtime))
+                    stats.add(
+                        size, code, time.time() - mtime,
+                        time.time() - queued - elapsed, elapsed)
+                    if code:
+                        logging.critical('Failed to process %s', path)
+                    else:
+                        logging.info(
+                            'Finished %s in %.1fs, %.1fs after it was '
+                            'last written', path, elapsed, time.time() - mtime)
+                if options.stats_interval and (
+                        time.time() - stats.logged >= options.stats_interval):
+                    stats.log()
+                if options.once and not pending and not running:
+                    break
+        except KeyboardInterrupt:
+            logging.warning('Interrupted; abandoning %d files', len(running))
+        finally:
+            pool.terminate()
+            pool.join()
+            watcher.close()
+            stats.log()
+        return 1 if stats.failed else 0
+
+    def wanted(self, path, root, output_dir, recursive=False):
+        """Returns True if path (found under root) is a data file to process
+
+        Output (e.g. from rasdump -o foo.ras) is never processed. The output
+        of the data files in each watched directory is written to the
+        corresponding directory of the tree under output_dir, so path is
+        output if its directory is one of those. When output_dir is within
+        the watched tree, all of its contents are treated as output.
+        """
+        if self.data_file_ext(path) not in self.data_parsers:
+            return False
+        if output_dir.startswith(root + os.sep):
+            return not path.startswith(output_dir + os.sep)
+        rel_dir = os.path.relpath(os.path.dirname(path), output_dir)
+        if rel_dir == os.curdir:
+            return False
+        if rel_dir == os.pardir or rel_dir.startswith(os.pardir + os.sep):
+            return True
+        return not (recursive and os.path.isdir(os.path.join(root, rel_dir)))
+
+
+class WatchStats(object):
+    """Accumulates throughput and latency statistics for raswatch"""
+
+    def __init__(self):
+        self.started = self.logged = time.time()
+        self.processed = 0
+        self.failed = 0
+        self.size = 0
+        self.latencies = []
+        self.waits = []
+        self.elapsed = []
+
+    def add(self, size, code, latency, wait, elapsed):
+        """Record a processed file
+
+        The latency of a file is the time from its last modification until
+        its output was complete, wait is the time it spent queued for a
+        worker and elapsed the time taken to process it.
+        """
+        self.processed += 1
+        self.failed += bool(code)
+        self.size += size
+        self.latencies.append(latency)
+        self.waits.append(wait)
+        self.elapsed.append(elapsed)
+
+    def log(self):
+        "Log the statistics gathered so far"
+        self.logged = time.time()
+        minutes = max(self.logged - self.started, 1.0) / 60.0
+        logging.info(
+            'Processed %d files (%d failed, %.1fMB) at %.2f files/min',
+            self.processed, self.failed, self.size / 1048576.0,
+            self.processed / minutes)
+        if self.processed:
+            logging.info(
+                'Latency after last write: mean %.1fs, max %.1fs; '
+                'queued: mean %.1fs; processing: mean %.1fs',
+                sum(self.latencies) / self.processed, max(self.latencies),
+                sum(self.waits) / self.processed,
+                sum(self.elapsed) / self.processed)
+
+
+def _watch_init():
+    "Initializes a worker process of RasWatchUtility"
+    # Ctrl+C is handled by the watcher, which terminates the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def _watch_process(recipes, data_file, channels_file, output_dir):
+    """Runs each recipe on data_file in output_dir
+
+    Returns the highest exit code of the recipes, and the time taken.
+    """
+    start = time.time()
+    if not os.path.isdir(output_dir):
+        try:
+            os.makedirs(output_dir)
+        except OSError:
+            # Another worker may have created it in the meantime
+            if not os.path.isdir(output_dir):
+                raise
+    # Each worker process runs one file at a time so changing directory is
+    # safe, and lets the recipes' --output templates be relative
+    os.chdir(output_dir)
+    codes = []
+    for tool, args in recipes:
+        utility = __import__(RECIPE_TOOLS[tool], fromlist=['main']).main
+        args = list(args) + [data_file]
+        if channels_file:
+            args.append(channels_file)
+        try:
+            codes.append(utility(args))
+        except Exception:
+            codes.append(utility.handle(*sys.exc_info()))
+    return max(codes), time.time() - start
+
+
+main = RasWatchUtility()
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
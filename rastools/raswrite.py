@@ -25,11 +25,14 @@ from __future__ import (
     division,
     )
 
+import io
 import struct
 
 import numpy as np
 
+from rastools.compression import open_output
 from rastools.rasparse import RasParser
+from rastools.textformat import TextFormatter, write_text
 
 
 DEFAULT_X_MOTOR          = 'HORZ'
@@ -42,6 +45,9 @@ DEFAULT_SCAN_DIRECTION   = 2
 DEFAULT_SCAN_TYPE        = 1
 DEFAULT_X_DIRECTION      = -1
 
+# The type of the values in the data portion of a RAS file
+RAS_DTYPE = np.dtype(str('<u4'))
+
 RAS_ASCII_HEADER = """\
 Version:     {version_string}
 Comment1:    {comments[0]}
@@ -65,12 +71,26 @@ Data:
 
 """
 
+def write_array(f, data):
+    "Writes data to the file f as little-endian uint32 values"
+    data = np.ascontiguousarray(data, dtype=RAS_DTYPE)
+    try:
+        # Anything written with f.write() must be flushed before numpy writes
+        # to the underlying file descriptor
+        f.flush()
+        data.tofile(f)
+    except (AttributeError, IOError, OSError, ValueError, io.UnsupportedOperation):
+        # File-like objects without a file descriptor (e.g. BytesIO) get the
+        # array's buffer instead, which still avoids any per-value conversion
+        f.write(data.data)
+
+
 class RasAsciiWriter(object):
     "Single channel writer for the ASCII variant of the QSCAN RAS format"
 
     def __init__(self, filename_or_obj, channel):
         try:
-            self._file = open(filename_or_obj, 'w')
+            self._file = open_output(filename_or_obj, 'w')
         except TypeError:
             self._file = filename_or_obj
         self._data_file = channel.parent
@@ -95,8 +115,9 @@ class RasAsciiWriter(object):
                 'sweep_count', DEFAULT_SWEEP_COUNT),
             count_time=data_file.header.get('count_time', DEFAULT_COUNT_TIME),
         ))
+        formatter = TextFormatter([(' ', '')])
         for row in data:
-            self._file.write(''.join(' %d\n' % value for value in row))
+            write_text(self._file, formatter.format(row))
         self._file.close()
 
 
@@ -105,7 +126,7 @@ class RasWriter(object):
 
     def __init__(self, filename_or_obj, channel):
         try:
-            self._file = open(filename_or_obj, 'wb')
+            self._file = open_output(filename_or_obj, 'wb')
         except TypeError:
             self._file = filename_or_obj
         self._data_file = channel.parent
@@ -157,9 +178,7 @@ class RasWriter(object):
             0.0,          # offset 6
             data_file.header.get('run_number', 1),
         ))
-        output_struct = struct.Struct(str('I' * len(data[0])))
-        for row in data:
-            self._file.write(output_struct.pack(*(int(i) for i in row)))
+        write_array(self._file, data)
         self._file.close()
 
 
@@ -168,11 +187,12 @@ class RasAsciiMultiWriter(object):
 
     def __init__(self, filename_or_obj, data_file):
         if isinstance(filename_or_obj, str):
-            self._file = open(filename_or_obj, 'w')
+            self._file = open_output(filename_or_obj, 'w')
         else:
             self._file = filename_or_obj
         self._data_file = data_file
         self._data = None
+        self._count = 0
 
     def __enter__(self):
         return self
@@ -182,15 +202,28 @@ class RasAsciiMultiWriter(object):
 
     def write_page(self, data, channel):
         "Write the channel to the output file"
+        # Channels are interleaved in the output so all must be stored before
+        # anything is written; an array large enough for every enabled channel
+        # is allocated on the first call and each page is copied into its
+        # stride
         if self._data is None:
-            self._data = np.dstack((data,))
-        else:
-            self._data = np.dstack((self._data, data))
+            self._data = np.empty(
+                data.shape + (sum(
+                    1 for c in self._data_file.channels if c.enabled),),
+                data.dtype)
+        if self._count >= self._data.shape[2]:
+            raise ValueError('Too many channels written')
+        self._data[..., self._count] = data
+        self._count += 1
 
     def close(self):
         "Finalize and close the output file"
+        if self._data is None:
+            self._file.close()
+            return
         # Take a slice of the data which only includes the channels that got
         # written
+        self._data = self._data[..., :self._count]
         data_file = self._data_file
         self._file.write(RAS_ASCII_HEADER.format(
             version_string=RasParser.header_string,
@@ -208,16 +241,9 @@ class RasAsciiMultiWriter(object):
                 'sweep_count', DEFAULT_SWEEP_COUNT),
             count_time=data_file.header.get('count_time', DEFAULT_COUNT_TIME),
         ))
-        for raster in range(len(self._data[..., 0])):
-            self._file.write(
-                ''.join(
-                    ''.join(
-                        ' %d' % value
-                        for value in row
-                    ) + '\n'
-                    for row in self._data[raster]
-                )
-            )
+        formatter = TextFormatter([(' ', '')] * self._count)
+        for raster in self._data:
+            write_text(self._file, formatter.format(raster))
         self._file.close()
 
 
@@ -226,11 +252,12 @@ class RasMultiWriter(object):
     
     def __init__(self, filename_or_obj, data_file):
         try:
-            self._file = open(filename_or_obj, 'wb')
+            self._file = open_output(filename_or_obj, 'w+b')
         except TypeError:
             self._file = filename_or_obj
         self._data_file = data_file
         self._data = None
+        self._count = 0
 
     def __enter__(self):
         return self
@@ -238,15 +265,64 @@ class RasMultiWriter(object):
     def __exit__(self, t, v, tb):
         self.close()
 
+    def _allocate(self, shape):
+        "Allocate the interleaved output for channels of the specified shape"
+        # At most every enabled channel will be written (empty channels may be
+        # skipped); the file is sized for them all and memory-mapped (after
+        # the header which is only written once the channel count is known)
+        # so that each channel can be written to its stride as it arrives.
+        # Output which can't be mapped (e.g. a pipe or a BytesIO) falls back
+        # to a preallocated array
+        shape = shape + (sum(1 for c in self._data_file.channels if c.enabled),)
+        size = RasParser.header_struct.size + (
+            shape[0] * shape[1] * shape[2] + 1) * RAS_DTYPE.itemsize
+        try:
+            self._file.fileno()
+            self._file.seek(size - 1)
+            self._file.write(b'\0')
+            self._file.flush()
+            self._data = np.memmap(
+                self._file, dtype=RAS_DTYPE, mode='r+',
+                offset=RasParser.header_struct.size, shape=shape)
+        except (AttributeError, IOError, OSError, ValueError, io.UnsupportedOperation):
+            self._data = np.empty(shape, RAS_DTYPE)
+        else:
+            self._file.seek(0)
+
     def write_page(self, data, channel):
         "Write the channel to the output file"
         if self._data is None:
-            self._data = np.dstack((data,))
+            self._allocate(data.shape)
+        if self._count >= self._data.shape[2]:
+            raise ValueError('Too many channels written to %s' % self._file.name)
+        self._data[..., self._count] = data
+        self._count += 1
+
+    def _compact(self):
+        "Remove unwritten channels from the interleaved output"
+        # Rows are compacted in order; each row's destination never lies beyond
+        # its source, and each row is copied before being written back, so
+        # no unread data is overwritten
+        y_size, x_size, capacity = self._data.shape
+        if isinstance(self._data, np.memmap):
+            flat = self._data.reshape(-1)
+            for raster in range(y_size):
+                row = np.array(self._data[raster, :, :self._count])
+                start = raster * x_size * self._count
+                flat[start:start + row.size] = row.reshape(-1)
+            self._data.flush()
+            self._data = flat[:y_size * x_size * self._count].reshape(
+                (y_size, x_size, self._count))
         else:
-            self._data = np.dstack((self._data, data))
+            self._data = self._data[..., :self._count]
 
     def close(self):
         "Finalize and close the output file"
+        if self._data is None:
+            self._file.close()
+            return
+        if self._count < self._data.shape[2]:
+            self._compact()
         data_file = self._data_file
         comments = data_file.comments.split('\n') + [''] * 6
         def b(s):
@@ -291,13 +367,21 @@ class RasMultiWriter(object):
             0.0,          # offset 6
             data_file.header.get('run_number', 1),
         ))
-        output_struct = struct.Struct(
-            str('I' * len(self._data[..., 0][0]) * len(self._data[0, 0])))
-        for raster in range(len(self._data[..., 0])):
-            self._file.write(
-                output_struct.pack(*(int(i) for i in self._data[raster].flat)))
+        if isinstance(self._data, np.memmap):
+            # The data is already in place (the header was written above it);
+            # just flush it and drop anything allocated beyond it
+            self._data.flush()
+            self._file.seek(
+                RasParser.header_struct.size + self._data.nbytes)
+            self._data = None
+            mapped = True
+        else:
+            write_array(self._file, self._data)
+            mapped = False
         # XXX See the note in rasparse.py about the off-by-one error in the
         # header. This extraneous uint32 ensures that our output matches the
         # length of the original, bugs'n'all
-        self._file.write(struct.pack(str('I'), 0))
+        self._file.write(struct.pack(str('<I'), 0))
+        if mapped:
+            self._file.truncate()
         self._file.close()
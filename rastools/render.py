@@ -0,0 +1,653 @@
+# vim: set et sw=4 sts=4:
+
+# Copyright 2012 Dave Hughes.
+#
+# This file is part of rastools.
+#
+# rastools is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# rastools is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# rastools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Renders channel data to images without any terminal machinery.
+
+The renderer classes here are used by the rasextract utility, but may equally
+be used by other code. The render() and render_rgba() functions wrap them to
+produce encoded image data or a raw RGBA buffer in memory, e.g.::
+
+    from rastools.rasparse import RasParser
+    from rastools.render import render
+    from rastools.settings import Percentile
+
+    data_file = RasParser('scan.ras')
+    png = render(data_file.channels[3], colormap='hot', clip=Percentile(1, 99))
+
+Each call constructs its own renderer, figure, and canvas (pyplot and its
+global state are never used) so that calls may be made concurrently from
+several threads of a worker pool.
+"""
+
+from __future__ import (
+    unicode_literals,
+    print_function,
+    absolute_import,
+    division,
+    )
+
+import io
+import math
+import logging
+
+import numpy as np
+import matplotlib
+import matplotlib.cm
+import matplotlib.figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from rastools.processing import RasChannelEmptyError, RasChannelProcessor
+from rastools.settings import BoundingBox, Coord, Range
+from rastools.blend import blend_layers, default_layer_color
+
+
+DPI = 72.0
+
+
+def _configure(renderer, settings):
+    "Applies the settings dict to the attributes of renderer"
+    for name, value in settings.items():
+        if not hasattr(renderer, name):
+            raise ValueError('Unknown render setting %s' % name)
+        setattr(renderer, name, value)
+
+
+def _draw(channel, settings):
+    "Draws channel (or a sequence of channels as layers) returning the figure"
+    if isinstance(channel, (tuple, list)):
+        layers = [c for c in channel if c]
+        if not layers:
+            raise ValueError('no channels to render')
+        data_size = layers[0].data.shape
+        renderer = LayeredRenderer((data_size[1], data_size[0]))
+        _configure(renderer, settings)
+        return renderer.draw(*channel)
+    else:
+        data_size = channel.data.shape
+        renderer = ChannelRenderer((data_size[1], data_size[0]))
+        _configure(renderer, settings)
+        figure = renderer.draw(channel)
+        if figure is None:
+            raise RasChannelEmptyError('Channel %d is empty' % channel.index)
+        return figure
+
+
+def render(channel, format='png', encoder_options=None, **settings):
+    """Renders channel to an image, returning the encoded image as bytes.
+
+    The channel parameter is a channel object from one of the data parsers,
+    or a sequence of them (None may be given for empty layers) to be blended
+    into a single multi-layered image. The format parameter is the extension
+    of one of the image formats listed by rasextract --help-formats (without
+    the leading period). Additional keyword arguments set the attributes of
+    the renderer, e.g. colormap, clip, crop, resize, histogram, or title, and
+    encoder_options is an optional dict of keyword arguments for the format's
+    encoder (e.g. quality for JPEG output). If the channel is empty
+    RasChannelEmptyError is raised, and if every layer is None, ValueError.
+    """
+    from rastools.image_writers import IMAGE_WRITERS
+    ext = '.' + format.lower()
+    if ext == '.xcf':
+        # GIMP can only be driven with files on disk
+        raise ValueError('XCF images cannot be rendered in memory')
+    try:
+        canvas_class, canvas_method, default_interpolation = [
+            (cls, method, interp)
+            for (cls, method, exts, _, interp, _) in IMAGE_WRITERS
+            if ext in exts][0]
+    except IndexError:
+        raise ValueError('Unknown image format %s' % format)
+    settings.setdefault('interpolation', default_interpolation)
+    figure = _draw(channel, settings)
+    output = io.BytesIO()
+    canvas_method(canvas_class(figure), output, **(encoder_options or {}))
+    return output.getvalue()
+
+
+def render_rgba(channel, **settings):
+    """Renders channel to an image, returning it as an RGBA array.
+
+    The parameters are the same as for render(). The result is a read-only
+    numpy array of uint8 with the shape (height, width, 4) sharing the memory
+    of matplotlib's Agg canvas, so no copy of the image is made.
+    """
+    figure = _draw(channel, settings)
+    canvas = FigureCanvasAgg(figure)
+    canvas.draw()
+    renderer = canvas.get_renderer()
+    result = np.frombuffer(renderer.buffer_rgba(), np.uint8).reshape(
+        (int(renderer.height), int(renderer.width), 4))
+    result.flags.writeable = False
+    return result
+
+
+class BaseRenderer(RasChannelProcessor):
+    "Abstract renderer class for data files"
+
+    def __init__(self, data_size):
+        super(BaseRenderer, self).__init__(data_size)
+        self.colorbar = False
+        self.colormap = 'gray'
+        self.histogram = False
+        self.histogram_bins = 32
+        self.interpolation = 'nearest'
+        self.grid = False
+        self.axes = False
+        self.title = None
+        self.axes_titles = Coord(None, None)
+        self.axes_offsets = Coord(0.0, 0.0)
+        self.axes_scales = Coord(1.0, 1.0)
+        self.resize = 1.0
+        self.raster_dpi = None
+        self.raster_max_pixels = None
+
+    @property
+    def axes_extents(self):
+        "Returns the extents of the axes for the image, after offsets and scaling"
+        return (
+            Range(
+                self.axes_scales.x * (
+                    self.axes_offsets.x + self.crop.left),
+                self.axes_scales.x * (
+                    self.axes_offsets.x + self.data_size.x - self.crop.right)
+            ) +
+            Range(
+                self.axes_scales.y * (
+                    self.axes_offsets.y + self.data_size.y - self.crop.bottom),
+                self.axes_scales.y * (
+                    self.axes_offsets.y + self.crop.top)
+            )
+        )
+
+    @property
+    def margins_visible(self):
+        "Returns True if the image margins should be shown"
+        return (
+            self.axes
+            or self.histogram
+            or self.colorbar
+            or bool(self.title))
+
+    @property
+    def margin(self):
+        "Returns the size of the margins when drawing"
+        return Coord(0.75, 0.25) if self.margins_visible else Coord(0.0, 0.0)
+
+    @property
+    def sep_margin(self):
+        "Returns the size of the separator between image elements"
+        return 0.3
+
+    # The following properties calculate the figure dimensions and margins. The
+    # layout of objects in the final image is roughly as illustrated below.
+    # Objects which are not selected to appear take up no space. Only the IMAGE
+    # element is mandatory:
+    #
+    #   +-----------------+
+    #   |     margin.x    |
+    #   |                 |
+    #   | m    TITLE    m |
+    #   | a             a |
+    #   | r    IMAGE    r |
+    #   | g             g |
+    #   | i  HISTOGRAM  i |
+    #   | n             n |
+    #   | .  COLORBAR   . |
+    #   | y             y |
+    #   |     margin.x    |
+    #   +-----------------+
+    #
+    # Positions are calculated from the bottom up, but several dimensions
+    # depend on the image size. Hence, this is calculated first, then each
+    # bounding box from the bottom up is calculated followed by the overall
+    # figure box.
+
+    @property
+    def image_size(self):
+        "Returns the size of the image in pixels after cropping and resizing"
+        if isinstance(self.resize, Coord):
+            return self.resize
+        else:
+            return Coord(
+                self.resize * (self.data_size.x - self.crop.left - self.crop.right),
+                self.resize * (self.data_size.y - self.crop.top - self.crop.bottom),
+            )
+
+    @property
+    def colorbar_box(self):
+        "Returns the colorbar bounding box"
+        return BoundingBox(
+            self.margin.x,
+            self.margin.y,
+            self.image_size.x / DPI,
+            0.5 if self.colorbar else 0.0,
+        )
+
+    @property
+    def histogram_box(self):
+        "Returns the histogram bounding box"
+        return BoundingBox(
+            self.margin.x,
+            self.colorbar_box.top + (
+                self.sep_margin if self.colorbar else 0.0),
+            self.image_size.x / DPI,
+            self.image_size.y / DPI * 0.8 if self.histogram else 0.0,
+        )
+
+    @property
+    def image_box(self):
+        "Returns the image bounding box"
+        return BoundingBox(
+            self.margin.x,
+            self.histogram_box.top + (
+                self.sep_margin if self.colorbar or self.histogram else 0.0),
+            self.image_size.x / DPI,
+            self.image_size.y / DPI,
+        )
+
+    @property
+    def title_box(self):
+        "Returns the title bounding box"
+        return BoundingBox(
+            self.margin.x,
+            self.image_box.top,
+            self.image_box.width,
+            1.0 if bool(self.title) else 0.0,
+        )
+
+    @property
+    def figure_box(self):
+        "Returns the overall bounding box"
+        return BoundingBox(
+            0.0,
+            0.0,
+            self.image_box.width + (self.margin.x * 2),
+            self.title_box.top + self.margin.y,
+        )
+
+    def title_axes(self, figure):
+        "Construct and configure a set of axes for the title"
+        box = self.title_box.relative_to(self.figure_box)
+        axes = figure.add_axes(box)
+        axes.set_axis_off()
+        return axes
+
+    def image_axes(self, figure):
+        "Construct and configure a set of axes for an image"
+        axes = figure.add_axes(
+            self.image_box.relative_to(self.figure_box),
+            frame_on=self.axes or self.grid)
+        # Configure the x and y axes appearance
+        if self.grid:
+            axes.grid(color='k', linestyle='-')
+        else:
+            axes.grid(False)
+        if self.axes:
+            if self.axes_titles.x:
+                axes.set_xlabel(self.axes_titles.x.decode('string_escape'))
+            if self.axes_titles.y:
+                axes.set_ylabel(self.axes_titles.y.decode('string_escape'))
+        else:
+            axes.set_xticks([], False)
+            axes.set_yticks([], False)
+        return axes
+
+    def histogram_axes(self, figure):
+        "Construct and configure a set of axes for a histogram"
+        return figure.add_axes(self.histogram_box.relative_to(self.figure_box))
+
+    def colorbar_axes(self, figure):
+        "Construct and configure a set of axes for the colorbar"
+        return figure.add_axes(self.colorbar_box.relative_to(self.figure_box))
+
+    def histogram_counts(self, data, data_range):
+        "Returns the histogram counts and bin edges of data within data_range"
+        low, high = data_range
+        if data.dtype.kind in 'iu' and low < high and \
+                low == int(low) and high == int(high):
+            # For integer data (the common case with RAS files) within a
+            # range of whole numbers, the bin of each value can be calculated
+            # exactly with integer arithmetic and tallied with bincount, which
+            # is considerably cheaper than the general purpose np.histogram
+            low, high = int(low), int(high)
+            values = data[(data >= low) & (data <= high)].astype(np.int64)
+            values -= low
+            values *= self.histogram_bins
+            values //= (high - low)
+            # Values equal to high belong in the last (closed) bin
+            np.minimum(values, self.histogram_bins - 1, out=values)
+            counts = np.bincount(values, minlength=self.histogram_bins)
+            edges = np.linspace(low, high, self.histogram_bins + 1)
+            return counts, edges
+        return np.histogram(data, bins=self.histogram_bins, range=data_range)
+
+    def rasterize(self, data, size):
+        """Downsample image data for embedding at the specified size (in inches)
+
+        Returns a tuple of the (possibly) downsampled data and the
+        interpolation to draw it with. When neither raster_dpi nor
+        raster_max_pixels is set, or the data is already smaller than the
+        target, the data and interpolation are returned unchanged.
+        """
+        height, width = data.shape[:2]
+        target = Coord(width, height)
+        if self.raster_dpi:
+            target = Coord(
+                min(target.x, size.x * self.raster_dpi),
+                min(target.y, size.y * self.raster_dpi))
+        if self.raster_max_pixels and (
+                target.x * target.y > self.raster_max_pixels):
+            scale = math.sqrt(self.raster_max_pixels / (target.x * target.y))
+            target = Coord(target.x * scale, target.y * scale)
+        target = Coord(max(1, int(target.x)), max(1, int(target.y)))
+        if target == (width, height):
+            return data, self.interpolation
+        logging.info(
+            'Downsampling image from %dx%d to %dx%d',
+            width, height, target.x, target.y)
+        # Each output pixel is the mean of the block of input pixels it
+        # covers. The blocks are summed along each axis in turn by reduceat
+        # which handles non-integer scaling factors in a single vectorized
+        # pass over the data
+        rows = np.linspace(0, height, target.y + 1).astype(np.intp)
+        cols = np.linspace(0, width, target.x + 1).astype(np.intp)
+        result = np.add.reduceat(
+            np.add.reduceat(data, rows[:-1], axis=0, dtype=np.float64),
+            cols[:-1], axis=1)
+        counts = np.outer(np.diff(rows), np.diff(cols))
+        if result.ndim > 2:
+            counts = counts[..., np.newaxis]
+        result /= counts
+        # As the data now matches the resolution it will occupy on the page,
+        # it is embedded as is (vector backends embed the data unsampled when
+        # interpolation is "none")
+        return result.astype(data.dtype), 'none'
+
+    def format_dict(self, **kwargs):
+        "Converts the configuration for use in format substitutions"
+        result = super(BaseRenderer, self).format_dict()
+        result.update(
+            interpolation=self.interpolation,
+            colormap=self.colormap)
+        return result
+
+
+class LayeredRenderer(BaseRenderer):
+    "Renderer implementation for multi-layered images"
+
+    def __init__(self, data_size):
+        super(LayeredRenderer, self).__init__(data_size)
+        self.colors = None
+        self.clips = None
+        self.blend = 'add'
+
+    def layer_colors(self, count):
+        "Returns the colors of count layers"
+        if self.colors:
+            return self.colors
+        return [default_layer_color(index) for index in range(count)]
+
+    def draw(self, *channels):
+        "Draw the specified channels as a single image, returning the matplotlib figure"
+        assert not self.colorbar
+        data, data_domain, data_range = self.process_multiple(
+            *channels, clips=self.clips)
+        # The combined data is already a float32 array (matplotlib's image
+        # module won't play with uint32 data - only uint8 or float32) so we
+        # normalize it to values between 0.0 and 1.0 in place
+        for index in range(len(channels)):
+            low, high = data_range[index]
+            layer = data[..., index]
+            layer -= low
+            if (high - low):
+                layer /= (high - low)
+        figure = matplotlib.figure.Figure(
+            figsize=(self.figure_box.width, self.figure_box.height), dpi=DPI,
+            facecolor='w', edgecolor='w')
+        # Draw the various image elements within bounding boxes calculated from
+        # the metrics above. The histogram must be drawn first as drawing the
+        # image clamps the normalized data in place
+        if self.histogram:
+            self.draw_histogram(data, data_range, figure)
+        self.draw_image(data, data_range, figure)
+        if bool(self.title):
+            self.draw_title(channels, figure)
+        return figure
+
+    def draw_image(self, data, data_range, figure):
+        "Draws the image of the data within the specified figure"
+        axes = self.image_axes(figure)
+        # Clamp all layers to values between 0.0 and 1.0 and blend them into
+        # a single RGB image with their colors. The clamping is done in place
+        # to avoid another copy of the data, hence the histogram (which needs
+        # the unclamped values) must be drawn before this is called
+        data = blend_layers(
+            data, self.layer_colors(data.shape[-1]), self.blend)
+        data, interpolation = self.rasterize(
+            data, Coord(self.image_box.width, self.image_box.height))
+        return axes.imshow(
+            data,
+            origin='upper',
+            extent=self.axes_extents,
+            interpolation=interpolation)
+
+    def draw_histogram(self, data, data_range, figure):
+        "Draws the data's historgram within the specified figure"
+        axes = self.histogram_axes(figure)
+        # Calculate the counts for each layer of the normalized data, then
+        # draw them by weighting a single value per bin; this looks identical
+        # to passing every pixel to hist() at a fraction of the cost
+        counts = []
+        for index in range(data.shape[-1]):
+            layer_counts, edges = self.histogram_counts(
+                data[..., index], Range(0.0, 1.0))
+            counts.append(layer_counts)
+        axes.hist(
+            [edges[:-1]] * len(counts),
+            bins=edges,
+            weights=counts,
+            histtype='barstacked',
+            color=self.layer_colors(len(counts)),
+            range=(0.0, 1.0))
+
+    def draw_title(self, channels, figure):
+        "Draws a title within the specified figure"
+        axes = self.title_axes(figure)
+        # The string_escape codec is used to permit new-line escapes, and
+        # various options are passed-thru to the channel formatter so things
+        # like percentile can be included in the title. Each layer's values
+        # are prefixed with layerN_, and the first three layers may also be
+        # referred to with the red_, green_, and blue_ prefixes
+        title_dict = self.format_dict()
+        for index, channel in enumerate(channels):
+            if channel:
+                prefixes = ['layer%d' % index]
+                if index < 3:
+                    prefixes.append(('red', 'green', 'blue')[index])
+                for name, value in channel.format_dict().items():
+                    for prefix in prefixes:
+                        title_dict[prefix + '_' + name] = value
+        title = self.title.decode('string_escape').format(**title_dict)
+        axes.text(
+            0.5, 0, title,
+            horizontalalignment='center', verticalalignment='baseline',
+            multialignment='center', size='medium', family='sans-serif',
+            transform=axes.transAxes)
+
+
+class ChannelRenderer(BaseRenderer):
+    "Renderer implementation for single-channel images"
+
+    def draw(self, channel):
+        "Draw the specified channel, returning the matplotlib figure"
+        try:
+            data, data_domain, data_range = self.process_single(channel)
+        except RasChannelEmptyError:
+            return None
+        figure = matplotlib.figure.Figure(
+            figsize=(self.figure_box.width, self.figure_box.height), dpi=DPI,
+            facecolor='w', edgecolor='w')
+        # Draw the various image elements within bounding boxes calculated from
+        # the metrics above. The histogram is drawn from the original data so
+        # that integer channels can use the cheaper integer counting method
+        if self.histogram:
+            self.draw_histogram(data, data_range, figure)
+        # Copy the data into a floating-point array (matplotlib's image module
+        # won't play with uint32 data - only uint8 or float32)
+        data = np.array(data, np.float)
+        image = self.draw_image(data, data_range, figure)
+        if self.colorbar:
+            self.draw_colorbar(image, data_domain, data_range, figure)
+        if bool(self.title):
+            self.draw_title(channel, figure)
+        return figure
+
+    def draw_image(self, data, data_range, figure):
+        "Draws the image of the data within the specified figure"
+        axes = self.image_axes(figure)
+        data, interpolation = self.rasterize(
+            data, Coord(self.image_box.width, self.image_box.height))
+        # The imshow() call takes care of clamping values with data_range and
+        # color-mapping
+        return axes.imshow(
+            data, cmap=matplotlib.cm.get_cmap(self.colormap),
+            origin='upper', extent=self.axes_extents,
+            vmin=data_range.low, vmax=data_range.high,
+            interpolation=interpolation)
+
+    def draw_histogram(self, data, data_range, figure):
+        "Draws the data's historgram within the specified figure"
+        axes = self.histogram_axes(figure)
+        # Draw precomputed counts by weighting a single value per bin; this
+        # looks identical to passing every pixel to hist()
+        counts, edges = self.histogram_counts(data, data_range)
+        axes.hist(edges[:-1], bins=edges, weights=counts)
+
+    def draw_colorbar(self, image, data_domain, data_range, figure):
+        "Draws a range color-bar within the specified figure"
+        axes = self.colorbar_axes(figure)
+        figure.colorbar(
+            image, cax=axes, orientation='horizontal',
+            extend=
+                'both' if data_range.low > data_domain.low and
+                          data_range.high < data_domain.high else
+                'max' if data_range.high < data_domain.high else
+                'min' if data_range.low > data_domain.low else
+                'neither')
+
+    def draw_title(self, channel, figure):
+        "Draws a title within the specified figure"
+        axes = self.title_axes(figure)
+        # The string_escape codec is used to permit new-line escapes, and
+        # various options are passed-thru to the channel formatter so things
+        # like percentile can be included in the title
+        title = self.title.decode('string_escape').format(
+            **channel.format_dict(**self.format_dict()))
+        axes.text(
+            0.5, 0, title,
+            horizontalalignment='center', verticalalignment='baseline',
+            multialignment='center', size='medium', family='sans-serif',
+            transform=axes.transAxes)
+
+
+class MontageRenderer(BaseRenderer):
+    "Renderer implementation for a grid of single-channel images"
+
+    def __init__(self, data_size):
+        super(MontageRenderer, self).__init__(data_size)
+        self.columns = 0
+        self.gap = 1
+
+    def draw(self, channels):
+        "Draw the specified channels in a grid, returning the matplotlib figure"
+        tiles = []
+        for channel in channels:
+            try:
+                data, data_domain, data_range = self.process_single(channel)
+            except RasChannelEmptyError:
+                continue
+            tiles.append((channel, data, data_range))
+        if not tiles:
+            logging.warning('No channels to draw in the montage')
+            return None
+        columns = self.columns or int(math.ceil(math.sqrt(len(tiles))))
+        rows = int(math.ceil(len(tiles) / columns))
+        tile_height, tile_width = tiles[0][1].shape
+        # Rather than building a set of axes for each channel, the channels
+        # are color-mapped directly into the pixels of a single RGBA montage
+        # (with a white gap between each tile) which is then drawn by a single
+        # imshow() call
+        montage = np.empty((
+            rows * (tile_height + self.gap) - self.gap,
+            columns * (tile_width + self.gap) - self.gap,
+            4), np.uint8)
+        montage[...] = 255
+        colormap = matplotlib.cm.get_cmap(self.colormap)
+        normalized = np.empty((tile_height, tile_width), np.float32)
+        for index, (channel, data, data_range) in enumerate(tiles):
+            row, column = divmod(index, columns)
+            top = row * (tile_height + self.gap)
+            left = column * (tile_width + self.gap)
+            # Each channel is normalized to its own range
+            low, high = data_range
+            np.subtract(data, low, out=normalized, dtype=np.float32)
+            if (high - low):
+                normalized /= (high - low)
+            np.clip(normalized, 0.0, 1.0, out=normalized)
+            montage[
+                top:top + tile_height,
+                left:left + tile_width] = colormap(normalized, bytes=True)
+        if isinstance(self.resize, Coord):
+            scale = Coord(self.resize.x / tile_width, self.resize.y / tile_height)
+        else:
+            scale = Coord(self.resize, self.resize)
+        figure = matplotlib.figure.Figure(
+            figsize=(
+                montage.shape[1] * scale.x / DPI,
+                montage.shape[0] * scale.y / DPI),
+            dpi=DPI, facecolor='w', edgecolor='w')
+        axes = figure.add_axes((0.0, 0.0, 1.0, 1.0), frame_on=False)
+        axes.set_axis_off()
+        image, interpolation = self.rasterize(
+            montage, Coord(*figure.get_size_inches()))
+        axes.imshow(
+            image, origin='upper', aspect='auto',
+            interpolation=interpolation)
+        self.draw_labels(tiles, columns, montage.shape, figure)
+        return figure
+
+    def draw_labels(self, tiles, columns, montage_shape, figure):
+        "Draws a label in the top-left corner of each tile of the montage"
+        tile_height = tiles[0][1].shape[0]
+        tile_width = tiles[0][1].shape[1]
+        # The string_escape codec is used to permit new-line escapes, and
+        # various options are passed-thru to the channel formatter so things
+        # like percentile can be included in the label
+        if self.title:
+            template = self.title.decode('string_escape')
+        else:
+            template = '{channel} - {channel_name}'
+        for index, (channel, _, _) in enumerate(tiles):
+            row, column = divmod(index, columns)
+            figure.text(
+                column * (tile_width + self.gap) / montage_shape[1],
+                1.0 - (row * (tile_height + self.gap) / montage_shape[0]),
+                template.format(**channel.format_dict(**self.format_dict())),
+                horizontalalignment='left', verticalalignment='top',
+                size='small', family='sans-serif', color='w',
+                bbox=dict(facecolor='k', edgecolor='none', alpha=0.5))
@@ -28,6 +28,7 @@ Percentile = namedtuple('Percentile', ('low', 'high'))
 Range = namedtuple('Range', ('low', 'high'))
 Crop = namedtuple('Crop', ('top', 'left', 'bottom', 'right'))
 Coord = namedtuple('Coord', ('x', 'y'))
+Layer = namedtuple('Layer', ('channel', 'color', 'clip'))
 
 
 class BoundingBox(object):
@@ -38,9 +38,17 @@ import textwrap
 import logging
 import locale
 import traceback
+import re
 import glob
+import multiprocessing
 from itertools import chain
 
+try:
+    # XXX Py2 only
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
 try:
     # Optionally import optcomplete (for auto-completion) if it's installed
     import optcomplete
@@ -249,11 +257,17 @@ class TerminalApplication(object):
         raise NotImplementedError
 
 
-import numpy as np
-
 from rastools import __version__
 from rastools.terminal import TerminalApplication
-from rastools.settings import Percentile, Range, Crop, Coord
+from rastools.settings import Percentile, Range, Crop
+from rastools.compression import strip_compression, compression_suffix
+from rastools.cache import OutputCache
+from rastools.journal import CheckpointJournal, discard_partial
+from rastools.pipeline import pipeline
+# The processing classes used to live here; they are re-exported for the
+# utilities (and any external code) which import them from this module
+from rastools.processing import (
+    RasError, RasChannelEmptyError, RasChannelProcessor)
 
 class RasApplication(TerminalApplication):
     """
@@ -266,9 +280,27 @@ class RasApplication(TerminalApplication):
     status = ''
     progress = 0
 
+    # If set, only the channels with these indexes (which must also be enabled
+    # by any channels file) are processed; used by rasqueue to split a data
+    # file into a task per channel
+    channel_indexes = None
+
+    # If set, an LRUCache of channel statistics shared with other utilities
+    # producing outputs from the same data file (see RasChannelProcessor)
+    stats_cache = None
+
+    # Options which have no effect on the content of outputs, and are
+    # therefore excluded from output cache keys (along with any --help-*
+    # option)
+    uncached_options = {
+        'output', 'jobs', 'loglevel', 'logfile', 'debug', 'cache',
+        'cache_size', 'journal', 'resume'}
+
     def __init__(self):
         super(RasApplication, self).__init__(__version__)
         self._data_parsers = None
+        self._output_cache = None
+        self._journal = None
 
     @property
     def data_parsers(self):
@@ -376,24 +408,176 @@ class RasApplication(TerminalApplication):
             help='if specified, include empty channels in the output (by '
             'default empty channels are ignored)')
 
-    def parse_files(self, options, args):
-        "Parse the files specified and construct a data parser"
+    def add_jobs_option(self):
+        "Add a --jobs option to the command line parser"
+        self.parser.set_defaults(jobs=1)
+        self.parser.add_option(
+            '-j', '--jobs', dest='jobs', action='store', type='int',
+            help='when several data files are specified, process up to JOBS '
+            'of them in parallel (0 means one per CPU). Default: %default')
+
+    def parse_jobs_option(self, options, count):
+        "Parses the --jobs option for a batch of count files"
+        if options.jobs < 0:
+            self.parser.error('--jobs cannot be negative')
+        return max(1, min(count, options.jobs or multiprocessing.cpu_count()))
+
+    def add_cache_options(self):
+        "Add --cache and --cache-size options to the command line parser"
+        self.parser.set_defaults(cache=None, cache_size=1024)
+        self.parser.add_option(
+            '--cache', dest='cache', action='store',
+            help='keep outputs in the specified cache directory, and reuse '
+            'them (instead of regenerating them) when neither the input nor '
+            'the options have changed')
+        self.parser.add_option(
+            '--cache-size', dest='cache_size', action='store', type='int',
+            help='limit the --cache directory to CACHE_SIZE MB, discarding '
+            'the least recently used outputs. Default: %default')
+
+    def open_cache(self, options):
+        "Returns the OutputCache selected by --cache, or None"
+        if not options.cache:
+            return None
+        if options.cache_size < 0:
+            self.parser.error('--cache-size cannot be negative')
+        path = normalize_path(options.cache)
+        if self._output_cache is None or self._output_cache.path != path:
+            self._output_cache = OutputCache(
+                path, options.cache_size * 1048576)
+        return self._output_cache
+
+    def add_journal_options(self):
+        "Add --journal and --resume options to the command line parser"
+        self.parser.set_defaults(journal=None, resume=False)
+        self.parser.add_option(
+            '--journal', dest='journal', action='store',
+            help='record each completed output in the specified journal file')
+        self.parser.add_option(
+            '--resume', dest='resume', action='store_true',
+            help='skip the outputs which the --journal records as completed '
+            'by a previous (interrupted) run, and redo the rest')
+
+    def open_journal(self, options):
+        "Returns the CheckpointJournal selected by --journal, or None"
+        if not getattr(options, 'journal', None):
+            if getattr(options, 'resume', False):
+                self.parser.error('--resume requires --journal')
+            return None
+        path = normalize_path(options.journal)
+        if self._journal is None or self._journal.filename != path:
+            self._journal = CheckpointJournal(path, options.resume)
+        return self._journal
+
+    def output_key(self, options, data_file, channels, filename):
+        """Returns the output cache key of filename
+
+        The key covers the fingerprint of data_file, its header, the index
+        and name of each of channels, the format of filename, and every
+        option which can affect the output. Returns None if data_file isn't a
+        file which can be fingerprinted (e.g. stdin).
+        """
+        try:
+            fingerprint = OutputCache.fingerprint(data_file.filename)
+        except (IOError, OSError):
+            return None
+        option_values = dict(
+            (name, value) for (name, value) in vars(options).items()
+            if name not in self.uncached_options
+            and not name.startswith('list_'))
+        header = data_file.format_dict()
+        # The data file's path only matters if a template (e.g. --title)
+        # refers to it
+        if not any(
+                re.search(r'\{filename[}:!]', value)
+                for value in option_values.values()
+                if isinstance(value, str)):
+            header.pop('filename', None)
+        return OutputCache.key(
+            __version__,
+            fingerprint,
+            header,
+            [(channel.index, channel.name) for channel in channels],
+            os.path.splitext(strip_compression(filename))[-1].lower() +
+                compression_suffix(filename).lower(),
+            option_values)
+
+    def fetch_output(self, cache, options, data_file, channels, filename):
+        """Fetches the output filename if it's unchanged
+
+        Returns a tuple of (fetched, complete). The output is fetched if the
+        --journal records it as completed by the run being resumed, or if
+        it's in cache. If fetched is False, filename must be written (see
+        atomic_output) and then complete must be called, to store it in cache
+        and record it in the journal.
+        """
+        journal = self.open_journal(options)
+        unit = (
+            normalize_path(data_file.filename),
+            [channel.index for channel in channels],
+            normalize_path(filename))
+        if journal:
+            # Inputs which can't be journalled (like stdin) are never complete
+            if journal.completed(*unit):
+                logging.warning('Skipping completed %s', filename)
+                return True, None
+            if options.resume:
+                discard_partial(unit[-1])
+        key = None
+        if cache is not None:
+            key = self.output_key(options, data_file, channels, filename)
+        def complete():
+            if key is not None:
+                cache.store(key, filename)
+            if journal:
+                journal.record(*unit)
+        if key is not None:
+            if cache.fetch(key, filename):
+                logging.warning(
+                    'Reusing unchanged %s from the cache', filename)
+                if journal:
+                    journal.record(*unit)
+                return True, None
+            cache.detach(filename)
+        return False, complete
+
+    def data_file_ext(self, filename):
+        "Returns the extension of filename which selects its data parser"
+        return os.path.splitext(strip_compression(filename))[-1]
+
+    def parse_file_list(self, options, args):
+        """Parse the files specified into data files and a channels file
+
+        Any number of data files may be given. If the last of several
+        arguments doesn't have the extension of a data file it's the channels
+        file (which applies to every data file).
+        """
         if len(args) == 0:
             self.parser.error('you must specify a data file')
-        elif len(args) == 1:
-            args = (args[0], None)
-        elif len(args) > 2:
-            self.parser.error('you cannot specify more than two filenames')
-        data_file, channels_file = args
-        if data_file == '-' and channels_file == '-':
+        if len(args) > 1 and self.data_file_ext(args[-1]) not in self.data_parsers:
+            data_files, channels_file = args[:-1], args[-1]
+        else:
+            data_files, channels_file = args, None
+        if '-' in data_files and channels_file == '-':
             self.parser.error('you cannot specify stdin for both files!')
-        # XXX #15: what format is stdin?
-        ext = os.path.splitext(data_file)[-1]
+        if '-' in data_files and len(data_files) > 1:
+            self.parser.error(
+                'you cannot specify stdin with several data files')
+        for data_file in data_files:
+            # XXX #15: what format is stdin?
+            ext = self.data_file_ext(data_file)
+            if ext not in self.data_parsers:
+                self.parser.error('unrecognized file extension %s' % ext)
+        return data_files, channels_file
+
+    def open_data_file(self, options, data_file, channels_file, progress=True):
+        "Construct a data parser for data_file"
+        ext = self.data_file_ext(data_file)
         data_file, channels_file = (
             sys.stdin if arg == '-' else arg
             for arg in (data_file, channels_file)
         )
-        if options.loglevel < logging.WARNING:
+        if progress and options.loglevel < logging.WARNING:
             progress = (
                 self.progress_start,
                 self.progress_update,
@@ -404,7 +588,159 @@ class RasApplication(TerminalApplication):
             parser = self.data_parsers[ext][0]
         except KeyError:
             self.parser.error('unrecognized file extension %s' % ext)
-        return parser(data_file, channels_file, progress=progress)
+        result = parser(data_file, channels_file, progress=progress)
+        if self.channel_indexes is not None:
+            for channel in result.channels:
+                if channel.index not in self.channel_indexes:
+                    channel.enabled = False
+        return result
+
+    def parse_files(self, options, args):
+        "Parse the files specified and construct a data parser"
+        data_files, channels_file = self.parse_file_list(options, args)
+        if len(data_files) > 1:
+            self.parser.error('you cannot specify more than one data file')
+        return self.open_data_file(options, data_files[0], channels_file)
+
+    def process(self, options, data_file):
+        "Called to process each data file specified on the command line"
+        raise NotImplementedError
+
+    def prefetch(self, options, data_file):
+        "Called in the background to read data_file's channels before use"
+        # The parsers read every channel on first access to any of them
+        for channel in data_file.channels:
+            if channel.enabled:
+                channel.data
+                break
+
+    def read_data_files(self, options, data_files, channels_file):
+        """Yields (filename, opener) for each of data_files
+
+        Each data file is opened and prefetched before it is yielded; opener
+        is a callable which returns the data file's parser, or raises the
+        exception which occurred while reading it.
+        """
+        for data_file in data_files:
+            try:
+                parser = self.open_data_file(
+                    options, data_file, channels_file, progress=False)
+                self.prefetch(options, parser)
+            except Exception as exc:
+                def opener(exc=exc):
+                    raise exc
+            else:
+                def opener(parser=parser):
+                    return parser
+            yield data_file, opener
+
+    def process_file(self, options, data_file, channels_file, progress=True,
+            opener=None):
+        """Opens and processes data_file, returning an exit code
+
+        Errors are logged (as the global exception handler would) rather than
+        raised, so that one bad file doesn't abort a batch. Errors in the
+        command line options are raised, as they will affect every file. If
+        opener is specified, it is called to obtain the data file's parser
+        (see read_data_files).
+        """
+        try:
+            if opener is None:
+                self.process(options, self.open_data_file(
+                    options, data_file, channels_file, progress))
+            else:
+                self.process(options, opener())
+        except optparse.OptParseError:
+            raise
+        except Exception:
+            logging.critical('Failed to process %s', data_file)
+            return self.handle(*sys.exc_info())
+        self.complete_input(options, data_file)
+        return 0
+
+    def complete_input(self, options, data_file):
+        "Records in the --journal that every output of data_file is complete"
+        journal = self.open_journal(options)
+        if journal and data_file != '-' and self.channel_indexes is None:
+            journal.record(normalize_path(data_file))
+
+    def pending_inputs(self, options, data_files):
+        """Returns those of data_files which aren't complete
+
+        Unless --resume is given, this starts a new --journal (if any) and
+        returns all of data_files.
+        """
+        if not getattr(options, 'journal', None):
+            self.open_journal(options)
+            return data_files
+        if not options.resume:
+            CheckpointJournal.truncate(normalize_path(options.journal))
+            return data_files
+        journal = self.open_journal(options)
+        result = []
+        for data_file in data_files:
+            if data_file != '-' and journal.completed(
+                    normalize_path(data_file)):
+                logging.warning('Skipping completed %s', data_file)
+            else:
+                result.append(data_file)
+        return result
+
+    def run_batch(self, options, args):
+        """Processes every data file in args, returning an exit code
+
+        A single data file is simply processed (with errors handled by the
+        global exception handler, as before). Several files are processed by
+        a pool of --jobs worker processes (or in turn if --jobs is 1, with the
+        next file read in the background while the current one is processed)
+        with each file's errors isolated from the others; the exit code is the
+        highest returned by any file.
+        """
+        data_files, channels_file = self.parse_file_list(options, args)
+        data_files = self.pending_inputs(options, data_files)
+        if not data_files:
+            return 0
+        if len(data_files) == 1:
+            result = self.process(options, self.open_data_file(
+                options, data_files[0], channels_file))
+            if not result:
+                self.complete_input(options, data_files[0])
+            return result
+        jobs = self.parse_jobs_option(options, len(data_files))
+        codes = []
+        if jobs == 1:
+            for data_file, opener in pipeline(self.read_data_files(
+                    options, data_files, channels_file), queue_size=1):
+                codes.append(self.process_file(
+                    options, data_file, channels_file, opener=opener))
+        else:
+            logging.info(
+                'Processing %d data files with %d jobs', len(data_files), jobs)
+            # Workers construct their own instance of this class (the
+            # utilities are stateless between files) and return whatever the
+            # file's processing wrote to stdout so that output is not
+            # interleaved
+            pool = multiprocessing.Pool(
+                jobs, _batch_init, (self.__class__, options))
+            try:
+                for code, output in pool.imap(
+                        _batch_process,
+                        [(data_file, channels_file) for data_file in data_files]):
+                    sys.stdout.write(output)
+                    codes.append(code)
+                    if code == 2:
+                        # Command line errors affect every file; don't
+                        # bother with the rest
+                        break
+            finally:
+                pool.terminate()
+                pool.join()
+        failures = sum(1 for code in codes if code)
+        if failures:
+            logging.critical(
+                'Failed to process %d of %d data files',
+                failures, len(data_files))
+        return max(codes)
 
     def progress_start(self):
         "Called at the start of a long operation to display progress"
@@ -426,176 +762,31 @@ class RasApplication(TerminalApplication):
         sys.stderr.write('\n')
 
 
-class RasError(Exception):
-    """
-    Base class for processing errors
-    """
-
-
-class RasChannelEmptyError(RasError):
-    """
-    Error raised when an empty channel is discovered
-    """
-
-
-class RasChannelProcessor(object):
-    """
-    Base class for classes which intend to process channel data.
-
-    This class provides the ability to perform percentile or straight range
-    limiting of channel data - functionality which is common to several tools
-    in the suite. The class attributes are as follows:
-
-    crop -- A Crop instance indicating the number of pixels that should be
-            cropped from each edge before data-limits are calculated
-    clip -- A Percentile or Range instance indicating the type and range of
-            limiting to be applied to channel data
-    empty -- If False (the default), then channels which are empty, or which
-            become empty after data limits are applied, will result in an
-            EmptyError exception being raised during a call to process()
-    """
-
-    def __init__(self, data_size):
-        self.data_size = Coord(*data_size)
-        self.crop = Crop(0, 0, 0, 0)
-        self.clip = None
-        self.empty = False
-
-    def process_multiple(self, red_channel, green_channel, blue_channel):
-        "Combine, crop, and limit the specified channels returning the data"
-        channels = (red_channel, green_channel, blue_channel)
-        data = np.zeros((self.data_size.y, self.data_size.x, 3), np.float)
-        for index, channel in enumerate(channels):
-            if channel:
-                data[..., index] = channel.data
-        data = data [
-            self.crop.top:data.shape[0] - self.crop.bottom,
-            self.crop.left:data.shape[1] - self.crop.right]
-        vsorted = np.empty((data.shape[0] * data.shape[1], 3))
-        for index in range(3):
-            vsorted[..., index] = np.sort(data[..., index], axis=None)
-        data_domain = [
-            Range(vsorted[..., index][0], vsorted[..., index][-1])
-            for index in range(3)]
-        if isinstance(self.clip, Percentile):
-            data_range = [
-                Range(
-                    vsorted[min(
-                        vsorted.shape[0] - 1,
-                        int(vsorted.shape[0] * self.clip.low / 100.0)), index],
-                    vsorted[min(
-                        vsorted.shape[0] - 1,
-                        int(vsorted.shape[0] * self.clip.high / 100.0)), index])
-                for index in range(3)]
-        elif isinstance(self.clip, Range):
-            data_range = [self.clip] * 3
-            for index, (channel_color, channel, channel_domain, channel_range) in enumerate(zip(
-                    ('Red', 'Green', 'Blue'), channels, data_domain, data_range)):
-                if channel:
-                    if channel_range.low < channel_domain.low:
-                        logging.warning(
-                            '%s channel (%d - %s) has no values below %d',
-                            channel_color, channel.index, channel.name,
-                            channel_range.low)
-                    if channel_range.high > channel_domain.high:
-                        logging.warning(
-                            '%s channel (%d - %s) has no values above %d',
-                            channel_color, channel.index, channel.name,
-                            channel_range.high)
-                    data_range[index] = Range(
-                        max(channel_range.low, channel_domain.low),
-                        min(channel_range.high, channel_domain.high))
-        else:
-            data_range = data_domain
-        for (channel_color, channel, channel_domain, channel_range) in zip(
-                ('Red', 'Green', 'Blue'), channels, data_domain, data_range):
-            if channel:
-                if channel_range != channel_domain:
-                    logging.info(
-                        '%s channel (%d - %s) has new range %d-%d',
-                        channel_color, channel.index, channel.name,
-                        channel_range.low, channel_range.high)
-                if channel_range.low >= channel_range.high:
-                    logging.warning(
-                        '%s channel (%d - %s) is empty',
-                        channel_color, channel.index, channel.name)
-        return data, data_domain, data_range
-
-    def process_single(self, channel):
-        "Crop and limit the specified channel returning the domain and range"
-        # Perform any cropping requested. This must be done before calculation
-        # of the data's range and percentile limiting is performed
-        data = channel.data
-        data = data[
-            self.crop.top:data.shape[0] - self.crop.bottom,
-            self.crop.left:data.shape[1] - self.crop.right]
-        # Find the minimum and maximum values in the channel and clip
-        # them to a percentile/range if requested
-        vsorted = np.sort(data, None)
-        data_domain = Range(vsorted[0], vsorted[-1])
-        logging.info(
-            'Channel %d (%s) has range %d-%d',
-            channel.index, channel.name, data_domain.low, data_domain.high)
-        if isinstance(self.clip, Percentile):
-            data_range = Range(
-                vsorted[min(
-                    len(vsorted) - 1,
-                    int(len(vsorted) * self.clip.low / 100.0))],
-                vsorted[min(
-                    len(vsorted) - 1,
-                    int(len(vsorted) * self.clip.high / 100.0))])
-            logging.info(
-                '%gth percentile is %d',
-                self.clip.low, data_range.low)
-            logging.info(
-                '%gth percentile is %d',
-                self.clip.high, data_range.high)
-        elif isinstance(self.clip, Range):
-            data_range = self.clip
-            if data_range.low < data_domain.low:
-                logging.warning(
-                    'Channel %d (%s) has no values below %d',
-                    channel.index, channel.name, data_range.low)
-            if data_range.high > data_domain.high:
-                logging.warning(
-                    'Channel %d (%s) has no values above %d',
-                    channel.index, channel.name, data_range.high)
-            data_range = Range(
-                max(data_range.low, data_domain.low),
-                min(data_range.high, data_domain.high))
-        else:
-            data_range = data_domain
-        if data_range != data_domain:
-            logging.info(
-                'Channel %d (%s) has new range %d-%d',
-                channel.index, channel.name, data_range.low, data_range.high)
-        if data_range.low >= data_range.high:
-            if self.empty:
-                logging.warning(
-                    'Channel %d (%s) is empty',
-                    channel.index, channel.name)
-            else:
-                logging.warning(
-                    'Channel %d (%s) is empty, skipping',
-                    channel.index, channel.name)
-                raise RasChannelEmptyError(
-                    'Channel %d is empty' % channel.index)
-        return data, data_domain, data_range
-
-    def format_dict(self, **kwargs):
-        "Converts the configuration for use in format substitutions"
-        return dict(
-            percentile_from=
-                self.clip.low if isinstance(self.clip, Percentile) else None,
-            percentile_to=
-                self.clip.high if isinstance(self.clip, Percentile) else None,
-            range_from=
-                self.clip.low if isinstance(self.clip, Range) else None,
-            range_to=
-                self.clip.high if isinstance(self.clip, Range) else None,
-            crop_left=self.crop.left,
-            crop_top=self.crop.top,
-            crop_right=self.crop.right,
-            crop_bottom=self.crop.bottom,
-            **kwargs)
-
+# The utility instance and options of a worker process of run_batch
+_BATCH = None
+
+def _batch_init(app_class, options):
+    "Initializes a worker process of RasApplication.run_batch"
+    global _BATCH
+    _CONSOLE.setLevel(options.loglevel)
+    if options.debug:
+        logging.getLogger().setLevel(logging.DEBUG)
+    else:
+        logging.getLogger().setLevel(logging.INFO)
+    _BATCH = (app_class(), options)
+
+def _batch_process(files):
+    "Processes a data file in a worker process of RasApplication.run_batch"
+    app, options = _BATCH
+    data_file, channels_file = files
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        try:
+            code = app.process_file(
+                options, data_file, channels_file, progress=False)
+        except optparse.OptParseError:
+            code = app.handle(*sys.exc_info())
+        return code, sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
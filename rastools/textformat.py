@@ -0,0 +1,122 @@
+# vim: set et sw=4 sts=4:
+
+# Copyright 2012 Dave Hughes.
+#
+# This file is part of rastools.
+#
+# rastools is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# rastools is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# rastools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Vectorized formatting of numeric data for the text-based writers"""
+
+from __future__ import (
+    unicode_literals,
+    print_function,
+    absolute_import,
+    division,
+    )
+
+import numpy as np
+
+
+class TextFormatter(object):
+    """Formats blocks of integers as lines of text.
+
+    The fields parameter is a sequence of (prefix, suffix) strings, one for
+    each column of a line, and line_end is appended to each line. Hence, the
+    result of format() is identical to formatting each value with
+    prefix + '%d' + suffix. Rather than formatting each value in Python, the
+    digits of all values are calculated together with numpy and written
+    directly into a byte buffer which is reused (and grown as necessary)
+    between calls.
+    """
+
+    powers = 10 ** np.arange(20, dtype=np.uint64)
+
+    def __init__(self, fields, line_end='\n'):
+        self.fields = [
+            (prefix.encode('ascii'), suffix.encode('ascii'))
+            for (prefix, suffix) in fields]
+        self.line_end = line_end.encode('ascii')
+        self._buf = np.empty(0, np.uint8)
+
+    def format(self, values):
+        """Returns a uint8 array containing the formatted values.
+
+        The values are flattened and formatted in order, so any array whose
+        size is a multiple of the number of fields may be given (e.g. an
+        array of shape (lines, fields)). Floats are truncated towards zero as
+        with the % operator.
+        """
+        columns = len(self.fields)
+        values = np.asarray(values).ravel()
+        if values.dtype.kind not in 'iu':
+            values = values.astype(np.int64)
+        negative = values < 0
+        magnitude = np.abs(values.astype(np.int64)).astype(np.uint64)
+        digits = np.ones(values.shape, np.intp)
+        if values.size:
+            for power in self.powers[1:]:
+                if power > magnitude.max():
+                    break
+                digits += magnitude >= power
+        digits = digits.reshape((-1, columns))
+        negative = negative.reshape((-1, columns))
+        # Each field consists of its prefix, an optional sign, its digits and
+        # its suffix, and the last field of each line is followed by the line
+        # ending
+        prefixes = np.array([len(p) for (p, _) in self.fields], np.intp)
+        suffixes = np.array([len(s) for (_, s) in self.fields], np.intp)
+        widths = digits + negative + prefixes + suffixes
+        widths[:, -1] += len(self.line_end)
+        ends = np.cumsum(widths).reshape(widths.shape)
+        size = ends[-1, -1] if ends.size else 0
+        if self._buf.size < size:
+            self._buf = np.empty(size, np.uint8)
+        buf = self._buf[:size]
+        starts = ends - widths
+        ends[:, -1] -= len(self.line_end)
+        for offset, char in enumerate(bytearray(self.line_end)):
+            buf[ends[:, -1] + offset] = char
+        # Fill in the prefixes and suffixes of all columns sharing the same
+        # strings together
+        for field in set(self.fields):
+            prefix, suffix = field
+            mask = np.array([f == field for f in self.fields], bool)
+            for offset, char in enumerate(bytearray(prefix)):
+                buf[starts[:, mask] + offset] = char
+            for offset, char in enumerate(bytearray(suffix)):
+                buf[ends[:, mask] - len(suffix) + offset] = char
+        buf[(starts + prefixes)[negative]] = ord('-')
+        # Fill in the digits from least to most significant; each pass only
+        # considers the values which have a digit at that position
+        ends = (ends - suffixes).ravel()
+        digits = digits.ravel()
+        for digit in range(digits.max() if values.size else 0):
+            if digit:
+                mask = digits > digit
+                ends = ends[mask]
+                digits = digits[mask]
+                magnitude = magnitude[mask] // 10
+            buf[ends - 1] = ord('0') + (magnitude % 10).astype(np.uint8)
+            ends = ends - 1
+        return buf
+
+
+def write_text(f, buf):
+    "Writes the uint8 array buf of ASCII characters to the file f"
+    data = buf.tobytes()
+    try:
+        f.write(data)
+    except TypeError:
+        # Text-mode files under Python 3 require a str
+        f.write(data.decode('ascii'))
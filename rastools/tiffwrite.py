@@ -27,52 +27,62 @@ from __future__ import (
     division,
     )
 
+import zlib
+
 from matplotlib.backends.backend_agg import FigureCanvasAgg
 from PIL import Image
-try:
-    # XXX Py2 only
-    from cStringIO import StringIO
-except ImportError:
-    # XXX Py2 only
-    from StringIO import StringIO
-except ImportError:
-    # XXX Py3 only
-    from io import StringIO
+
+
+# The zlib strategies selectable for PNG output, by name
+PNG_STRATEGIES = {
+    'default':  zlib.Z_DEFAULT_STRATEGY,
+    'filtered': zlib.Z_FILTERED,
+    'huffman':  zlib.Z_HUFFMAN_ONLY,
+    'rle':      getattr(zlib, 'Z_RLE', 3),
+    'fixed':    getattr(zlib, 'Z_FIXED', 4),
+    }
 
 # If PIL's available, define a sub-class of Agg which can handle conversion
 # to odd formats like TIFF
 class FigureCanvasPIL(FigureCanvasAgg):
+    def get_image(self, mode='RGBA'):
+        "Renders the figure and returns it as a PIL image in the given mode"
+        # Rather than encoding a PNG with Agg and decoding it again, the image
+        # is taken directly from Agg's RGBA buffer. Formats which were written
+        # from Agg's PNG keep its alpha channel; the others never had one
+        FigureCanvasAgg.draw(self)
+        renderer = self.get_renderer()
+        im = Image.frombuffer(
+            'RGBA', (int(renderer.width), int(renderer.height)),
+            renderer.buffer_rgba(), 'raw', 'RGBA', 0, 1)
+        return im if mode == 'RGBA' else im.convert(mode)
+
+    def print_png(self, filename_or_obj, *args, **kwargs):
+        # Encode the PNG with PIL, which (unlike Agg) permits the compression
+        # level and strategy to be traded against encoding speed
+        im = self.get_image()
+        im.save(filename_or_obj, 'PNG',
+            compress_level=kwargs.get('compress_level', 6),
+            compress_type=PNG_STRATEGIES[kwargs.get('strategy', 'default')])
+
     def print_bmp(self, filename_or_obj, *args, **kwargs):
-        png = StringIO()
-        FigureCanvasAgg.print_png(self, png, *args, **kwargs)
-        png.seek(0) # rewind
-        # Convert the PNG to a BMP (uncompressed)
-        im = Image.open(png)
-        im = im.convert('RGB')
+        # Convert the image to a BMP (uncompressed)
+        im = self.get_image('RGB')
         im.save(filename_or_obj, 'BMP')
 
     def print_tif(self, filename_or_obj, *args, **kwargs):
-        png = StringIO()
-        FigureCanvasAgg.print_png(self, png, *args, **kwargs)
-        png.seek(0) # rewind
-        # Convert the PNG to a TIFF (uncompressed)
-        im = Image.open(png)
+        # Convert the image to a TIFF (uncompressed)
+        im = self.get_image()
         im.save(filename_or_obj, 'TIFF')
 
     def print_gif(self, filename_or_obj, *args, **kwargs):
-        png = StringIO()
-        FigureCanvasAgg.print_png(self, png, *args, **kwargs)
-        png.seek(0) # rewind
-        # Convert the PNG to a GIF87a
-        im = Image.open(png)
+        # Convert the image to a GIF87a
+        im = self.get_image()
         im.save(filename_or_obj, 'GIF')
 
     def print_jpg(self, filename_or_obj, *args, **kwargs):
-        png = StringIO()
-        FigureCanvasAgg.print_png(self, png, *args, **kwargs)
-        png.seek(0) # rewind
-        # Convert the PNG to a JPEG
-        im = Image.open(png)
+        # Convert the image to a JPEG
+        im = self.get_image('RGB')
         im.save(filename_or_obj, 'JPEG',
             quality=kwargs.get('quality', 75),
             optimize=kwargs.get('optimize', True))
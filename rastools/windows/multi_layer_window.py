@@ -33,19 +33,24 @@ import numpy as np
 import matplotlib
 from matplotlib.figure import Figure
 import matplotlib.cm
+import matplotlib.colors
 import matplotlib.image
 from PyQt4 import QtCore, QtGui, uic
 
 from rastools.settings import Coord, Range, BoundingBox
+from rastools.blend import BLEND_MODES, blend_layers, default_layer_color
+from rastools.windows import get_ui_file
 from rastools.windows.progress_dialog import ProgressDialog
 from rastools.windows.figure_canvas import FigureCanvas
 from rastools.windows.sub_window import SubWindow
 
 
 class ControlSet(object):
-    def __init__(self, index, prefix, **kwargs):
+    def __init__(self, index, prefix, color, **kwargs):
         self.index = index
         self.prefix = prefix
+        self.color = color
+        self.tab = kwargs['tab']
         self.channel_combo = kwargs['channel_combo']
         self.value_from_label = kwargs['value_from_label']
         self.value_to_label = kwargs['value_to_label']
@@ -59,6 +64,7 @@ class ControlSet(object):
         self.percentile_to_slider = kwargs['percentile_to_slider']
         self.percentile_from_button = kwargs['percentile_from_button']
         self.percentile_to_button = kwargs['percentile_to_button']
+        self.color_button = kwargs['color_button']
 
 
 class MultiLayerWindow(SubWindow):
@@ -76,86 +82,117 @@ class MultiLayerWindow(SubWindow):
 
     def _config_interface(self):
         self._current_set = None
-        self._control_sets = [
-            ControlSet(
-                index=0,
-                prefix='red',
-                channel_combo=self.ui.red_channel_combo,
-                value_from_label=self.ui.red_value_from_label,
-                value_to_label=self.ui.red_value_to_label,
-                value_from_spinbox=self.ui.red_value_from_spinbox,
-                value_to_spinbox=self.ui.red_value_to_spinbox,
-                value_from_slider=self.ui.red_value_from_slider,
-                value_to_slider=self.ui.red_value_to_slider,
-                percentile_from_spinbox=self.ui.red_percentile_from_spinbox,
-                percentile_to_spinbox=self.ui.red_percentile_to_spinbox,
-                percentile_from_slider=self.ui.red_percentile_from_slider,
-                percentile_to_slider=self.ui.red_percentile_to_slider,
-                percentile_from_button=self.ui.red_percentile_from_button,
-                percentile_to_button=self.ui.red_percentile_to_button),
-            ControlSet(
-                index=1,
-                prefix='green',
-                channel_combo=self.ui.green_channel_combo,
-                value_from_label=self.ui.green_value_from_label,
-                value_to_label=self.ui.green_value_to_label,
-                value_from_spinbox=self.ui.green_value_from_spinbox,
-                value_to_spinbox=self.ui.green_value_to_spinbox,
-                value_from_slider=self.ui.green_value_from_slider,
-                value_to_slider=self.ui.green_value_to_slider,
-                percentile_from_spinbox=self.ui.green_percentile_from_spinbox,
-                percentile_to_spinbox=self.ui.green_percentile_to_spinbox,
-                percentile_from_slider=self.ui.green_percentile_from_slider,
-                percentile_to_slider=self.ui.green_percentile_to_slider,
-                percentile_from_button=self.ui.green_percentile_from_button,
-                percentile_to_button=self.ui.green_percentile_to_button),
-            ControlSet(
-                index=2,
-                prefix='blue',
-                channel_combo=self.ui.blue_channel_combo,
-                value_from_label=self.ui.blue_value_from_label,
-                value_to_label=self.ui.blue_value_to_label,
-                value_from_spinbox=self.ui.blue_value_from_spinbox,
-                value_to_spinbox=self.ui.blue_value_to_spinbox,
-                value_from_slider=self.ui.blue_value_from_slider,
-                value_to_slider=self.ui.blue_value_to_slider,
-                percentile_from_spinbox=self.ui.blue_percentile_from_spinbox,
-                percentile_to_spinbox=self.ui.blue_percentile_to_spinbox,
-                percentile_from_slider=self.ui.blue_percentile_from_slider,
-                percentile_to_slider=self.ui.blue_percentile_to_slider,
-                percentile_from_button=self.ui.blue_percentile_from_button,
-                percentile_to_button=self.ui.blue_percentile_to_button)]
+        self._control_sets = []
         super(MultiLayerWindow, self)._config_interface()
-        # Fill out the combos
-        for cset in self._control_sets:
-            cset.channel_combo.addItem('None', None)
-            for channel in self._file.channels:
-                if channel.enabled:
-                    if channel.name:
-                        cset.channel_combo.addItem(
-                            'Channel {index} - {name}'.format(
-                                index=channel.index, name=channel.name),
-                            channel)
-                    else:
-                        cset.channel_combo.addItem(
-                            'Channel {index}'.format(
-                                index=channel.index),
-                            channel)
+        for mode in BLEND_MODES:
+            self.ui.blend_combo.addItem(mode)
+        # Start with the traditional red, green, and blue layers
+        for index in range(3):
+            self.add_layer()
 
     def _config_handlers(self):
         super(MultiLayerWindow, self)._config_handlers()
         # Set up the event connections and a timer to handle delayed redrawing
-        for cset in self._control_sets:
-            cset.channel_combo.currentIndexChanged.connect(self.channel_changed)
-            cset.percentile_from_button.clicked.connect(self.percentile_from_clicked)
-            cset.percentile_to_button.clicked.connect(self.percentile_to_clicked)
+        # (the handlers of each layer's controls are connected by add_layer)
+        self.ui.blend_combo.currentIndexChanged.connect(self.invalidate_image)
+        self.ui.add_layer_button.clicked.connect(self.add_layer_clicked)
+        self.ui.remove_layer_button.clicked.connect(self.remove_layer_clicked)
+
+    def add_layer(self):
+        "Adds a tab of controls for a new layer, returning its control set"
+        index = len(self._control_sets)
+        tab = uic.loadUi(get_ui_file('layer_tab.ui'))
+        cset = ControlSet(
+            index=index,
+            prefix='layer{0:d}'.format(index),
+            color=default_layer_color(index),
+            tab=tab,
+            channel_combo=tab.channel_combo,
+            value_from_label=tab.value_from_label,
+            value_to_label=tab.value_to_label,
+            value_from_spinbox=tab.value_from_spinbox,
+            value_to_spinbox=tab.value_to_spinbox,
+            value_from_slider=tab.value_from_slider,
+            value_to_slider=tab.value_to_slider,
+            percentile_from_spinbox=tab.percentile_from_spinbox,
+            percentile_to_spinbox=tab.percentile_to_spinbox,
+            percentile_from_slider=tab.percentile_from_slider,
+            percentile_to_slider=tab.percentile_to_slider,
+            percentile_from_button=tab.percentile_from_button,
+            percentile_to_button=tab.percentile_to_button,
+            color_button=tab.color_button)
+        self._control_sets.append(cset)
+        self.ui.layer_tabs.addTab(tab, 'Layer {0:d}'.format(index))
+        self.color_changed(cset)
+        # Fill out the combo
+        cset.channel_combo.addItem('None', None)
+        for channel in self._file.channels:
+            if channel.enabled:
+                if channel.name:
+                    cset.channel_combo.addItem(
+                        'Channel {index} - {name}'.format(
+                            index=channel.index, name=channel.name),
+                        channel)
+                else:
+                    cset.channel_combo.addItem(
+                        'Channel {index}'.format(
+                            index=channel.index),
+                        channel)
+        cset.channel_combo.currentIndexChanged.connect(self.channel_changed)
+        cset.percentile_from_button.clicked.connect(self.percentile_from_clicked)
+        cset.percentile_to_button.clicked.connect(self.percentile_to_clicked)
+        cset.color_button.clicked.connect(
+            lambda checked=False: self.color_clicked(cset))
+        self.ui.remove_layer_button.setEnabled(len(self._control_sets) > 1)
+        return cset
+
+    def add_layer_clicked(self):
+        "Handler for add_layer_button click event"
+        cset = self.add_layer()
+        self.ui.layer_tabs.setCurrentWidget(cset.tab)
+        self.channel_changed()
+
+    def remove_layer_clicked(self):
+        "Handler for remove_layer_button click event"
+        cset = self._control_sets.pop(self.ui.layer_tabs.currentIndex())
+        if self._current_set is cset:
+            self._current_set = None
+        self.ui.layer_tabs.removeTab(cset.index)
+        cset.tab.deleteLater()
+        # Renumber the remaining layers so their indexes match the columns of
+        # the combined data
+        for index, cset in enumerate(self._control_sets):
+            cset.index = index
+            cset.prefix = 'layer{0:d}'.format(index)
+            self.ui.layer_tabs.setTabText(index, 'Layer {0:d}'.format(index))
+        self.ui.remove_layer_button.setEnabled(len(self._control_sets) > 1)
+        self.channel_changed()
+
+    def color_clicked(self, cset):
+        "Handler for color_button click event"
+        color = QtGui.QColorDialog.getColor(
+            QtGui.QColor.fromRgbF(*cset.color), self)
+        if color.isValid():
+            cset.color = (color.redF(), color.greenF(), color.blueF())
+            self.color_changed(cset)
+            self.invalidate_image()
+
+    def color_changed(self, cset):
+        "Updates the color button of the specified control set"
+        cset.color_button.setStyleSheet(
+            'background-color: {0};'.format(
+                matplotlib.colors.rgb2hex(cset.color)))
+
+    @property
+    def colors(self):
+        "Returns the colors of the layers"
+        return [cset.color for cset in self._control_sets]
 
     def canvas_motion(self, event):
         "Handler for mouse movement over graph canvas"
-        labels = (
-            ('Red', self.window().ui.red_label),
-            ('Green', self.window().ui.green_label),
-            ('Blue', self.window().ui.blue_label))
+        # All layer values are reported in the first status bar label as the
+        # number of layers is variable
+        label = self.window().ui.value_label
         if (self.image_axes and
                 (event.inaxes == self.image_axes) and
                 (event.xdata is not None)):
@@ -164,24 +201,22 @@ class MultiLayerWindow(SubWindow):
             self.window().ui.y_label.setText(
                 'Y: {0:d}'.format(int(event.ydata)))
             try:
-                for index, (name, label) in enumerate(labels):
-                    label.setText(
-                        '{name}: {value:.2f} ({norm:.2f})'.format(
-                            name=name,
-                            value=self.data[event.ydata, event.xdata, index],
-                            norm=self.data_normalized[
-                                event.ydata - self.ui.crop_top_spinbox.value(),
-                                event.xdata - self.ui.crop_left_spinbox.value(),
-                                index]))
+                label.setText('  '.join(
+                    '{prefix}: {value:.2f} ({norm:.2f})'.format(
+                        prefix=cset.prefix,
+                        value=self.data[event.ydata, event.xdata, cset.index],
+                        norm=self.data_normalized[
+                            event.ydata - self.ui.crop_top_spinbox.value(),
+                            event.xdata - self.ui.crop_left_spinbox.value(),
+                            cset.index])
+                    for cset in self._control_sets))
             except IndexError:
-                for _, label in labels:
-                    label.setText('')
+                label.setText('')
             self.canvas.setCursor(QtCore.Qt.CrossCursor)
         else:
             self.window().ui.x_label.setText('')
             self.window().ui.y_label.setText('')
-            for _, label in labels:
-                label.setText('')
+            label.setText('')
             self.canvas.setCursor(QtCore.Qt.ArrowCursor)
 
     def focus_changed(self, old_widget, new_widget):
@@ -386,7 +421,7 @@ class MultiLayerWindow(SubWindow):
         if self.data is not None:
             save_range_locked = self._range_locked
             if save_range_locked:
-                self.range_disconnect()
+                self.range_disconnect(self._current_set)
             for cset in self._control_sets:
                 cset.value_from_label.setText(
                     str(self.data_domain[cset.index].low))
@@ -424,7 +459,7 @@ class MultiLayerWindow(SubWindow):
             self.ui.x_size_label.setText(str(x_size))
             self.ui.y_size_label.setText(str(y_size))
             if save_range_locked:
-                self._range_connect()
+                self.range_connect(self._current_set)
 
     def default_title_clicked(self):
         "Handler for default_title_button click event"
@@ -435,43 +470,26 @@ class MultiLayerWindow(SubWindow):
         self.ui.title_edit.setPlainText(title)
 
     @property
-    def red_channel(self):
-        "Returns the currently selected red channel object"
+    def channels(self):
+        "Returns the selected channel of each layer"
         # We test self.ui here as during ui loading something
         # (connectSlotsByName) seems to iterate over all the properties
         # querying their value. As self.ui wasn't assigned at this point it led
         # to several annoying exceptions...
-        if self.ui and (self.ui.red_channel_combo.currentIndex() != -1):
-            return self.ui.red_channel_combo.itemData(
-                self.ui.red_channel_combo.currentIndex())
-
-    @property
-    def green_channel(self):
-        "Returns the currently selected green channel object"
-        # See note above about self.ui
-        if self.ui and (self.ui.green_channel_combo.currentIndex() != -1):
-            return self.ui.green_channel_combo.itemData(
-                self.ui.green_channel_combo.currentIndex())
-
-    @property
-    def blue_channel(self):
-        "Returns the currently selected blue channel object"
-        # See note above about self.ui
-        if self.ui and (self.ui.blue_channel_combo.currentIndex() != -1):
-            return self.ui.blue_channel_combo.itemData(
-                self.ui.blue_channel_combo.currentIndex())
-
-    @property
-    def channels(self):
-        "Returns the selected channels as a three-tuple"
-        return (self.red_channel, self.green_channel, self.blue_channel)
+        if self.ui:
+            return [
+                cset.channel_combo.itemData(cset.channel_combo.currentIndex())
+                if cset.channel_combo.currentIndex() != -1 else None
+                for cset in self._control_sets]
+        return []
 
     @property
     def data(self):
         "Returns the data of the combined channels"
         if self.ui and (self._data is None):
             self._data = np.zeros(
-                (self._file.y_size, self._file.x_size, 3), np.float)
+                (self._file.y_size, self._file.x_size,
+                    len(self._control_sets)), np.float)
             for index, channel in enumerate(self.channels):
                 if channel:
                     self._data[..., index] = channel.data
@@ -492,9 +510,10 @@ class MultiLayerWindow(SubWindow):
     def data_sorted(self):
         "Returns a flat, sorted array of the cropped data"
         if (self._data_sorted is None) and (self.data_cropped is not None):
-            self._data_sorted = np.empty(
-                (self.data_cropped.shape[0] * self.data_cropped.shape[1], 3))
-            for index in range(3):
+            self._data_sorted = np.empty((
+                self.data_cropped.shape[0] * self.data_cropped.shape[1],
+                self.data_cropped.shape[2]))
+            for index in range(self.data_cropped.shape[2]):
                 self._data_sorted[..., index] = np.sort(
                     self.data_cropped[..., index], axis=None)
         return self._data_sorted
@@ -507,7 +526,7 @@ class MultiLayerWindow(SubWindow):
                 Range(
                     self.data_sorted[..., index][0],
                     self.data_sorted[..., index][-1])
-                for index in range(3)]
+                for index in range(self.data_sorted.shape[1])]
 
     @property
     def data_range(self):
@@ -515,21 +534,16 @@ class MultiLayerWindow(SubWindow):
         if self.data_sorted is not None:
             return [
                 Range(
-                    self.ui.red_value_from_spinbox.value(),
-                    self.ui.red_value_to_spinbox.value()),
-                Range(
-                    self.ui.green_value_from_spinbox.value(),
-                    self.ui.green_value_to_spinbox.value()),
-                Range(
-                    self.ui.blue_value_from_spinbox.value(),
-                    self.ui.blue_value_to_spinbox.value())]
+                    cset.value_from_spinbox.value(),
+                    cset.value_to_spinbox.value())
+                for cset in self._control_sets]
 
     @property
     def data_normalized(self):
         "Returns the data normalized to a 0-1 range"
         if (self._data_normalized is None) and (self.data_cropped is not None):
             array = self.data_cropped.copy()
-            for index in range(3):
+            for index in range(array.shape[2]):
                 low, high = self.data_range[index]
                 array[..., index] = array[..., index] - low
                 if (high - low):
@@ -541,9 +555,10 @@ class MultiLayerWindow(SubWindow):
     def data_flat(self):
         "Returns the normalized data flattened and sorted"
         if (self._data_flat is None) and (self.data_normalized is not None):
-            self._data_flat = np.empty(
-                (self.data_normalized.shape[0] * self.data_normalized.shape[1], 3))
-            for index in range(3):
+            self._data_flat = np.empty((
+                self.data_normalized.shape[0] * self.data_normalized.shape[1],
+                self.data_normalized.shape[2]))
+            for index in range(self.data_normalized.shape[2]):
                 self._data_flat[..., index] = self.data_normalized[..., index].flatten()
         return self._data_flat
 
@@ -594,14 +609,14 @@ class MultiLayerWindow(SubWindow):
         else:
             self.image_axes.set_xticks([], False)
             self.image_axes.set_yticks([], False)
-        # Here we tweak values outside the normalized 0.0 and 1.0 range just
-        # before drawing. This is not done in data_normalized as otherwise
-        # histograms derived from the flattened version of the data wind up
-        # with clumps of data at the extremes of the range when percentiles are
-        # applied
-        data = self.data_normalized.copy()
-        data[data < 0.0] = 0.0
-        data[data > 1.0] = 1.0
+        # Here we clamp values outside the normalized 0.0 and 1.0 range and
+        # blend the layers just before drawing. This is not done in
+        # data_normalized as otherwise histograms derived from the flattened
+        # version of the data wind up with clumps of data at the extremes of
+        # the range when percentiles are applied
+        data = blend_layers(
+            self.data_normalized.astype(np.float32), self.colors,
+            self.ui.blend_combo.currentText())
         return self.image_axes.imshow(
             data,
             origin='upper',
@@ -622,7 +637,7 @@ class MultiLayerWindow(SubWindow):
                 self.data_flat,
                 bins=self.ui.histogram_bins_spinbox.value(),
                 histtype='barstacked',
-                color=('red', 'green', 'blue'),
+                color=self.colors,
                 range=(0.0, 1.0))
         elif self.histogram_axes:
             self.figure.delaxes(self.histogram_axes)
@@ -641,7 +656,11 @@ class MultiLayerWindow(SubWindow):
             crop_bottom=self.ui.crop_bottom_spinbox.value())
         for channel, cset in zip(self.channels, self._control_sets):
             if channel:
+                prefixes = [cset.prefix]
+                if cset.index < 3:
+                    prefixes.append(('red', 'green', 'blue')[cset.index])
                 for name, value in channel.format_dict().items():
-                    result[cset.prefix + '_' + name] = value
+                    for prefix in prefixes:
+                        result[prefix + '_' + name] = value
         return result
 
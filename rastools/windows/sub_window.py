@@ -38,6 +38,7 @@ import pkg_resources
 from PyQt4 import QtCore, QtGui, uic
 
 from rastools.settings import Crop, Coord, Range, BoundingBox
+from rastools.compression import strip_compression
 from rastools.windows import get_ui_file
 from rastools.windows.progress_dialog import ProgressDialog
 from rastools.windows.figure_canvas import FigureCanvas
@@ -86,7 +87,7 @@ class SubWindow(QtGui.QWidget):
         finally:
             QtGui.QApplication.instance().restoreOverrideCursor()
         # Open the selected file
-        ext = os.path.splitext(data_file)[-1]
+        ext = os.path.splitext(strip_compression(data_file))[-1]
         parsers = dict(
             (ext, cls)
             for (cls, exts, _) in DATA_PARSERS
@@ -0,0 +1,295 @@
+# vim: set et sw=4 sts=4:
+
+# Copyright 2012 Dave Hughes.
+#
+# This file is part of rastools.
+#
+# rastools is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# rastools is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# rastools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""A queue of tasks in a directory shared by workers on several hosts"""
+
+from __future__ import (
+    unicode_literals,
+    print_function,
+    absolute_import,
+    division,
+    )
+
+import io
+import os
+import json
+import time
+import socket
+import logging
+import threading
+
+from rastools.journal import atomic_output
+
+
+# The sub-directories of a queue which hold tasks in each state
+QUEUE_STATES = ('pending', 'running', 'done', 'failed')
+
+
+def lease_age(filename, now=None):
+    """Returns the seconds since the lease filename was renewed
+
+    Renaming a file (to claim it) updates its change time but not its
+    modification time, so the later of the two is used.
+    """
+    stat = os.stat(filename)
+    return (now or time.time()) - max(stat.st_mtime, stat.st_ctime)
+
+
+def worker_name():
+    "Returns the name identifying this process as a worker"
+    return '%s.%d' % (socket.gethostname(), os.getpid())
+
+
+class WorkQueue(object):
+    """Queue of tasks held in a directory shared by any number of workers
+
+    Each task is a JSON file which moves between the pending, running, done,
+    and failed sub-directories of path. A worker claims a pending task by
+    renaming it into running (a rename is atomic, even over NFS, so only one
+    worker can succeed) with its own name appended. While the task runs, the
+    worker touches the file every so often as a heartbeat; a running task
+    whose heartbeat stops for longer than the lease (because its worker
+    crashed, or its host died) is returned to pending by whichever worker
+    notices first, or failed once it has been attempted max_attempts times.
+    When the task finishes its result is written to done (or failed).
+
+    All files are written to temporaries and renamed into place, and names
+    beginning with a dot are ignored, so a reader never sees a partial task.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        for state in QUEUE_STATES:
+            state_path = os.path.join(path, state)
+            if not os.path.isdir(state_path):
+                try:
+                    os.makedirs(state_path)
+                except OSError:
+                    # Another worker may have created it in the meantime
+                    if not os.path.isdir(state_path):
+                        raise
+
+    @staticmethod
+    def task_id(name):
+        "Returns the id of the task in the file name"
+        return name.rsplit('.json', 1)[0].split('@', 1)[0]
+
+    def list(self, state):
+        "Returns the sorted names of the files of tasks in state"
+        try:
+            return sorted(
+                name for name in os.listdir(os.path.join(self.path, state))
+                if name.endswith('.json') and not name.startswith('.'))
+        except OSError:
+            return []
+
+    def read(self, state, name):
+        "Returns the task (or result) in the file name of state, or None"
+        try:
+            with io.open(
+                    os.path.join(self.path, state, name), 'r',
+                    encoding='utf-8') as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def write(self, state, task):
+        "Writes task (which must have an id) to state"
+        filename = os.path.join(self.path, state, task['id'] + '.json')
+        with atomic_output(filename) as temp:
+            with io.open(temp, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(task, indent=4, sort_keys=True))
+
+    def submit(self, tasks):
+        "Adds each of tasks (dicts of JSON serializable values) to the queue"
+        prefix = '%013d-%s' % (int(time.time() * 1000), worker_name())
+        for index, task in enumerate(tasks):
+            task = dict(task)
+            task.setdefault('id', '%s-%05d' % (prefix, index))
+            task.setdefault('attempts', 0)
+            task.setdefault('submitted', time.time())
+            self.write('pending', task)
+
+    def claim(self, worker):
+        """Claims the oldest pending task for worker
+
+        Returns a tuple of (task, lease) where lease is the path of the task's
+        file in running (see heartbeat and finish), or (None, None) if there
+        are no pending tasks.
+        """
+        finished = set(
+            self.task_id(name) for state in ('done', 'failed')
+            for name in self.list(state))
+        for name in self.list('pending'):
+            pending = os.path.join(self.path, 'pending', name)
+            if self.task_id(name) in finished:
+                # A worker whose lease expired finished it after all
+                try:
+                    os.unlink(pending)
+                except OSError:
+                    pass
+                continue
+            lease = os.path.join(
+                self.path, 'running',
+                '%s@%s.json' % (self.task_id(name), worker))
+            try:
+                os.rename(pending, lease)
+            except OSError:
+                # Another worker claimed it first
+                continue
+            task = self.read('running', os.path.basename(lease))
+            if task is not None:
+                return task, lease
+        return None, None
+
+    def release(self, task, lease):
+        "Returns the task held under lease to pending without running it"
+        try:
+            os.rename(lease, os.path.join(
+                self.path, 'pending', task['id'] + '.json'))
+        except OSError:
+            # The lease expired, and the task was requeued anyway
+            pass
+
+    def heartbeat(self, lease):
+        "Renews lease, returning False if it has been lost"
+        try:
+            os.utime(lease, None)
+        except OSError:
+            return False
+        return True
+
+    def finish(self, task, lease, result):
+        """Records the result (a dict) of the task held under lease
+
+        The task moves to done if result's code is 0, and to failed
+        otherwise.
+        """
+        task = dict(task)
+        task.update(result)
+        self.write('done' if result.get('code') == 0 else 'failed', task)
+        try:
+            os.unlink(lease)
+        except OSError:
+            # The lease expired while the task ran
+            pass
+
+    def expire(self, lease_time, max_attempts, worker):
+        """Returns running tasks whose leases have expired to pending
+
+        Tasks which have been attempted max_attempts times are failed
+        instead. Returns the number of leases which expired.
+        """
+        now = time.time()
+        count = 0
+        for name in self.list('running'):
+            running = os.path.join(self.path, 'running', name)
+            try:
+                if lease_age(running, now) < lease_time:
+                    continue
+            except OSError:
+                continue
+            # Take the task over before requeuing it, so only one worker
+            # does. If this worker dies before it's done, the renamed file's
+            # lease expires in turn
+            reaped = os.path.join(
+                self.path, 'running',
+                '%s@expired-%s.json' % (self.task_id(name), worker))
+            try:
+                os.rename(running, reaped)
+            except OSError:
+                continue
+            count += 1
+            task = self.read('running', os.path.basename(reaped))
+            if task is not None:
+                task['attempts'] = task.get('attempts', 0) + 1
+                holder = name.rsplit('.json', 1)[0].partition('@')[2]
+                if task['attempts'] >= max_attempts:
+                    logging.error(
+                        'Lease of task %s expired on %s; giving up after %d '
+                        'attempts', task['id'], holder, task['attempts'])
+                    task.update(
+                        code=None, worker=holder,
+                        error='lease expired %d times' % task['attempts'])
+                    self.write('failed', task)
+                else:
+                    logging.warning(
+                        'Lease of task %s expired on %s; requeuing it',
+                        task['id'], holder)
+                    self.write('pending', task)
+            os.unlink(reaped)
+        return count
+
+    def status(self, lease_time):
+        """Returns a summary of the queue as a dict
+
+        The summary has the number of tasks in each state, a list of
+        (task, worker, heartbeat age) for running tasks, the results of done
+        and failed tasks, and a count of expired leases.
+        """
+        now = time.time()
+        result = dict(
+            (state, len(self.list(state))) for state in QUEUE_STATES)
+        result['running_tasks'] = []
+        result['expired'] = 0
+        for name in self.list('running'):
+            try:
+                age = lease_age(
+                    os.path.join(self.path, 'running', name), now)
+            except OSError:
+                continue
+            task = self.read('running', name)
+            if task is not None:
+                result['running_tasks'].append(
+                    (task, name.rsplit('.json', 1)[0].partition('@')[2], age))
+            if age >= lease_time:
+                result['expired'] += 1
+        for state in ('done', 'failed'):
+            result[state + '_tasks'] = [
+                task for task in (
+                    self.read(state, name) for name in self.list(state))
+                if task is not None]
+        return result
+
+
+class Heartbeat(object):
+    """Context manager which renews a lease in a background thread"""
+
+    def __init__(self, queue, lease, interval):
+        self.queue = queue
+        self.lease = lease
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if not self.queue.heartbeat(self.lease):
+                logging.warning(
+                    'Lost the lease of %s; another worker may repeat it',
+                    os.path.basename(self.lease))
+                break
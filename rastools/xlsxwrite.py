@@ -0,0 +1,105 @@
+# vim: set et sw=4 sts=4:
+
+# Copyright 2012 Dave Hughes.
+#
+# This file is part of rastools.
+#
+# rastools is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# rastools is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# rastools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Microsoft Excel 2007+ (.xlsx) writer module for rasdump and rasviewer"""
+
+from __future__ import (
+    unicode_literals,
+    print_function,
+    absolute_import,
+    division,
+    )
+
+import re
+
+import xlsxwriter
+
+
+# Limits of an Excel 2007+ worksheet (compared to 256 x 65536 for .xls)
+MAX_COLUMNS = 16384
+MAX_ROWS = 1048576
+MAX_SHEET_NAME = 31
+
+INVALID_SHEET_CHARS = re.compile(r'[\[\]:*?/\\]')
+
+
+def check_size(x_size, y_size):
+    "Raises ValueError if the specified data won't fit in a worksheet"
+    if x_size > MAX_COLUMNS:
+        raise ValueError('Data has too many columns to fit in an Excel '
+            'spreadsheet (%d)' % x_size)
+    if y_size > MAX_ROWS:
+        raise ValueError('Data has too many rows to fit in an Excel '
+            'spreadsheet (%d)' % y_size)
+
+def sheet_name(channel, used):
+    "Returns a unique, valid worksheet name for channel"
+    name = INVALID_SHEET_CHARS.sub('_',
+        '{channel} - {channel_name}'.format(**channel.format_dict()))
+    name = name[:MAX_SHEET_NAME]
+    suffix = 1
+    while name.lower() in used:
+        suffix += 1
+        tail = ' (%d)' % suffix
+        name = name[:MAX_SHEET_NAME - len(tail)] + tail
+    used.add(name.lower())
+    return name
+
+def write_sheet(worksheet, data):
+    "Writes data to worksheet a whole row at a time"
+    # Rows must be written in order for constant_memory mode to work; tolist()
+    # converts each row to native Python numbers in a single call
+    for row_num, row in enumerate(data):
+        worksheet.write_row(row_num, 0, row.tolist())
+
+
+class XlsxWriter(object):
+    "Single-sheet writer class for Microsoft Excel 2007+ output"
+
+    def __init__(self, filename_or_obj, channel):
+        check_size(channel.parent.x_size, channel.parent.y_size)
+        # constant_memory flushes each row to a temporary file as soon as the
+        # next row is started, so memory use is independent of the data size
+        self._workbook = xlsxwriter.Workbook(
+            filename_or_obj, {'constant_memory': True})
+        self._worksheet = self._workbook.add_worksheet(
+            sheet_name(channel, set()))
+
+    def write(self, data):
+        "Writes channel data to the first workbook sheet"
+        write_sheet(self._worksheet, data)
+        self._workbook.close()
+
+class XlsxMulti(object):
+    "Multi-sheet writer class for Microsoft Excel 2007+ output"
+
+    def __init__(self, filename_or_obj, data_file):
+        check_size(data_file.x_size, data_file.y_size)
+        self._workbook = xlsxwriter.Workbook(
+            filename_or_obj, {'constant_memory': True})
+        self._names = set()
+
+    def write_page(self, data, channel):
+        "Writes channel data to a new workbook sheet"
+        write_sheet(
+            self._workbook.add_worksheet(sheet_name(channel, self._names)),
+            data)
+
+    def close(self):
+        "Finalizes the workbook and closes the file"
+        self._workbook.close()
@@ -0,0 +1,130 @@
+# vim: set et sw=4 sts=4:
+
+# Copyright 2012 Dave Hughes.
+#
+# This file is part of rastools.
+#
+# rastools is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# rastools is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# rastools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the processing of several data files by run_batch"""
+
+from __future__ import (
+    unicode_literals,
+    print_function,
+    absolute_import,
+    division,
+    )
+
+import io
+import os
+import sys
+import time
+import shutil
+import optparse
+import tempfile
+
+from rastools.rasinfo import RasInfoUtility
+from utils import *
+
+
+TEMP_DIRS = []
+
+
+class BatchUtility(RasInfoUtility):
+    """rasinfo, with the processing of some files failing or slowed down
+
+    Files are treated according to the start of their names: "fail" files
+    raise an error, "usage" files a command line error, and "slow" files
+    take longer than the rest (so their results are the last to arrive).
+    """
+
+    def process(self, options, data_file):
+        name = os.path.basename(data_file.filename)
+        if name.startswith('slow'):
+            time.sleep(0.5)
+        if name.startswith('fail'):
+            raise ValueError('failed to process %s' % name)
+        if name.startswith('usage'):
+            self.parser.error('bad usage in %s' % name)
+        sys.stdout.write('processed %s\n' % name)
+
+
+def make_files(*names):
+    path = tempfile.mkdtemp()
+    TEMP_DIRS.append(path)
+    result = []
+    for name in names:
+        filename = os.path.join(path, name)
+        if name.startswith('broken'):
+            with io.open(filename, 'w') as f:
+                f.write('not a data file\n')
+        else:
+            shutil.copy(TEST_DAT, filename)
+        result.append(filename)
+    return result
+
+def run_batch(jobs, files):
+    "Returns the exit code and stdout of BatchUtility for files"
+    stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        code = BatchUtility()(['--jobs', str(jobs)] + files)
+        return code, sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+
+def processed(*names):
+    return ''.join('processed %s\n' % name for name in names)
+
+
+def test_batch_order():
+    # Output is written in the order of the inputs, not of completion
+    files = make_files('slow1.dat', 'slow2.dat', 'a.dat', 'b.dat', 'c.dat')
+    for jobs in (1, 2, 5):
+        assert run_batch(jobs, files) == (0, processed(
+            'slow1.dat', 'slow2.dat', 'a.dat', 'b.dat', 'c.dat'))
+
+def test_batch_errors():
+    # A file which fails (to open or to process) doesn't affect the others,
+    # and the exit code is the highest of any file
+    files = make_files(
+        'slow.dat', 'fail.dat', 'a.dat', 'broken.dat', 'b.dat')
+    for jobs in (1, 3):
+        assert run_batch(jobs, files) == (1, processed(
+            'slow.dat', 'a.dat', 'b.dat'))
+
+def test_batch_usage():
+    # Command line errors affect every file, so nothing after the first is
+    # processed (or at least, has its output written). Workers report them
+    # with an exit code of 2; processed in turn, they're raised for the
+    # global exception handler as with a single file
+    files = make_files(
+        'slow.dat', 'fail.dat', 'usage.dat', 'a.dat', 'b.dat', 'c.dat')
+    for jobs in (2, 4):
+        assert run_batch(jobs, files) == (2, processed('slow.dat'))
+    stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        try:
+            BatchUtility()(['--jobs', '1'] + files)
+        except optparse.OptParseError as exc:
+            assert str(exc) == 'bad usage in usage.dat'
+        else:
+            assert False, 'OptParseError not raised'
+        assert sys.stdout.getvalue() == processed('slow.dat')
+    finally:
+        sys.stdout = stdout
+
+def teardown():
+    for path in TEMP_DIRS:
+        shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,190 @@
+# vim: set et sw=4 sts=4:
+
+# Copyright 2012 Dave Hughes.
+#
+# This file is part of rastools.
+#
+# rastools is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# rastools is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# rastools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Unit tests for the caches"""
+
+from __future__ import (
+    unicode_literals,
+    print_function,
+    absolute_import,
+    division,
+    )
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+
+from rastools.cache import LRUCache, OutputCache
+from rastools.datparse import DatParser
+from rastools.processing import RasChannelProcessor
+from rastools.settings import Percentile
+from utils import *
+
+
+TEMP_DIRS = []
+
+def make_temp_dir():
+    path = tempfile.mkdtemp()
+    TEMP_DIRS.append(path)
+    return path
+
+
+def test_lru_compute():
+    cache = LRUCache(2)
+    assert cache.compute('a', lambda: 1) == 1
+    assert cache.compute('a', lambda: 2) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_lru_compute_concurrent():
+    cache = LRUCache(2)
+    calls = []
+    def factory():
+        calls.append(None)
+        time.sleep(0.2)
+        return 'value'
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(cache.compute('key', factory)))
+        for i in range(4)
+        ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ['value'] * 4
+    assert len(calls) == 1
+    assert (cache.hits, cache.misses) == (3, 1)
+
+def test_lru_compute_failure():
+    cache = LRUCache(2)
+    def fail():
+        raise ValueError('failed')
+    try:
+        cache.compute('key', fail)
+    except ValueError:
+        pass
+    else:
+        assert False
+    assert 'key' not in cache
+    assert cache.compute('key', lambda: 1) == 1
+
+def test_shared_stats():
+    # Two processors of the same channel with the same crop and clip (as the
+    # outputs of one rasextract run) calculate its statistics once
+    data_file = DatParser(TEST_DAT)
+    channel = data_file.channels[1]
+    cache = LRUCache(2)
+    results = []
+    for i in range(2):
+        processor = RasChannelProcessor(channel.data.shape[::-1])
+        processor.clip = Percentile(20.0, 80.0)
+        processor.stats_cache = cache
+        results.append(processor.process_single(channel)[1:])
+    assert results[0] == results[1]
+    assert (cache.hits, cache.misses) == (1, 1)
+    # A different clip is a different key
+    processor.clip = Percentile(10.0, 90.0)
+    processor.process_single(channel)
+    assert (cache.hits, cache.misses) == (1, 2)
+
+def change_size(filename, stat):
+    # Lengthen the comment of the data file, keeping its modification time
+    with open(filename, 'r') as f:
+        content = f.read()
+    with open(filename, 'w') as f:
+        f.write(content.replace('TEST COMMENT', 'TEST COMMENTS'))
+    os.utime(filename, (stat.st_atime, stat.st_mtime - 10))
+
+def test_output_cache():
+    path = make_temp_dir()
+    cache = OutputCache(os.path.join(path, 'cache'), 1024)
+    output = os.path.join(path, 'output.csv')
+    key = cache.key('csv', 1)
+    assert not cache.fetch(key, output)
+    with open(output, 'w') as f:
+        f.write('1,2,3\n')
+    cache.store(key, output)
+    os.unlink(output)
+    assert cache.fetch(key, output)
+    with open(output, 'r') as f:
+        assert f.read() == '1,2,3\n'
+    # A hard-linked output is removed before it's overwritten, leaving the
+    # cached copy intact
+    cache.detach(output)
+    assert not os.path.exists(output)
+    assert cache.fetch(key, output)
+    assert cache.key('csv', 2) != key
+
+def test_output_cache_fingerprint():
+    path = make_temp_dir()
+    data_file = os.path.join(path, 'test.dat')
+    shutil.copy(TEST_DAT, data_file)
+    fingerprint = OutputCache.fingerprint(data_file)
+    assert OutputCache.fingerprint(data_file) == fingerprint
+    stat = os.stat(data_file)
+    os.utime(data_file, (stat.st_atime, stat.st_mtime - 10))
+    assert OutputCache.fingerprint(data_file) != fingerprint
+    fingerprint = OutputCache.fingerprint(data_file)
+    change_size(data_file, stat)
+    assert OutputCache.fingerprint(data_file) != fingerprint
+
+def test_output_cache_evict():
+    path = make_temp_dir()
+    cache = OutputCache(os.path.join(path, 'cache'), 250)
+    for index in range(3):
+        output = os.path.join(path, 'output%d.csv' % index)
+        with open(output, 'w') as f:
+            f.write('x' * 100)
+        cache.store(cache.key(index), output)
+        # Ensure the entries' modification times differ
+        entry = cache.entry(cache.key(index))
+        os.utime(entry, (index, index))
+    cache.evict()
+    assert [size for (_, size, _) in cache.entries()] == [100, 100]
+    assert not cache.fetch(cache.key(0), os.path.join(path, 'new.csv'))
+    assert cache.fetch(cache.key(2), os.path.join(path, 'new.csv'))
+
+def test_rasdump_cache():
+    # A second run reuses the cached output; changing the size or
+    # modification time of the input is a miss
+    path = make_temp_dir()
+    data_file = os.path.join(path, 'test.dat')
+    shutil.copy(TEST_DAT, data_file)
+    cmdline = [
+        'rasdump', '--cache', os.path.join(path, 'cache'), '--output',
+        os.path.join(path, 'test.{channel}.csv'), data_file]
+    out, err = run(cmdline)
+    assert not in_output('Reusing', err)
+    out, err = run(cmdline)
+    assert in_output(r'Reusing unchanged .*test\.1\.csv', err)
+    stat = os.stat(data_file)
+    os.utime(data_file, (stat.st_atime, stat.st_mtime - 10))
+    out, err = run(cmdline)
+    assert not in_output('Reusing', err)
+    change_size(data_file, stat)
+    out, err = run(cmdline)
+    assert not in_output('Reusing', err)
+    out, err = run(cmdline)
+    assert in_output('Reusing', err)
+
+def teardown():
+    for path in TEMP_DIRS:
+        shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,204 @@
+# vim: set et sw=4 sts=4:
+
+# Copyright 2012 Dave Hughes.
+#
+# This file is part of rastools.
+#
+# rastools is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# rastools is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# rastools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Round-trip tests for compressed outputs and inputs"""
+
+from __future__ import (
+    unicode_literals,
+    print_function,
+    absolute_import,
+    division,
+    )
+
+import io
+import os
+import shutil
+import tempfile
+from unittest import SkipTest
+
+import numpy as np
+
+from rastools.compression import (
+    COMPRESSORS, DECOMPRESSORS, CHUNK_SIZE, open_output, open_input,
+    is_compressed, read_array)
+from rastools.csvwrite import CsvWriter, TsvWriter
+from utils import *
+
+
+TEMP_DIRS = []
+# Enough lines to fill several of the compression thread's chunks
+LINES = ['%d,%d,%d\r\n' % (i, i * 2, i * 3) for i in range(200000)]
+
+
+def make_temp_dir():
+    path = tempfile.mkdtemp()
+    TEMP_DIRS.append(path)
+    return path
+
+def check_codec(suffix):
+    if suffix not in COMPRESSORS:
+        raise SkipTest('%s compression is not available' % suffix)
+    path = make_temp_dir()
+    filename = os.path.join(path, 'test.csv' + suffix)
+    f = open_output(filename, 'w', encoding='ascii', newline='')
+    for line in LINES:
+        f.write(line)
+    f.close()
+    expected = ''.join(LINES).encode('ascii')
+    assert len(expected) > CHUNK_SIZE * 2
+    # The file can be read by the compression library itself...
+    with io.open(filename, 'rb') as raw:
+        stream = DECOMPRESSORS[suffix](raw)
+        try:
+            assert stream.read() == expected
+        finally:
+            stream.close()
+    # ...and by open_input, with or without its suffix
+    unsuffixed = os.path.join(path, 'test.csv')
+    shutil.copy(filename, unsuffixed)
+    for name in (filename, unsuffixed):
+        f = open_input(name, 'rb')
+        try:
+            assert is_compressed(f)
+            assert f.read() == expected
+        finally:
+            f.close()
+        f = open_input(name, 'r', encoding='ascii', newline='')
+        try:
+            assert f.readline() == LINES[0]
+            assert f.read() == ''.join(LINES[1:])
+        finally:
+            f.close()
+
+def check_read_array(suffix):
+    if suffix not in COMPRESSORS:
+        raise SkipTest('%s compression is not available' % suffix)
+    path = make_temp_dir()
+    filename = os.path.join(path, 'test.ras' + suffix)
+    # An array which spans several chunks, and doesn't end on a boundary
+    data = np.arange(CHUNK_SIZE + 1234, dtype='<u4')
+    with open_output(filename, 'wb') as f:
+        f.write(b'HEADER')
+        f.write(data.tobytes())
+    progress = []
+    with open_input(filename, 'rb') as f:
+        assert f.read(6) == b'HEADER'
+        result = read_array(f, '<u4', data.size, progress.append)
+    assert result.dtype == np.dtype('<u4')
+    assert (result == data).all()
+    assert len(progress) > 1
+    assert progress[-1] == 100
+    # A file which ends early gives a shorter array
+    with open_input(filename, 'rb') as f:
+        f.read(6)
+        result = read_array(f, '<u4', data.size + 10)
+    assert (result == data).all()
+
+def check_rasdump(suffix):
+    # Compressed rasdump output matches the uncompressed output
+    if suffix not in COMPRESSORS:
+        raise SkipTest('%s compression is not available' % suffix)
+    path = make_temp_dir()
+    for fmt in ('.csv', '.ras'):
+        run([
+            'rasdump', '--output',
+            os.path.join(path, 'test.{channel}' + fmt), TEST_DAT])
+        run([
+            'rasdump', '--output',
+            os.path.join(path, 'test.{channel}' + fmt + suffix), TEST_DAT])
+        with io.open(os.path.join(path, 'test.1' + fmt), 'rb') as f:
+            expected = f.read()
+        f = open_input(os.path.join(path, 'test.1' + fmt + suffix), 'rb')
+        try:
+            assert f.read() == expected
+        finally:
+            f.close()
+
+def check_csv_writer(suffix):
+    # The writer finishes compressed output (waiting for the compression
+    # thread) before write returns, while it's still referenced
+    if suffix not in COMPRESSORS:
+        raise SkipTest('%s compression is not available' % suffix)
+    path = make_temp_dir()
+    data = np.arange(600000, dtype=np.int64).reshape((2000, 300))
+    for writer_class, fmt in ((CsvWriter, '.csv'), (TsvWriter, '.tsv')):
+        writer_class(os.path.join(path, 'test' + fmt), None).write(data)
+        writer = writer_class(os.path.join(path, 'test' + fmt + suffix), None)
+        writer.write(data)
+        assert writer._file.closed
+        with io.open(os.path.join(path, 'test' + fmt), 'rb') as f:
+            expected = f.read()
+        assert len(expected) > CHUNK_SIZE * 2
+        with io.open(os.path.join(path, 'test' + fmt + suffix), 'rb') as raw:
+            stream = DECOMPRESSORS[suffix](raw)
+            try:
+                assert stream.read() == expected
+            finally:
+                stream.close()
+        writer.close()
+
+def test_plain():
+    path = make_temp_dir()
+    filename = os.path.join(path, 'test.csv')
+    with open_output(filename, 'w', newline='') as f:
+        f.write(LINES[0])
+    with open_input(filename, 'r', newline='') as f:
+        assert not is_compressed(f)
+        assert f.read() == LINES[0]
+
+def test_read_array():
+    # Real files and other streams are read alike
+    path = make_temp_dir()
+    filename = os.path.join(path, 'test.ras')
+    data = np.arange(1000, dtype='<f4')
+    with io.open(filename, 'wb') as f:
+        f.write(data.tobytes())
+    with io.open(filename, 'rb') as f:
+        assert (read_array(f, '<f4', 1000) == data).all()
+    f = io.BytesIO(data.tobytes())
+    assert (read_array(f, '<f4', 1000) == data).all()
+    f = io.BytesIO(data.tobytes()[:-6])
+    assert (read_array(f, '<f4', 1000) == data[:-2]).all()
+
+def test_gzip():
+    check_codec('.gz')
+    check_read_array('.gz')
+    check_rasdump('.gz')
+    check_csv_writer('.gz')
+
+def test_bz2():
+    check_codec('.bz2')
+    check_read_array('.bz2')
+    check_rasdump('.bz2')
+    check_csv_writer('.bz2')
+
+def test_xz():
+    check_codec('.xz')
+    check_read_array('.xz')
+    check_rasdump('.xz')
+    check_csv_writer('.xz')
+
+def test_zstandard():
+    check_codec('.zst')
+    check_read_array('.zst')
+    check_rasdump('.zst')
+    check_csv_writer('.zst')
+
+def teardown():
+    for path in TEMP_DIRS:
+        shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,166 @@
+# vim: set et sw=4 sts=4:
+
+# Copyright 2012 Dave Hughes.
+#
+# This file is part of rastools.
+#
+# rastools is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# rastools is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# rastools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for checkpoint journals and atomic output files"""
+
+from __future__ import (
+    unicode_literals,
+    print_function,
+    absolute_import,
+    division,
+    )
+
+import os
+import shutil
+import tempfile
+
+from rastools.journal import (
+    CheckpointJournal, atomic_output, discard_partial, temp_name)
+from utils import *
+
+
+TEMP_DIRS = []
+
+def make_temp_dir():
+    path = tempfile.mkdtemp()
+    TEMP_DIRS.append(path)
+    return path
+
+def test_atomic_output():
+    path = make_temp_dir()
+    output = os.path.join(path, 'output.csv')
+    with atomic_output(output, sync=True) as temp:
+        assert temp != output
+        with open(temp, 'w') as f:
+            f.write('1,2,3\n')
+        assert not os.path.exists(output)
+    with open(output, 'r') as f:
+        assert f.read() == '1,2,3\n'
+    try:
+        with atomic_output(output) as temp:
+            with open(temp, 'w') as f:
+                f.write('partial')
+            raise ValueError('failed')
+    except ValueError:
+        pass
+    assert os.listdir(path) == ['output.csv']
+    with open(output, 'r') as f:
+        assert f.read() == '1,2,3\n'
+
+def test_discard_partial():
+    path = make_temp_dir()
+    output = os.path.join(path, 'output.csv')
+    others = ['output.csv', 'other.csv', '.tmp.1.other.csv', 'output.csv.1']
+    for name in others + ['.tmp.1.output.csv', '.tmp.22.output.csv']:
+        with open(os.path.join(path, name), 'w') as f:
+            f.write('partial')
+    with open(temp_name(output), 'w') as f:
+        f.write('partial')
+    discard_partial(output)
+    assert sorted(os.listdir(path)) == sorted(others)
+
+def test_journal():
+    path = make_temp_dir()
+    data_file = os.path.join(path, 'test.dat')
+    output = os.path.join(path, 'test.1.csv')
+    shutil.copy(TEST_DAT, data_file)
+    with open(output, 'w') as f:
+        f.write('1,2,3\n')
+    filename = os.path.join(path, 'journal')
+    journal = CheckpointJournal(filename)
+    journal.record(data_file, [1], output)
+    assert journal.completed(data_file, [1], output)
+    assert not journal.completed(data_file, [0], output)
+    assert not journal.completed(data_file)
+    journal = CheckpointJournal(filename, resume=True)
+    assert journal.completed(data_file, [1], output)
+    # A new run ignores the journal's records
+    journal = CheckpointJournal(filename)
+    assert not journal.completed(data_file, [1], output)
+    # The unit is incomplete if its output has gone, or its input changed
+    journal = CheckpointJournal(filename, resume=True)
+    os.unlink(output)
+    assert not journal.completed(data_file, [1], output)
+    with open(output, 'w') as f:
+        f.write('1,2,3\n')
+    stat = os.stat(data_file)
+    os.utime(data_file, (stat.st_atime, stat.st_mtime - 10))
+    assert not journal.completed(data_file, [1], output)
+
+def test_journal_truncated():
+    # The last line of a journal cut short by the death of a run is ignored
+    path = make_temp_dir()
+    data_file = os.path.join(path, 'test.dat')
+    shutil.copy(TEST_DAT, data_file)
+    filename = os.path.join(path, 'journal')
+    journal = CheckpointJournal(filename)
+    journal.record(data_file, [0], data_file)
+    journal.record(data_file, [1], data_file)
+    with open(filename, 'rb') as f:
+        content = f.read()
+    with open(filename, 'wb') as f:
+        f.write(content[:-10])
+    journal = CheckpointJournal(filename, resume=True)
+    assert journal.completed(data_file, [0], data_file)
+    assert not journal.completed(data_file, [1], data_file)
+    CheckpointJournal.truncate(filename)
+    assert os.path.getsize(filename) == 0
+
+def test_rasdump_resume():
+    # A resumed run skips the outputs (and inputs) the journal records as
+    # completed, and writes the rest
+    path = make_temp_dir()
+    data_files = [os.path.join(path, 'test%d.dat' % i) for i in range(2)]
+    for data_file in data_files:
+        shutil.copy(TEST_DAT, data_file)
+    journal = os.path.join(path, 'journal')
+    template = os.path.join(path, '{filename_root}.{channel}.csv')
+    run(['rasdump', '--empty', '--journal', journal, '--output', template]
+        + data_files)
+    outputs = [
+        os.path.join(path, 'test%d.dat.%d.csv' % (i, channel))
+        for i in range(2) for channel in range(2)]
+    for output in outputs:
+        check_exists(output, False)
+    # Simulate a run which died while writing the last output of the second
+    # file, leaving a partial temporary file behind (the journal records each
+    # output, then each input once all its outputs are complete)
+    with open(journal, 'rb') as f:
+        lines = f.read().splitlines(True)
+    assert len(lines) == 6
+    with open(journal, 'wb') as f:
+        f.write(b''.join(lines[:4]))
+    os.unlink(outputs[-1])
+    partial = os.path.join(path, '.tmp.1.test1.dat.1.csv')
+    with open(partial, 'w') as f:
+        f.write('partial')
+    out, err = run([
+        'rasdump', '--empty', '--journal', journal, '--resume', '--output',
+        template] + data_files)
+    assert in_output(r'Skipping completed .*test0\.dat$', err)
+    assert in_output(r'Skipping completed .*test1\.dat\.0\.csv$', err)
+    assert not in_output(r'Skipping completed .*test1\.dat\.1\.csv', err)
+    for output in outputs:
+        check_exists(output, False)
+    check_not_exists(partial, False)
+    with open(journal, 'rb') as f:
+        assert len(f.read().splitlines()) == 6
+
+def teardown():
+    for path in TEMP_DIRS:
+        shutil.rmtree(path, ignore_errors=True)
@@ -30,6 +30,8 @@ import numpy as np
 
 from rastools.datparse import DatParser
 from rastools.datwrite import DatMultiWriter
+from rastools.npyparse import NpzParser
+from rastools.npywrite import NpzMultiWriter
 from rastools.rasparse import RasParser
 from rastools.raswrite import RasMultiWriter
 
@@ -39,6 +41,8 @@ TEST_DAT = os.path.join(THIS_PATH, 'test.dat')
 TEST2_DAT = os.path.join(THIS_PATH, 'test2.dat')
 TEST_RAS = os.path.join(THIS_PATH, 'test.ras')
 TEST2_RAS = os.path.join(THIS_PATH, 'test2.ras')
+TEST_NPZ = os.path.join(THIS_PATH, 'test.npz')
+TEST2_NPZ = os.path.join(THIS_PATH, 'test2.npz')
 TEST_CHANNELS = os.path.join(THIS_PATH, 'channels.txt')
 
 
@@ -58,6 +62,11 @@ def write_ras_file(filename, data_file):
         for channel in data_file.channels:
             f.write_page(channel.data, channel)
 
+def write_npz_file(filename, data_file):
+    with NpzMultiWriter(filename, data_file) as f:
+        for channel in data_file.channels:
+            f.write_page(channel.data, channel)
+
 def check_contents(data_file):
     assert data_file.version == 1
     assert data_file.x_size == 10
@@ -92,7 +101,22 @@ def test_rasroundtrip():
     data_file2 = read_ras_file(TEST2_RAS, TEST_CHANNELS)
     check_contents(data_file2)
 
+def test_npzroundtrip():
+    write_npz_file(TEST_NPZ, read_dat_file(TEST_DAT))
+    data_file = NpzParser(TEST_NPZ)
+    check_contents(data_file)
+    # The channels were stored uncompressed so they're mapped rather than
+    # read into memory
+    assert all(isinstance(data, np.memmap) for data in data_file._data)
+    assert data_file.x_coords == list(range(10))
+    write_npz_file(TEST2_NPZ, data_file)
+    data_file2 = NpzParser(TEST2_NPZ)
+    check_contents(data_file2)
+    assert all(isinstance(data, np.memmap) for data in data_file2._data)
+
 def teardown():
-    for filename in (TEST_RAS, TEST_CHANNELS, TEST2_DAT, TEST2_RAS):
+    for filename in (
+            TEST_RAS, TEST_CHANNELS, TEST2_DAT, TEST2_RAS,
+            TEST_NPZ, TEST2_NPZ):
         if os.path.exists(filename):
             os.unlink(filename)
@@ -0,0 +1,138 @@
+# vim: set et sw=4 sts=4:
+
+# Copyright 2012 Dave Hughes.
+#
+# This file is part of rastools.
+#
+# rastools is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# rastools is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# rastools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the threaded pipelines of rastools.pipeline"""
+
+from __future__ import (
+    unicode_literals,
+    print_function,
+    absolute_import,
+    division,
+    )
+
+import time
+import threading
+
+from rastools.pipeline import pipeline, parallel
+
+
+class Source(object):
+    "An iterable which records how many of its items have been produced"
+
+    def __init__(self, count, fail_at=None):
+        self.count = count
+        self.fail_at = fail_at
+        self.produced = 0
+
+    def __iter__(self):
+        for i in range(self.count):
+            if i == self.fail_at:
+                raise ValueError('source failed at %d' % i)
+            self.produced += 1
+            yield i
+
+def double(item):
+    return [item * 2]
+
+def raises(exc_class, func, *args):
+    try:
+        func(*args)
+    except exc_class as exc:
+        return exc
+    assert False, '%s not raised' % exc_class.__name__
+
+
+def test_pipeline_order():
+    assert list(pipeline(range(100))) == list(range(100))
+    assert list(pipeline(range(100), [double])) == list(range(0, 200, 2))
+    # Stages may produce any number of items for each they receive
+    def repeat(item):
+        return [item] * item
+    assert list(pipeline(range(5), [repeat, double], queue_size=1)) == [
+        2, 4, 4, 6, 6, 6, 8, 8, 8, 8]
+
+def test_pipeline_read_ahead():
+    # Whilst an item is handled, at most queue_size more are produced
+    for queue_size in (1, 2, 3):
+        source = Source(20)
+        for item in pipeline(source, queue_size=queue_size):
+            time.sleep(0.02)
+            assert source.produced <= item + 1 + queue_size
+        assert source.produced == 20
+    source = Source(20)
+    for item in pipeline(source, [double], queue_size=1):
+        time.sleep(0.02)
+        # One item ahead in each of the source and the stage
+        assert source.produced <= item // 2 + 3
+
+def test_pipeline_exceptions():
+    def consume(items):
+        return list(items)
+    exc = raises(ValueError, consume, pipeline(Source(10, fail_at=5)))
+    assert str(exc) == 'source failed at 5'
+    def stage(item):
+        if item == 3:
+            raise KeyError(item)
+        return [item]
+    raises(KeyError, consume, pipeline(range(10), [stage, double]))
+    # Items produced before the failure are still delivered in order
+    result = []
+    def consume_some(items):
+        for item in items:
+            result.append(item)
+    raises(KeyError, consume_some, pipeline(range(10), [stage]))
+    assert result == [0, 1, 2]
+    raises(ValueError, consume, pipeline(range(10), queue_size=0))
+
+def test_pipeline_stop():
+    # Stopping early stops the threads without exhausting the source
+    threads = threading.active_count()
+    source = Source(1000)
+    items = pipeline(source, [double], queue_size=1)
+    for item in items:
+        if item == 10:
+            break
+    items.close()
+    assert threading.active_count() == threads
+    assert source.produced < 20
+
+def test_parallel():
+    def call(value, delay):
+        def result():
+            time.sleep(delay)
+            return value
+        return result
+    # Results are in the order of the calls, not of their completion
+    assert parallel([call(1, 0.1), call(2, 0.0), call(3, 0.05)]) == [1, 2, 3]
+    assert parallel([]) == []
+    finished = []
+    def fail(exc, delay):
+        def result():
+            time.sleep(delay)
+            finished.append(exc)
+            raise exc
+        return result
+    # The first failure in the order of calls is raised, once all have
+    # finished
+    first = KeyError('first')
+    second = ValueError('second')
+    exc = raises(
+        Exception, parallel,
+        [call(1, 0.0), fail(first, 0.1), fail(second, 0.0), call(4, 0.15)])
+    assert exc is first
+    assert finished == [second, first]
@@ -37,6 +37,9 @@ def get_dump_formats():
     for line in formats.splitlines():
         line = line.rstrip()
         if not line:
+            # The list ends at the first blank line after it starts
+            if result:
+                break
             continue
         if accept:
             ext = line.split()[0].lower()
@@ -25,7 +25,12 @@ from __future__ import (
     division,
     )
 
+import io
 import os
+import re
+import base64
+import shutil
+import tempfile
 from PIL import Image
 from utils import *
 
@@ -37,6 +42,9 @@ def get_picture_formats():
     for line in formats.splitlines():
         line = line.rstrip()
         if not line:
+            # The list ends at the first blank line after it starts
+            if result:
+                break
             continue
         if accept:
             ext = line.split()[0].lower()
@@ -153,6 +161,161 @@ def check_rasextract(filename):
             run(['rasextract', '--multi', '--output', test, filename])
             check_exists(test)
 
+def check_multiple_outputs(filename):
+    # Several outputs from one read of the data file must match the output
+    # of separate runs
+    run([
+        'rasextract', '--empty', '--percentile', '10-90',
+        '--output', os.path.join(THIS_PATH, 'test-one.{channel}.png'),
+        '--output', os.path.join(THIS_PATH, 'test-one.{channel}.csv'),
+        filename])
+    run([
+        'rasextract', '--empty', '--percentile', '10-90', '--output',
+        os.path.join(THIS_PATH, 'test-sep.{channel}.png'), filename])
+    run([
+        'rasdump', '--empty', '--percentile', '10-90', '--output',
+        os.path.join(THIS_PATH, 'test-sep.{channel}.csv'), filename])
+    for channel in (0, 1):
+        for fmt in ('.png', '.csv'):
+            one = os.path.join(THIS_PATH, 'test-one.%d%s' % (channel, fmt))
+            sep = os.path.join(THIS_PATH, 'test-sep.%d%s' % (channel, fmt))
+            check_exists(one)
+            check_exists(sep)
+            with open(one, 'rb') as f1, open(sep, 'rb') as f2:
+                assert f1.read() == f2.read()
+
+def check_montage(filename):
+    # The default output of --montage has no {channel} variables; it's
+    # written to the current directory so run from a scratch one
+    path = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        run(['rasextract', '--empty', '--montage', filename])
+        # Both test files have a filename_root of test.dat (RAS files record
+        # the name of the file they were produced from)
+        montage = os.path.join(path, 'test.dat_montage.png')
+        assert os.listdir(path) == [os.path.basename(montage)]
+        check_image_size(montage, at_least=(20, 10))
+        run([
+            'rasextract', '--empty', '--montage', '--montage-columns', '1',
+            '--output', 'all.png', filename])
+        check_image_size(os.path.join(path, 'all.png'), at_least=(10, 20))
+        # A template which needs a channel is rejected rather than crashing
+        try:
+            run([
+                'rasextract', '--montage', '--output',
+                'test.{channel}.png', filename])
+        except ValueError:
+            pass
+        else:
+            assert False, '--montage accepted a {channel} template'
+        assert not os.path.exists(os.path.join(path, 'test.0.png'))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(path)
+
+def check_encoders(filename):
+    # The encoder options trade size against speed (or quality) without
+    # changing the image's mode or (for lossless formats) its pixels
+    path = tempfile.mkdtemp()
+    def extract(name, *options):
+        # Returns the output of the Sequence channel
+        run(['rasextract', '--resize', '10', '--output',
+            os.path.join(path, name % '{channel}')] +
+            list(options) + [filename])
+        return os.path.join(path, name % 1)
+    def rejected(*options):
+        try:
+            extract('rejected.%s.png', *options)
+        except ValueError:
+            return True
+        return False
+    try:
+        default = Image.open(extract('default.%s.png'))
+        sizes = {}
+        for level in (0, 9):
+            for strategy in ('default', 'huffman'):
+                output = extract(
+                    'png-%d-%s.%%s.png' % (level, strategy),
+                    '--png-compression', str(level),
+                    '--png-strategy', strategy)
+                image = Image.open(output)
+                assert image.mode == default.mode == 'RGBA'
+                assert list(image.getdata()) == list(default.getdata())
+                sizes[(level, strategy)] = os.path.getsize(output)
+        assert sizes[(0, 'default')] > sizes[(9, 'default')]
+        assert rejected('--png-compression', '10')
+        assert rejected('--png-strategy', 'foo')
+        low = extract('q10.%s.jpg', '--jpeg-quality', '10')
+        high = extract('q95.%s.jpg', '--jpeg-quality', '95')
+        assert Image.open(low).mode == Image.open(high).mode == 'RGB'
+        assert os.path.getsize(low) < os.path.getsize(high)
+        assert rejected('--jpeg-quality', '0')
+        # Formats which were converted from Agg's PNG keep its alpha channel
+        for fmt, mode in (('.tif', 'RGBA'), ('.bmp', 'RGB')):
+            assert Image.open(extract('mode.%s' + fmt)).mode == mode
+    finally:
+        shutil.rmtree(path)
+
+def check_layers(filename):
+    # Any number of layers may be blended, each with its own color and range
+    path = tempfile.mkdtemp()
+    try:
+        for blend in ('add', 'max'):
+            output = os.path.join(path, 'layers-%s.png' % blend)
+            run([
+                'rasextract', '--blend', blend, '--output', output,
+                '--layers', '1:red,1:#008000,,1:#008080:0-49,0:yellow',
+                filename])
+            image = Image.open(output).convert('RGB')
+            assert image.size == (10, 10)
+            # The last pixel is the maximum of every layer but the zeros
+            assert image.getpixel((9, 9)) == {
+                'add': (255, 255, 128), 'max': (255, 128, 128)}[blend]
+        for layers in ('1:nocolor', '1:red:50-10', '1:red:0-200%', ','):
+            try:
+                run([
+                    'rasextract', '--layers', layers, '--output',
+                    os.path.join(path, 'bad.png'), filename])
+            except ValueError:
+                pass
+            else:
+                assert False, '--layers %s accepted' % layers
+    finally:
+        shutil.rmtree(path)
+
+def check_raster_limits(filename):
+    # --max-pixels limits the raster embedded in vector output (keeping its
+    # aspect ratio), and only applies to vector formats
+    path = tempfile.mkdtemp()
+    def embedded_size(*options):
+        run(['rasextract', '--output', os.path.join(path, 'test.{channel}.svg')]
+            + list(options) + [filename])
+        with io.open(os.path.join(path, 'test.1.svg'), 'r') as f:
+            images = re.findall(r'data:image/png;base64,([^"]+)"', f.read())
+        assert len(images) == 1
+        data = base64.b64decode(re.sub(r'\s', '', images[0]))
+        return Image.open(io.BytesIO(data)).size
+    try:
+        assert embedded_size() == (10, 10)
+        assert embedded_size('--max-pixels', '25') == (5, 5)
+        assert embedded_size('--max-pixels', '1000') == (10, 10)
+        # Cropped to 5 columns by 10 rows
+        assert embedded_size('--crop', '0,0,0,5', '--max-pixels', '12') == (
+            2, 4)
+        for options in (['--dpi', '72'], ['--max-pixels', '25']):
+            try:
+                run(['rasextract', '--output',
+                    os.path.join(path, 'test.{channel}.png')] + options +
+                    [filename])
+            except ValueError:
+                pass
+            else:
+                assert False, '%s accepted for PNG output' % options[0]
+    finally:
+        shutil.rmtree(path)
+
 
 def setup():
     create_test_ras()
@@ -162,5 +325,21 @@ def test_rasextract():
     check_rasextract(TEST_DAT)
     check_rasextract(TEST_RAS)
 
+def test_multiple_outputs():
+    check_multiple_outputs(TEST_DAT)
+
+def test_encoders():
+    check_encoders(TEST_DAT)
+
+def test_layers():
+    check_layers(TEST_DAT)
+
+def test_raster_limits():
+    check_raster_limits(TEST_DAT)
+
+def test_montage():
+    check_montage(TEST_DAT)
+    check_montage(TEST_RAS)
+
 def teardown():
     delete_produced_files()
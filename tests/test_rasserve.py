@@ -0,0 +1,183 @@
+# vim: set et sw=4 sts=4:
+
+# Copyright 2012 Dave Hughes.
+#
+# This file is part of rastools.
+#
+# rastools is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# rastools is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# rastools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the rasserve render server and its caches"""
+
+from __future__ import (
+    unicode_literals,
+    print_function,
+    absolute_import,
+    division,
+    )
+
+import os
+import shutil
+import tempfile
+import threading
+
+from rastools.cache import LRUCache
+from rastools.rasserve import RenderServer, RenderError, EXCLUDED_OPTIONS
+from rastools.terminal import normalize_path
+from utils import *
+
+
+TEMP_DIRS = []
+
+def raises_status(status, func, *args):
+    try:
+        func(*args)
+    except RenderError as exc:
+        assert exc.status == status, str(exc)
+    else:
+        assert False, 'RenderError %d not raised' % status
+
+def make_server():
+    path = normalize_path(tempfile.mkdtemp())
+    TEMP_DIRS.append(path)
+    shutil.copy(TEST_DAT, path)
+    return RenderServer(path, None, 2 ** 30, 2 ** 20)
+
+def test_lru_eviction():
+    evicted = []
+    cache = LRUCache(2, on_evict=lambda key, value: evicted.append(key))
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache['a'] == 1
+    cache['c'] = 3
+    assert evicted == ['b']
+    assert cache.keys() == ['a', 'c']
+    assert cache.get('b') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_lru_discard():
+    evicted = []
+    cache = LRUCache(
+        10, sizeof=len, on_evict=lambda key, value: evicted.append(key))
+    cache['a'] = 'xxx'
+    cache['b'] = 'yyyy'
+    cache['c'] = 'zz'
+    assert cache.discard(lambda key: key in ('a', 'c')) == [
+        ('a', 'xxx'), ('c', 'zz')]
+    assert cache.keys() == ['b']
+    # Discarded items aren't evicted, and no longer count against the size
+    assert evicted == []
+    cache['d'] = 'wwwwww'
+    assert cache.keys() == ['b', 'd']
+    cache['e'] = 'v'
+    assert evicted == ['b']
+
+def test_load_once():
+    # Concurrent requests for a file which isn't cached load it once
+    server = make_server()
+    filename, fingerprint = server.resolve('/test.dat')
+    options, _, _ = server.parse_query('')
+    results = []
+    def request():
+        results.append(server.data_file(filename, fingerprint, options))
+    threads = [threading.Thread(target=request) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 4
+    assert all(data_file is results[0] for data_file in results)
+    assert server.parsers.misses == 1
+    assert len(server.parsers) == 1
+
+def test_reload():
+    # A changed file replaces its previous version, and the statistics of
+    # the previous version's channels
+    server = make_server()
+    filename, fingerprint = server.resolve('/test.dat')
+    options, _, _ = server.parse_query('')
+    data_file = server.data_file(filename, fingerprint, options)
+    server.stats[(data_file.channels[1], None)] = 'stats'
+    assert server.data_file(filename, fingerprint, options) is data_file
+    assert len(server.stats) == 1
+    stat = os.stat(filename)
+    os.utime(filename, (stat.st_atime, stat.st_mtime - 10))
+    filename, new_fingerprint = server.resolve('/test.dat')
+    assert new_fingerprint != fingerprint
+    new_data_file = server.data_file(filename, new_fingerprint, options)
+    assert new_data_file is not data_file
+    assert len(server.parsers) == 1
+    assert len(server.stats) == 0
+
+def test_forbidden():
+    # Paths outside the served directory are refused, whether or not they
+    # exist
+    server = make_server()
+    for path in (
+            '/../test.dat', '/sub/../../test.dat',
+            '/' + os.path.relpath(TEST_DAT, server.root)):
+        raises_status(403, server.resolve, path)
+        raises_status(403, server.render, path, '')
+    raises_status(404, server.render, '/missing.dat', '')
+    raises_status(404, server.render, '/test.txt', '')
+
+def test_excluded_options():
+    server = make_server()
+    for option in EXCLUDED_OPTIONS:
+        raises_status(400, server.render, '/test.dat', option[2:] + '=x')
+        raises_status(400, server.parse_query, option[2:])
+    raises_status(400, server.parse_query, 'no-such-option')
+    raises_status(400, server.parse_query, 'channel=one')
+    raises_status(400, server.parse_query, 'format=xcf')
+    raises_status(400, server.render, '/test.dat', 'percentile=90-10')
+    options, channel, image_format = server.parse_query(
+        'channel=1&percentile=10-90&format=JPG')
+    assert channel == 1
+    assert image_format == 'jpg'
+    assert options.output == 'image.jpg'
+
+def test_missing_channel():
+    server = make_server()
+    raises_status(404, server.render, '/test.dat', 'channel=5')
+    # Channel 0 is empty, and isn't rendered unless empty is given
+    raises_status(404, server.render, '/test.dat', 'channel=0')
+    content_type, body = server.render('/test.dat', 'channel=0&empty')
+    assert content_type == 'image/png'
+    assert body.startswith(b'\x89PNG')
+
+def test_image_cache():
+    # Repeated requests are answered from the image cache until the data
+    # file changes
+    server = make_server()
+    result = server.render('/test.dat', 'channel=1')
+    assert result[0] == 'image/png'
+    assert server.render('/test.dat', 'channel=1') is result
+    assert (server.images.hits, server.images.misses) == (1, 1)
+    assert server.parsers.misses == 1
+    # A different query is rendered from the cached data file
+    jpeg = server.render('/test.dat', 'channel=1&format=jpg')
+    assert jpeg[0] == 'image/jpeg'
+    assert jpeg[1].startswith(b'\xff\xd8')
+    assert (server.images.hits, server.images.misses) == (1, 2)
+    assert server.parsers.misses == 1
+    filename = os.path.join(server.root, 'test.dat')
+    stat = os.stat(filename)
+    os.utime(filename, (stat.st_atime, stat.st_mtime - 10))
+    changed = server.render('/test.dat', 'channel=1')
+    assert changed is not result
+    assert changed == result
+    assert (server.images.hits, server.images.misses) == (1, 3)
+    assert server.parsers.misses == 2
+
+def teardown():
+    for path in TEMP_DIRS:
+        shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,161 @@
+# vim: set et sw=4 sts=4:
+
+# Copyright 2012 Dave Hughes.
+#
+# This file is part of rastools.
+#
+# rastools is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# rastools is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# rastools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the raswatch utility"""
+
+from __future__ import (
+    unicode_literals,
+    print_function,
+    absolute_import,
+    division,
+    )
+
+import io
+import os
+import shutil
+import tempfile
+
+from rastools.datparse import DatParser
+from rastools.raswrite import RasMultiWriter
+from rastools.raswatch import RasWatchUtility, ras_complete
+from rastools.terminal import normalize_path
+from utils import *
+
+
+TEMP_DIRS = []
+
+def make_temp_dir():
+    path = normalize_path(tempfile.mkdtemp())
+    TEMP_DIRS.append(path)
+    return path
+
+def run_in(path, cmdline):
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        return run(cmdline)
+    finally:
+        os.chdir(cwd)
+
+def test_wanted():
+    utility = RasWatchUtility()
+    join = os.path.join
+    root = join(os.sep, 'data', 'incoming')
+    # Output elsewhere
+    output = join(os.sep, 'output')
+    assert utility.wanted(join(root, 'scan.ras'), root, output)
+    assert utility.wanted(join(root, 'scan.DAT'), root, output)
+    assert not utility.wanted(join(root, 'scan.txt'), root, output)
+    # Output to a parent of the watched directory, as with the default
+    # --output-dir when raswatch is started beside the watched directory
+    output = join(os.sep, 'data')
+    assert utility.wanted(join(root, 'scan.ras'), root, output)
+    assert utility.wanted(join(root, 'scan.ras'), root, output, True)
+    # Output within the watched tree
+    output = join(root, 'processed')
+    assert utility.wanted(join(root, 'scan.ras'), root, output, True)
+    assert utility.wanted(join(root, 'a', 'scan.ras'), root, output, True)
+    assert not utility.wanted(join(output, 'scan.ras'), root, output, True)
+    assert not utility.wanted(
+        join(output, 'a', 'scan.ras'), root, output, True)
+
+def test_wanted_mirror():
+    # With output to a parent of the watched directory, the output of a
+    # watched subdirectory may land back in the watched tree
+    path = make_temp_dir()
+    root = os.path.join(path, 'incoming')
+    os.makedirs(os.path.join(root, 'incoming'))
+    utility = RasWatchUtility()
+    scan = os.path.join(root, 'scan.ras')
+    assert utility.wanted(scan, root, path, False)
+    assert not utility.wanted(scan, root, path, True)
+
+def test_ras_complete():
+    path = make_temp_dir()
+    filename = os.path.join(path, 'test.ras')
+    data_file = DatParser(TEST_DAT)
+    with RasMultiWriter(filename, data_file) as f:
+        for channel in data_file.channels:
+            f.write_page(channel.data, channel)
+    size = os.path.getsize(filename)
+    assert ras_complete(filename, size)
+    # The file is complete once its data is, before its terminator
+    assert ras_complete(filename, size - 4)
+    assert not ras_complete(filename, size - 5)
+    truncated = os.path.join(path, 'truncated.ras')
+    with io.open(filename, 'rb') as source:
+        with io.open(truncated, 'wb') as target:
+            target.write(source.read(100))
+    assert not ras_complete(truncated, 100)
+    assert not ras_complete(os.path.join(path, 'missing.ras'), size)
+
+def test_raswatch_once():
+    path = make_temp_dir()
+    incoming = os.path.join(path, 'incoming')
+    os.makedirs(incoming)
+    shutil.copy(TEST_DAT, incoming)
+    output = os.path.join(path, 'output')
+    cmdline = [
+        'raswatch', '-v', '--once', '--poll', '--settle', '0',
+        '--output-dir', output, '--dump',
+        '--empty -o {filename_root}.{channel}.csv', incoming]
+    out, err = run(cmdline)
+    assert in_output(r'Processed 1 files \(0 failed', err)
+    check_exists(os.path.join(output, 'test.dat.0.csv'), False)
+    check_exists(os.path.join(output, 'test.dat.1.csv'), False)
+    check_exists(os.path.join(output, '.raswatch'), False)
+    # The journal is reloaded, so unchanged files aren't processed again...
+    os.unlink(os.path.join(output, 'test.dat.1.csv'))
+    out, err = run(cmdline)
+    assert in_output(r'Processed 0 files', err)
+    check_not_exists(os.path.join(output, 'test.dat.1.csv'), False)
+    # ...even if the journal's last line was cut short, but changed files are
+    with io.open(os.path.join(output, '.raswatch'), 'ab') as f:
+        f.write(b'["/data/scan')
+    stat = os.stat(os.path.join(incoming, 'test.dat'))
+    os.utime(
+        os.path.join(incoming, 'test.dat'),
+        (stat.st_atime, stat.st_mtime - 10))
+    out, err = run(cmdline)
+    assert in_output(r'Processed 1 files \(0 failed', err)
+    check_exists(os.path.join(output, 'test.dat.1.csv'), False)
+
+def test_raswatch_default_output():
+    # Run beside the watched directory, the default --output-dir writes to
+    # the current directory
+    path = make_temp_dir()
+    incoming = os.path.join(path, 'incoming')
+    os.makedirs(incoming)
+    shutil.copy(TEST_DAT, incoming)
+    out, err = run_in(path, [
+        'raswatch', '-v', '--once', '--poll', '--settle', '0', '--dump',
+        '-o {filename_root}.{channel}.csv', 'incoming'])
+    assert in_output(r'Processed 1 files \(0 failed', err)
+    check_exists(os.path.join(path, 'test.dat.1.csv'), False)
+    # Run within it, there'd be no telling output from input
+    try:
+        run_in(incoming, [
+            'raswatch', '--once', '--poll', '--dump', '-o x.csv', '.'])
+    except ValueError:
+        pass
+    else:
+        assert False
+
+def teardown():
+    for path in TEMP_DIRS:
+        shutil.rmtree(path, ignore_errors=True)
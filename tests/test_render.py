@@ -0,0 +1,233 @@
+# vim: set et sw=4 sts=4:
+
+# Copyright 2012 Dave Hughes.
+#
+# This file is part of rastools.
+#
+# rastools is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# rastools is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# rastools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Unit tests for the renderers"""
+
+from __future__ import (
+    unicode_literals,
+    print_function,
+    absolute_import,
+    division,
+    )
+
+import os
+
+import numpy as np
+
+from rastools.blend import blend_layers, default_layer_color
+from rastools.datparse import DatParser
+from rastools.processing import RasChannelEmptyError, RasChannelProcessor
+from rastools.render import ChannelRenderer, render, render_rgba
+from rastools.settings import Range, Percentile, Crop, Coord
+
+
+THIS_PATH = os.path.abspath(os.path.dirname(__file__))
+TEST_DAT = os.path.join(THIS_PATH, 'test.dat')
+
+
+def raises(exc_class, func, *args, **kwargs):
+    try:
+        func(*args, **kwargs)
+    except exc_class as exc:
+        return exc
+    assert False, '%s not raised' % exc_class.__name__
+
+
+def test_histogram_counts():
+    # The counts match np.histogram for integer and float data, whether or
+    # not the range's bounds are whole numbers
+    renderer = ChannelRenderer((50, 50))
+    renderer.histogram_bins = 32
+    data = np.random.RandomState(0).randint(0, 100, (50, 50))
+    for dtype in (np.uint32, np.int64, np.float32):
+        for data_range in (
+                Range(0, 99), Range(5, 50), Range(5.5, 50), Range(5.2, 5.8),
+                Range(10.0, 10.5), Range(3.0, 97.0), Range(-10, 200)):
+            counts, edges = renderer.histogram_counts(
+                data.astype(dtype), data_range)
+            expected_counts, expected_edges = np.histogram(
+                data.astype(dtype), bins=32, range=data_range)
+            assert (counts == expected_counts).all()
+            assert np.allclose(edges, expected_edges)
+
+def test_render():
+    data_file = DatParser(TEST_DAT)
+    zeros, sequence = data_file.channels
+    assert render(sequence).startswith(b'\x89PNG')
+    assert render(sequence, format='JPG').startswith(b'\xff\xd8')
+    # Layers may include empty channels and Nones, so long as one remains
+    assert render([None, sequence, zeros]).startswith(b'\x89PNG')
+    assert raises(RasChannelEmptyError, render, zeros)
+    assert raises(ValueError, render, [None, None])
+    assert 'foo' in str(raises(ValueError, render, sequence, format='foo'))
+    assert 'XCF' in str(raises(ValueError, render, sequence, format='xcf'))
+    assert 'colourmap' in str(
+        raises(ValueError, render, sequence, colourmap='hot'))
+
+def test_render_rgba():
+    data_file = DatParser(TEST_DAT)
+    zeros, sequence = data_file.channels
+    image = render_rgba(sequence)
+    assert image.shape == (10, 10, 4)
+    assert image.dtype == np.uint8
+    assert not image.flags.writeable
+    assert (image[..., 3] == 255).all()
+    # The gray colormap maps the sequence's rows from black to white
+    assert (image[0, 0, :3] == 0).all()
+    assert (image[-1, -1, :3] == 255).all()
+    assert render_rgba(sequence, resize=2.0).shape == (20, 20, 4)
+    assert raises(RasChannelEmptyError, render_rgba, zeros)
+    assert raises(ValueError, render_rgba, [None, None])
+    assert raises(ValueError, render_rgba, sequence, colourmap='hot')
+
+def test_process_multiple():
+    # Layers are combined into a single float32 array at their cropped size;
+    # layers without a channel are zeros with no statistics
+    data_file = DatParser(TEST_DAT)
+    zeros, sequence = data_file.channels
+    processor = RasChannelProcessor((10, 10))
+    data, domains, ranges = processor.process_multiple(sequence, None, zeros)
+    assert data.dtype == np.float32
+    assert data.shape == (10, 10, 3)
+    assert (data[..., 0] == sequence.data).all()
+    assert (data[..., 1] == 0).all()
+    assert (data[..., 2] == 0).all()
+    assert domains == [Range(0, 99), Range(0, 0), Range(0, 0)]
+    assert ranges == domains
+    # Each layer may have its own clip, overriding the processor's
+    processor.crop = Crop(1, 2, 3, 4)
+    processor.clip = Range(10, 50)
+    data, domains, ranges = processor.process_multiple(
+        sequence, sequence, clips=[None, Percentile(0.0, 50.0)])
+    assert data.shape == (6, 4, 2)
+    assert (data[..., 0] == sequence.data[1:7, 2:6]).all()
+    assert domains == [Range(12, 65)] * 2
+    assert ranges[0] == Range(12, 50)
+    expected = np.sort(sequence.data[1:7, 2:6], axis=None)
+    assert ranges[1] == Range(expected[0], expected[12])
+
+def test_layered_render():
+    # Each layer is normalized to its own range before blending, so a layer
+    # of the sequence ramps from black to its full color
+    data_file = DatParser(TEST_DAT)
+    zeros, sequence = data_file.channels
+    image = render_rgba([sequence, None, zeros]).astype(np.int32)
+    assert image.shape == (10, 10, 4)
+    expected = (sequence.data * 255 / 99).astype(np.int32)
+    assert (abs(image[..., 0] - expected) <= 1).all()
+    assert (image[..., 1:3] == 0).all()
+    # Layers clipped to a range saturate outside it
+    image = render_rgba(
+        [None, sequence], clips=[None, Range(20, 80)]).astype(np.int32)
+    expected = ((np.clip(sequence.data, 20, 80) - 20) * 255 / 60).astype(
+        np.int32)
+    assert (abs(image[..., 1] - expected) <= 1).all()
+    assert (image[..., 0] == 0).all()
+
+def test_blend_layers():
+    # Any number of layers, each with its own color, blend in a single step
+    state = np.random.RandomState(0)
+    data = state.uniform(-0.5, 1.5, (8, 6, 5)).astype(np.float32)
+    colors = state.uniform(0.0, 1.0, (5, 3))
+    clamped = np.clip(data, 0.0, 1.0)
+    expected_add = np.clip(np.dot(clamped, colors), 0.0, 1.0)
+    expected_max = np.clip(
+        (clamped[..., np.newaxis] * colors).max(axis=2), 0.0, 1.0)
+    result = blend_layers(data.copy(), colors, 'add')
+    assert result.shape == (8, 6, 3)
+    assert result.dtype == np.float32
+    assert np.allclose(result, expected_add, atol=1e-6)
+    result = blend_layers(data.copy(), colors, 'max')
+    assert result.dtype == np.float32
+    assert np.allclose(result, expected_max, atol=1e-6)
+    # The layers are clamped in place, and the traditional red, green, blue
+    # composite is returned without blending
+    rgb = data[..., :3].copy()
+    result = blend_layers(rgb, np.identity(3))
+    assert result is rgb
+    assert (rgb == clamped[..., :3]).all()
+    try:
+        blend_layers(data.copy(), colors[:4])
+    except ValueError:
+        pass
+    else:
+        assert False, 'mismatched colors accepted'
+    try:
+        blend_layers(data.copy(), colors, 'multiply')
+    except ValueError:
+        pass
+    else:
+        assert False, 'unknown mode accepted'
+    # Default colors start with red, green, blue and wrap around
+    assert [default_layer_color(i) for i in range(3)] == [
+        (1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0)]
+    assert default_layer_color(100) == default_layer_color(100 % 8)
+
+def test_layer_colors():
+    # Four layers (one empty) with overlapping colors: added, the green of
+    # the second and fourth layers sums; with max, the brighter is taken
+    data_file = DatParser(TEST_DAT)
+    zeros, sequence = data_file.channels
+    value = sequence.data * 255 / 99
+    layers = [sequence, sequence, None, sequence]
+    colors = [(1, 0, 0), (0, 0.5, 0), (0, 0, 1), (0, 0.5, 1)]
+    for blend, green in (('add', value), ('max', value / 2)):
+        image = render_rgba(
+            layers, colors=colors, blend=blend).astype(np.int32)
+        assert (abs(image[..., 0] - value.astype(np.int32)) <= 1).all()
+        assert (abs(image[..., 1] - green.astype(np.int32)) <= 1).all()
+        assert (abs(image[..., 2] - value.astype(np.int32)) <= 1).all()
+
+def test_rasterize():
+    renderer = ChannelRenderer((100, 60))
+    data = np.arange(6000, dtype=np.float32).reshape((60, 100))
+    # Without a limit (or when within it) the data is drawn as is
+    assert renderer.rasterize(data, Coord(1.0, 1.0)) == (
+        data, renderer.interpolation)
+    renderer.raster_max_pixels = 6000
+    result, interpolation = renderer.rasterize(data, Coord(1.0, 1.0))
+    assert result is data
+    # The pixel count is clamped to max_pixels, keeping the aspect ratio,
+    # and each pixel is the mean of the block it covers
+    renderer.raster_max_pixels = 60
+    result, interpolation = renderer.rasterize(data, Coord(1.0, 1.0))
+    assert interpolation == 'none'
+    assert result.shape == (6, 10)
+    assert result.dtype == np.float32
+    assert np.allclose(
+        result, data.reshape((6, 10, 10, 10)).mean(axis=(1, 3)))
+    # Non-integer scales, and RGB data
+    renderer.raster_max_pixels = 35
+    rgb = np.dstack([data] * 3)
+    result, _ = renderer.rasterize(rgb, Coord(1.0, 1.0))
+    assert result.shape == (4, 7, 3)
+    assert np.allclose(result[0, 0], data[:15, :14].mean())
+    assert np.allclose(result[-1, -1], data[45:, 85:].mean())
+    # The DPI limit applies to the size the image occupies, and the pixel
+    # limit to what remains
+    renderer.raster_max_pixels = None
+    renderer.raster_dpi = 20
+    result, _ = renderer.rasterize(data, Coord(2.0, 1.0))
+    assert result.shape == (20, 40)
+    renderer.raster_max_pixels = 200
+    result, _ = renderer.rasterize(data, Coord(2.0, 1.0))
+    assert result.shape == (10, 20)
+    renderer.raster_max_pixels = 1
+    result, _ = renderer.rasterize(data, Coord(2.0, 1.0))
+    assert result.shape == (1, 1)
+    assert np.isclose(result[0, 0], data.mean())
@@ -0,0 +1,134 @@
+# vim: set et sw=4 sts=4:
+
+# Copyright 2012 Dave Hughes.
+#
+# This file is part of rastools.
+#
+# rastools is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# rastools is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# rastools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the work queue and the rasqueue utility"""
+
+from __future__ import (
+    unicode_literals,
+    print_function,
+    absolute_import,
+    division,
+    )
+
+import os
+import shutil
+import tempfile
+import threading
+
+from rastools.workqueue import WorkQueue
+from utils import *
+
+
+TEMP_DIRS = []
+
+def make_queue():
+    path = tempfile.mkdtemp()
+    TEMP_DIRS.append(path)
+    return WorkQueue(os.path.join(path, 'queue'))
+
+def test_claim_contention():
+    # Every task is claimed by exactly one of several competing workers
+    queue = make_queue()
+    queue.submit([dict(number=i) for i in range(50)])
+    claimed = []
+    def work(worker):
+        while True:
+            task, lease = queue.claim(worker)
+            if task is None:
+                break
+            claimed.append((task['number'], worker))
+            queue.finish(task, lease, dict(code=0))
+    threads = [
+        threading.Thread(target=work, args=('worker%d' % i,))
+        for i in range(8)
+        ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(number for (number, worker) in claimed) == list(range(50))
+    assert len(queue.list('done')) == 50
+    assert not queue.list('pending')
+    assert not queue.list('running')
+
+def test_expire():
+    # A task whose lease expires is requeued until max_attempts is reached,
+    # then failed
+    queue = make_queue()
+    queue.submit([dict(number=1)])
+    task, lease = queue.claim('worker1')
+    assert task['attempts'] == 0
+    assert queue.expire(60, 2, 'worker2') == 0
+    assert queue.expire(0, 2, 'worker2') == 1
+    assert not queue.list('running')
+    task, lease = queue.claim('worker2')
+    assert task['number'] == 1
+    assert task['attempts'] == 1
+    assert queue.expire(0, 2, 'worker3') == 1
+    assert not queue.list('pending')
+    assert not queue.list('running')
+    failed = queue.list('failed')
+    assert len(failed) == 1
+    task = queue.read('failed', failed[0])
+    assert task['attempts'] == 2
+    assert task['code'] is None
+    assert task['worker'] == 'worker2'
+    assert task['error'] == 'lease expired 2 times'
+
+def test_finish_expired():
+    # A worker which finishes a task after its lease expired (and the task
+    # was requeued) records the result, and the requeued copy is dropped
+    queue = make_queue()
+    queue.submit([dict(number=1)])
+    task, lease = queue.claim('worker1')
+    assert queue.expire(0, 3, 'worker2') == 1
+    assert len(queue.list('pending')) == 1
+    assert not queue.heartbeat(lease)
+    queue.finish(task, lease, dict(code=0, worker='worker1'))
+    assert queue.claim('worker2') == (None, None)
+    assert not queue.list('pending')
+    done = queue.list('done')
+    assert len(done) == 1
+    assert queue.read('done', done[0])['worker'] == 'worker1'
+
+def test_rasqueue():
+    queue = make_queue()
+    output_dir = os.path.join(os.path.dirname(queue.path), 'output')
+    run([
+        'rasqueue', '--submit', '--per-channel', '-o', output_dir,
+        '-x', '--empty -o out.{channel}.png',
+        '-d', '--empty -o out.{channel}.csv',
+        queue.path, TEST_DAT, TEST_DAT])
+    assert len(queue.list('pending')) == 4
+    run(['rasqueue', '--work', '-j', '3', '--interval', '0.1', queue.path])
+    assert not queue.list('pending')
+    assert not queue.list('running')
+    assert not queue.list('failed')
+    done = [queue.read('done', name) for name in queue.list('done')]
+    assert len(done) == 4
+    assert sorted(task['channel'] for task in done) == [0, 0, 1, 1]
+    for channel in (0, 1):
+        for fmt in ('.png', '.csv'):
+            check_exists(
+                os.path.join(output_dir, 'out.%d%s' % (channel, fmt)), False)
+    out, err = run(['rasqueue', '--status', queue.path])
+    assert in_output(r'0 pending, 0 running, 4 done, 0 failed', out)
+
+def teardown():
+    for path in TEMP_DIRS:
+        shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,333 @@
+# vim: set et sw=4 sts=4:
+
+# Copyright 2012 Dave Hughes.
+#
+# This file is part of rastools.
+#
+# rastools is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# rastools is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# rastools.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests that rasdump's data writers match their original output
+
+The files in the baseline directory were written from test.dat by the
+original (row by row) writers, run in the same directory as test.dat (as
+RAS files record the name of their input). Timestamps, which RAS files take
+from the change time of a DAT input, are ignored in comparisons. Formats
+added since (which have no baseline) are read back and compared with the
+data instead.
+"""
+
+from __future__ import (
+    unicode_literals,
+    print_function,
+    absolute_import,
+    division,
+    )
+
+import io
+import os
+import re
+import csv
+import json
+import shutil
+import zipfile
+import tempfile
+from unittest import SkipTest
+from xml.etree import ElementTree
+
+import numpy as np
+
+from rastools.datparse import DatParser
+from utils import *
+
+
+BASELINE_PATH = os.path.join(THIS_PATH, 'baseline')
+TEMP_DIRS = []
+
+# Each case is the prefix of its baseline files, and rasdump's options
+CASES = [
+    ('plain', []),
+    ('empty', ['--empty']),
+    ('crop', ['--empty', '--crop', '1,2,3,4']),
+    ('pct', ['--percentile', '20-80']),
+    ('range', ['--range', '20-80']),
+    ('croppct', ['--percentile', '20-80', '--crop', '1,1,1,1']),
+    ]
+MULTI_CASES = [
+    ('multi', ['--empty']),
+    ('multiskip', []),
+    ('multicroppct', ['--empty', '--crop', '1,2,3,4', '--percentile', '10-90']),
+    ]
+FORMATS = ('.csv', '.tsv', '.dat', '.ras', '.ras_a')
+MULTI_FORMATS = ('.dat', '.ras')
+TIMESTAMP = re.compile(
+    br'[A-Z][a-z]{2} [A-Z][a-z]{2} [ 0-9][0-9] '
+    br'[0-9]{2}:[0-9]{2}:[0-9]{2} [0-9]{4}')
+
+
+def make_temp_dir():
+    path = tempfile.mkdtemp()
+    TEMP_DIRS.append(path)
+    shutil.copy(TEST_DAT, path)
+    return path
+
+def run_rasdump(path, options, output):
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        return run(['rasdump'] + options + ['--output', output, 'test.dat'])
+    finally:
+        os.chdir(cwd)
+
+def read_output(filename):
+    with io.open(filename, 'rb') as f:
+        return TIMESTAMP.sub(b'TIMESTAMP', f.read())
+
+def check_outputs(path, prefix, formats):
+    def outputs(path):
+        return sorted(
+            name for name in os.listdir(path)
+            if name.split('.')[0] == prefix and
+            os.path.splitext(name)[1] in formats)
+    expected = outputs(BASELINE_PATH)
+    produced = outputs(path)
+    assert expected
+    assert produced == expected
+    for name in expected:
+        assert read_output(os.path.join(path, name)) == read_output(
+            os.path.join(BASELINE_PATH, name))
+
+def test_writers():
+    path = make_temp_dir()
+    for fmt in FORMATS:
+        for prefix, options in CASES:
+            run_rasdump(path, options, prefix + '.{channel}' + fmt)
+    for prefix, options in CASES:
+        check_outputs(path, prefix, FORMATS)
+
+def test_multi_writers():
+    path = make_temp_dir()
+    for fmt in MULTI_FORMATS:
+        for prefix, options in MULTI_CASES:
+            run_rasdump(path, ['--multi'] + options, prefix + fmt)
+    for prefix, options in MULTI_CASES:
+        check_outputs(path, prefix, MULTI_FORMATS)
+
+def test_number_format():
+    # The output is what the csv module would write for the formatted values
+    path = make_temp_dir()
+    data = DatParser(TEST_DAT).channels[1].data
+    for index, number_format in enumerate(('%d', '%.2f', '%g')):
+        for fmt, dialect in (('.csv', 'excel'), ('.tsv', 'excel-tab')):
+            prefix = 'format%d' % index
+            run_rasdump(
+                path, ['--number-format', number_format],
+                prefix + '.{channel}' + fmt)
+            expected = io.StringIO(newline='')
+            writer = csv.writer(expected, dialect=dialect)
+            for row in data:
+                writer.writerow([number_format % value for value in row])
+            assert not os.path.exists(os.path.join(path, prefix + '.0' + fmt))
+            with io.open(
+                    os.path.join(path, prefix + '.1' + fmt), 'r',
+                    encoding='ascii', newline='') as f:
+                assert f.read() == expected.getvalue()
+
+def read_xlsx(filename):
+    "Returns a list of (name, rows) for each sheet of an .xlsx workbook"
+    ns = {
+        'm': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main',
+        }
+    def col_index(ref):
+        result = 0
+        for char in re.match(r'[A-Z]+', ref).group(0):
+            result = result * 26 + ord(char) - ord('A') + 1
+        return result - 1
+    result = []
+    with zipfile.ZipFile(filename) as archive:
+        workbook = ElementTree.fromstring(archive.read('xl/workbook.xml'))
+        sheets = workbook.findall('m:sheets/m:sheet', ns)
+        for number, sheet in enumerate(sheets, start=1):
+            root = ElementTree.fromstring(
+                archive.read('xl/worksheets/sheet%d.xml' % number))
+            rows = []
+            for row in root.findall('m:sheetData/m:row', ns):
+                assert int(row.get('r')) == len(rows) + 1
+                cells = row.findall('m:c', ns)
+                assert [col_index(c.get('r')) for c in cells] == list(
+                    range(len(cells)))
+                rows.append([float(c.find('m:v', ns).text) for c in cells])
+            result.append((sheet.get('name'), rows))
+    return result
+
+def test_xlsx_writers():
+    try:
+        from rastools.xlsxwrite import sheet_name
+    except ImportError:
+        raise SkipTest('xlsxwriter is not available')
+    path = make_temp_dir()
+    data_file = DatParser(TEST_DAT)
+    run_rasdump(path, ['--empty'], 'test.{channel}.xlsx')
+    run_rasdump(path, ['--empty', '--multi'], 'multi.xlsx')
+    run_rasdump(path, ['--empty', '--crop', '1,2,3,4'], 'crop.{channel}.xlsx')
+    for channel in data_file.channels:
+        sheets = read_xlsx(
+            os.path.join(path, 'test.%d.xlsx' % channel.index))
+        assert [name for (name, _) in sheets] == [
+            '%d - %s' % (channel.index, channel.name)]
+        assert np.array(sheets[0][1]).shape == (10, 10)
+        assert (np.array(sheets[0][1]) == channel.data).all()
+        sheets = read_xlsx(
+            os.path.join(path, 'crop.%d.xlsx' % channel.index))
+        assert (np.array(sheets[0][1]) == channel.data[1:7, 2:6]).all()
+    sheets = read_xlsx(os.path.join(path, 'multi.xlsx'))
+    assert [name for (name, _) in sheets] == ['0 - Zeros', '1 - Sequence']
+    for channel, (_, rows) in zip(data_file.channels, sheets):
+        assert (np.array(rows) == channel.data).all()
+    # Sheet names are made valid and unique (case-insensitively), and kept
+    # within Excel's limit of 31 characters
+    class Channel(object):
+        def __init__(self, name):
+            self.name = name
+        def format_dict(self):
+            return {'channel': 1, 'channel_name': self.name}
+    used = set()
+    assert sheet_name(Channel('a/b:c'), used) == '1 - a_b_c'
+    assert sheet_name(Channel('A/B:C'), used) == '1 - A_B_C (2)'
+    long_name = 'x' * 40
+    assert sheet_name(Channel(long_name), used) == '1 - ' + 'x' * 27
+    assert sheet_name(Channel(long_name), used) == '1 - ' + 'x' * 23 + ' (2)'
+
+def test_h5_writers():
+    try:
+        import h5py
+        from rastools.h5write import dataset_name
+    except ImportError:
+        raise SkipTest('h5py is not available')
+    def text(value):
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+    path = make_temp_dir()
+    data_file = DatParser(TEST_DAT)
+    run_rasdump(path, ['--empty'], 'test.{channel}.h5')
+    run_rasdump(path, ['--empty', '--multi'], 'multi.h5')
+    run_rasdump(path, ['--crop', '1,2,3,4'], 'crop.{channel}.nxs')
+    for channel in data_file.channels:
+        with h5py.File(
+                os.path.join(path, 'test.%d.h5' % channel.index), 'r') as f:
+            assert text(f.attrs['NX_class']) == 'NXroot'
+            assert text(f['entry'].attrs['NX_class']) == 'NXentry'
+            assert text(f['entry'].attrs['comments']) == 'TEST COMMENT'
+            group = f['entry/data']
+            assert text(group.attrs['NX_class']) == 'NXdata'
+            assert text(group.attrs['signal']) == dataset_name(channel)
+            assert 'auxiliary_signals' not in group.attrs
+            dataset = group[dataset_name(channel)]
+            assert dataset.shape == (10, 10)
+            assert dataset.compression == 'gzip'
+            assert (dataset[...] == channel.data).all()
+            assert dataset.attrs['channel'] == channel.index
+            assert text(dataset.attrs['channel_name']) == channel.name
+            assert (group['x'][...] == data_file.x_coords).all()
+            assert (group['y'][...] == data_file.y_coords).all()
+    assert not os.path.exists(os.path.join(path, 'crop.0.nxs'))
+    with h5py.File(os.path.join(path, 'crop.1.nxs'), 'r') as f:
+        group = f['entry/data']
+        assert (group['channel01_Sequence'][...] ==
+            data_file.channels[1].data[1:7, 2:6]).all()
+        # Cropped data falls back to indices for its coordinates
+        assert (group['x'][...] == np.arange(4)).all()
+        assert (group['y'][...] == np.arange(6)).all()
+    with h5py.File(os.path.join(path, 'multi.h5'), 'r') as f:
+        group = f['entry/data']
+        assert text(group.attrs['signal']) == 'channel00_Zeros'
+        assert [text(name) for name in group.attrs['auxiliary_signals']] == [
+            'channel01_Sequence']
+        for channel in data_file.channels:
+            assert (group[dataset_name(channel)][...] == channel.data).all()
+    # Dataset names are valid NeXus names
+    class Channel(object):
+        index = 3
+        name = 'Fe K-alpha (1)'
+    assert dataset_name(Channel()) == 'channel03_Fe_K_alpha__1_'
+
+def test_arrow_writers():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        from rastools import arrowwrite
+    except ImportError:
+        raise SkipTest('pyarrow is not available')
+    path = make_temp_dir()
+    data_file = DatParser(TEST_DAT)
+    zeros, sequence = data_file.channels
+    def read_table(filename):
+        if filename.endswith('.parquet'):
+            return pq.read_table(filename)
+        with pa.OSFile(filename, 'rb') as f:
+            return pa.ipc.open_file(f).read_all()
+    run_rasdump(path, [], 'test.{channel}.arrow')
+    run_rasdump(path, ['--empty', '--multi'], 'multi.parquet')
+    run_rasdump(path, ['--crop', '1,2,3,4'], 'crop.{channel}.feather')
+    assert not os.path.exists(os.path.join(path, 'test.0.arrow'))
+    table = read_table(os.path.join(path, 'test.1.arrow'))
+    assert table.column_names == ['x', 'y', 'Sequence']
+    assert table.num_rows == 100
+    assert (table.column('Sequence').to_numpy() ==
+        sequence.data.reshape(-1)).all()
+    assert (table.column('x').to_numpy() ==
+        np.tile(data_file.x_coords, 10)).all()
+    assert (table.column('y').to_numpy() ==
+        np.repeat(data_file.y_coords, 10)).all()
+    metadata = json.loads(table.schema.metadata[b'rastools'].decode('utf-8'))
+    assert metadata['comments'] == 'TEST COMMENT'
+    table = read_table(os.path.join(path, 'multi.parquet'))
+    assert table.column_names == ['x', 'y', 'Zeros', 'Sequence']
+    assert (table.column('Zeros').to_numpy() == 0).all()
+    assert (table.column('Sequence').to_numpy() ==
+        sequence.data.reshape(-1)).all()
+    table = read_table(os.path.join(path, 'crop.1.feather'))
+    assert table.num_rows == 24
+    assert (table.column('Sequence').to_numpy() ==
+        sequence.data[1:7, 2:6].reshape(-1)).all()
+    assert (table.column('x').to_numpy() == np.tile(np.arange(4), 6)).all()
+    assert (table.column('y').to_numpy() == np.repeat(np.arange(6), 4)).all()
+    # Batches (and Parquet row groups) consist of whole rows of the scan
+    batch_rows = arrowwrite.BATCH_ROWS
+    arrowwrite.BATCH_ROWS = 25
+    try:
+        filename = os.path.join(path, 'batches.parquet')
+        with arrowwrite.ParquetMultiWriter(filename, data_file) as writer:
+            writer.write_page(sequence.data, sequence)
+    finally:
+        arrowwrite.BATCH_ROWS = batch_rows
+    parquet = pq.ParquetFile(filename)
+    assert [parquet.metadata.row_group(i).num_rows
+        for i in range(parquet.num_row_groups)] == [20, 20, 20, 20, 20]
+    assert (parquet.read().column('Sequence').to_numpy() ==
+        sequence.data.reshape(-1)).all()
+    # Channels must all have the same shape
+    writer = arrowwrite.ArrowMultiWriter(
+        os.path.join(path, 'shape.arrow'), data_file)
+    writer.write_page(sequence.data, sequence)
+    try:
+        writer.write_page(sequence.data[1:], zeros)
+    except ValueError:
+        pass
+    else:
+        assert False, 'mismatched shapes accepted'
+    # Column names are unique, and distinct from the coordinates
+    assert arrowwrite.column_names(['x', 'Fe', 'Fe', 'Fe_2']) == [
+        'x_2', 'Fe', 'Fe_2', 'Fe_2_2']
+
+def teardown():
+    for path in TEMP_DIRS:
+        shutil.rmtree(path, ignore_errors=True)